@@ -0,0 +1,146 @@
+"""
+Synthetic SecureTrack, SecureChange and Orca data for the benchmark scenarios.
+The data only depends on the scenario parameters and the seed, so every run of a scenario sees the same data.
+"""
+import ipaddress
+import json
+import random
+from xml.sax.saxutils import escape
+
+GROUP_NAME = 'bench_group'
+WORKFLOW_NAME = 'Bench Workflow'
+STEP_NAME = 'Integrate'
+TICKET_ID = 1001
+XSI = 'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"'
+
+
+def _addresses(count, seed, first='10.0.0.1'):
+    """ Distinct host addresses in a random order."""
+    start = int(ipaddress.IPv4Address(first))
+    addresses = [str(ipaddress.IPv4Address(start + offset)) for offset in range(count)]
+    random.Random(seed).shuffle(addresses)
+    return addresses
+
+
+def _uid(device_id, index):
+    return '{{{:08x}-0000-4000-8000-{:012x}}}'.format(device_id, index)
+
+
+def _host_xml(device_id, index, ip):
+    return ('<network_object {} xsi:type="hostNetworkObjectDTO"><id>{index}</id><name>host_{ip}</name>'
+            '<display_name>host_{ip}</display_name><global>false</global><type>host</type><ip>{ip}</ip>'
+            '<device_id>{device_id}</device_id><comment/><implicit>false</implicit><uid>{uid}</uid>'
+            '</network_object>').format(XSI, index=index, ip=ip, device_id=device_id, uid=_uid(device_id, index))
+
+
+def _group_xml(device_id, group_id, member_indexes, addresses):
+    members = ''.join('<member><id>{}</id><name>host_{ip}</name><display_name>host_{ip}</display_name>'
+                      '<uid>{}</uid></member>'.format(index, _uid(device_id, index), ip=addresses[index])
+                      for index in member_indexes)
+    return ('<network_object {} xsi:type="networkObjectGroupDTO"><id>{}</id><name>{name}</name>'
+            '<display_name>{name}</display_name><global>false</global><type>group</type><device_id>{}</device_id>'
+            '<comment/><implicit>false</implicit><uid>{}</uid><members>{}</members></network_object>').format(
+        XSI, group_id, device_id, _uid(device_id, group_id), members, name=GROUP_NAME)
+
+
+class GroupFixture:
+    """
+    Devices that all have a group of group_size hosts, and Orca tasks whose destinations differ from the group
+    by the changed share: half of it is removed from the group, half is new addresses.
+    Half of the new addresses already have a host object on the devices.
+    """
+
+    def __init__(self, group_size=100, devices=1, changed=0.1, repeat_task=False, task_prefix='bench', seed=1):
+        self.group_size = int(group_size)
+        self.devices = int(devices)
+        self.repeat_task = repeat_task
+        self.task_prefix = task_prefix
+        changes = int(self.group_size * float(changed))
+        removed, added = changes // 2, changes - changes // 2
+        self.addresses = _addresses(self.group_size + added, seed)
+        members, new = self.addresses[:self.group_size], self.addresses[self.group_size:]
+        self.destinations = members[removed:] + new
+        # Objects 0..group_size-1 are the members, the next ones are existing objects for new addresses
+        self._object_count = self.group_size + len(new) // 2
+        self._task_number = 0
+
+    def device_ids(self):
+        return range(1, self.devices + 1)
+
+    def device_xml(self, device_id):
+        return ('<device><id>{0}</id><name>fw{0}</name><model>asa</model><vendor>Cisco</vendor>'
+                '<domain_id>1</domain_id><domain_name>Default</domain_name><offline>false</offline>'
+                '<topology>true</topology><ip>192.168.0.{0}</ip></device>').format(device_id)
+
+    def group_xml(self, device_id):
+        return _group_xml(device_id, self._object_count, range(self.group_size), self.addresses)
+
+    def network_objects_xml(self, device_id):
+        objects = [_host_xml(device_id, index, self.addresses[index]) for index in range(self._object_count)]
+        objects.append(self.group_xml(device_id))
+        return '<network_objects count="{0}" total="{0}">{1}</network_objects>'.format(len(objects), ''.join(objects))
+
+    def search_xml(self, name):
+        if name != GROUP_NAME:
+            return '<network_objects count="0" total="0"/>'
+        groups = [self.group_xml(device_id) for device_id in self.device_ids()]
+        return '<network_objects count="{0}" total="{0}">{1}</network_objects>'.format(len(groups), ''.join(groups))
+
+    def orca_task_json(self):
+        if not self.repeat_task:
+            self._task_number += 1
+        task = {
+            'id': '{}-{}'.format(self.task_prefix, self._task_number),
+            'groups': [{'name': GROUP_NAME, 'destinations': self.destinations}],
+        }
+        return json.dumps(task)
+
+
+class TicketFixture:
+    """
+    A ticket whose current step has a task with placeholders text fields, an 'Ids' field with the ids of the fan-out
+    endpoints and a 'Result' field for the response.
+    """
+
+    def __init__(self, placeholders=10, endpoints=1, value_size=32, seed=1):
+        self.placeholders = int(placeholders)
+        self.endpoints = int(endpoints)
+        rand = random.Random(seed)
+        alphabet = 'abcdefghijklmnopqrstuvwxyz0123456789'
+        self.values = [''.join(rand.choice(alphabet) for _ in range(int(value_size))) for _ in range(self.placeholders)]
+
+    def field_names(self):
+        return ['Field {}'.format(number) for number in range(1, self.placeholders + 1)]
+
+    def _text_field(self, field_id, name, value):
+        return '<field {} xsi:type="text_field"><id>{}</id><name>{}</name><text>{}</text></field>'.format(
+            XSI, field_id, escape(name), escape(value))
+
+    def ticket_xml(self):
+        fields = [self._text_field(100 + number, name, value)
+                  for number, (name, value) in enumerate(zip(self.field_names(), self.values))]
+        ids = ', '.join(str(number) for number in range(1, self.endpoints + 1))
+        fields.append(self._text_field(10, 'Ids', ids))
+        fields.append(self._text_field(11, 'Result', ''))
+        return (
+            '<ticket><id>{ticket_id}</id><subject>Benchmark</subject><requester>bench</requester>'
+            '<requester_id>1</requester_id><priority>Normal</priority><status>In Progress</status>'
+            '<domain_name/><sla_status>NA</sla_status><sla_outcome>NA</sla_outcome>'
+            '<workflow><id>1</id><name>{workflow}</name><uses_topology>false</uses_topology></workflow>'
+            '<steps>'
+            '<step><id>1</id><name>Submit</name><redone>false</redone><skipped>false</skipped><tasks>'
+            '<task><id>1</id><assignee_id>1</assignee_id><assignee>bench</assignee><status>DONE</status>'
+            '<name>Default</name><fields/></task></tasks></step>'
+            '<step><id>2</id><name>{step}</name><redone>false</redone><skipped>false</skipped><tasks>'
+            '<task><id>2</id><assignee_id>1</assignee_id><assignee>bench</assignee><status>ASSIGNED</status>'
+            '<name>Default</name><fields>{fields}</fields></task></tasks></step>'
+            '</steps>'
+            '<current_step><id>2</id><name>{step}</name></current_step><comments/></ticket>'
+        ).format(ticket_id=TICKET_ID, workflow=escape(WORKFLOW_NAME), step=escape(STEP_NAME), fields=''.join(fields))
+
+    def request_template(self):
+        return json.dumps({name.replace(' ', '_').lower(): '#{}#'.format(name) for name in self.field_names()})
+
+    @staticmethod
+    def response_template():
+        return json.dumps({'result': '#Result#'})
@@ -0,0 +1,286 @@
+#!/usr/local/orca/python/bin/python3
+"""
+Run the benchmark scenarios against local stub services and compare the results with a stored baseline.
+
+Every scenario is run once to warm up, then timed for a number of iterations and run once more under tracemalloc
+for the peak memory. The median wall time and CPU time of an iteration, the peak memory, the requests the stubs
+served per iteration and the errors logged are reported.
+"""
+import argparse
+import fnmatch
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path[:0] = [BENCHMARKS_DIR, os.path.join(REPO_DIR, 'orca', 'lib'), os.path.join(REPO_DIR, 'orca', 'bin')]
+
+import urllib3
+
+from scenarios import SCENARIOS, build_iteration, stub_params
+from stub_servers import StubServers, create_certificate, ORCA_GROUP_PATH, ORCA_UPDATE_PATH
+
+BASELINE_VERSION = 1
+DEFAULT_BASELINE_PATH = os.path.join(BENCHMARKS_DIR, 'baseline.json')
+DEFAULT_TOLERANCE = 0.25
+METRICS = ('wall_ms', 'cpu_ms', 'peak_kib')
+SECURE_STORE_KEYS = ('securetrack', 'securechange', 'securechangeworkflow', 'rest_integration')
+
+CONF_TEMPLATE = """
+[integration setup]
+hostname = {orca_host}
+group_path_url = {group_path}
+orca_update_task_url = {update_path}
+change_group_ticket_template_path = {ticket_template}
+templates_root_dir = {templates_dir}
+task_ledger_path = {work_dir}/task_ledger.db
+# Every iteration measures a full cycle, including the SecureTrack object lookups
+object_index_max_age = 0
+
+[rest_integration]
+plugins_root_dir = {work_dir}/plugins
+queue_path = {work_dir}/trigger_queue.db
+
+[common]
+log_file_path = {work_dir}
+
+[log_levels]
+common = WARNING
+third_party = WARNING
+
+[securechange]
+host = {sc_host}
+
+[securetrack]
+host = {st_host}
+"""
+
+
+class ErrorCounter(logging.Handler):
+    """ Count the errors logged while a scenario runs, a scenario that logs errors measures a failure path."""
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.count = 0
+        self.first = None
+
+    def emit(self, record):
+        self.count += 1
+        if self.first is None:
+            self.first = self.format(record)
+
+
+def get_cli_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('scenarios', nargs='*', default=['*'],
+                        help='Names or patterns of the scenarios to run, all by default')
+    parser.add_argument('-i', '--iterations', type=int, default=5, help='Timed iterations of every scenario')
+    parser.add_argument('-l', '--latency', type=float, default=0.0,
+                        help='Milliseconds the stub services wait before answering a request')
+    parser.add_argument('--set', action='append', default=[], metavar='PARAM=VALUE',
+                        help='Override a parameter of the selected scenarios that have it, e.g. group_size=20000')
+    parser.add_argument('--list', action='store_true', help='List the scenarios and exit')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    parser.add_argument('--save-baseline', nargs='?', const=DEFAULT_BASELINE_PATH, metavar='PATH',
+                        help='Save the results as the baseline, {} by default'.format(
+                            os.path.relpath(DEFAULT_BASELINE_PATH)))
+    parser.add_argument('--baseline', nargs='?', const=DEFAULT_BASELINE_PATH, metavar='PATH',
+                        help='Compare the results with a baseline, exit with status 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='Allowed relative increase of time and memory over the baseline')
+    parser.add_argument('--keep-work-dir', action='store_true', help='Keep the configuration and databases')
+    return parser.parse_args()
+
+
+def parse_overrides(overrides):
+    params = {}
+    for override in overrides:
+        name, _, value = override.partition('=')
+        try:
+            params[name.strip()] = json.loads(value)
+        except ValueError:
+            params[name.strip()] = value
+    return params
+
+
+def select_scenarios(patterns, overrides):
+    selected = [scenario for scenario in SCENARIOS
+                if any(fnmatch.fnmatch(scenario.name, pattern) for pattern in patterns)]
+    if not selected:
+        raise SystemExit("No scenario matches '{}'".format(' '.join(patterns)))
+    return [scenario._replace(params=dict(scenario.params, **{name: value for name, value in overrides.items()
+                                                               if name in scenario.params}))
+            for scenario in selected]
+
+
+def prepare_environment(work_dir, stubs):
+    """
+    Write the configuration and the secure store of the benchmark and point the scripts at them.
+    Must be called before the scripts are imported, they read the configuration on import.
+    """
+    templates_dir = os.path.join(work_dir, 'templates')
+    os.makedirs(templates_dir)
+    conf_path = os.path.join(work_dir, 'custom.conf')
+    with open(conf_path, 'w') as conf_file:
+        conf_file.write(CONF_TEMPLATE.format(
+            orca_host=stubs.host('orca'), sc_host=stubs.host('securechange'), st_host=stubs.host('securetrack'),
+            group_path=ORCA_GROUP_PATH, update_path=ORCA_UPDATE_PATH,
+            ticket_template=os.path.join(REPO_DIR, 'orca', 'templates', 'group_change_ticket_template.xml'),
+            templates_dir=templates_dir, work_dir=work_dir))
+
+    from common import context
+    from common.secret_store import Secret_Store_Helper
+    context.CONF_FILE_PATH = conf_path
+    Secret_Store_Helper.PASSPHRASE_FILE = os.path.join(work_dir, 'secret.passphrase')
+    Secret_Store_Helper.SECRETSDB_FILE = os.path.join(work_dir, 'secret.db')
+    secret_store = context.get_secret_store()
+    with secret_store.transaction():
+        for key in SECURE_STORE_KEYS:
+            secret_store.set_username(key, 'bench')
+            secret_store.set_password(key, 'bench')
+        secret_store.set_password('auth_header_integration', 'Bearer bench')
+    return templates_dir
+
+
+def run_scenario(scenario, stubs, templates_dir, iterations, latency):
+    stubs.configure(stub_params(scenario), latency=latency)
+    iteration = build_iteration(scenario, templates_dir)
+    errors = ErrorCounter()
+    logging.getLogger().addHandler(errors)
+    try:
+        iteration()
+        stubs.reset()
+        walls, cpus = [], []
+        for _ in range(iterations):
+            wall_start, cpu_start = time.perf_counter(), time.process_time()
+            iteration()
+            walls.append(time.perf_counter() - wall_start)
+            cpus.append(time.process_time() - cpu_start)
+        stats = stubs.stats()
+        tracemalloc.start()
+        try:
+            iteration()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    finally:
+        logging.getLogger().removeHandler(errors)
+
+    requests = {'{} {}'.format(service, route): count / iterations
+                for service, routes in sorted(stats.items()) for route, count in sorted(routes.items())}
+    return {
+        'params': scenario.params,
+        'wall_ms': round(statistics.median(walls) * 1000, 3),
+        'cpu_ms': round(statistics.median(cpus) * 1000, 3),
+        'peak_kib': round(peak / 1024, 1),
+        'requests': round(sum(requests.values()), 2),
+        'requests_by_route': requests,
+        'errors': errors.count,
+        'first_error': errors.first,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    :return: dict of scenario name to a list of (metric, baseline value, change text, regressed)
+    """
+    comparison = {}
+    for name, result in results.items():
+        base = baseline.get('scenarios', {}).get(name)
+        if base is None:
+            continue
+        if base['params'] != result['params']:
+            comparison[name] = [('params', None, 'differ from the baseline, not compared', False)]
+            continue
+        rows = []
+        for metric in METRICS:
+            change = (result[metric] - base[metric]) / base[metric] if base[metric] else 0.0
+            rows.append((metric, base[metric], '{:+.1%}'.format(change), change > tolerance))
+        rows.append(('requests', base['requests'], '{:+g}'.format(result['requests'] - base['requests']),
+                     result['requests'] > base['requests']))
+        comparison[name] = rows
+    return comparison
+
+
+def print_report(results, comparison):
+    header = '{:<22} {:>11} {:>11} {:>11} {:>9} {:>7}'.format(
+        'scenario', 'wall ms', 'cpu ms', 'peak KiB', 'requests', 'errors')
+    print(header)
+    print('-' * len(header))
+    for name, result in results.items():
+        print('{:<22} {:>11.1f} {:>11.1f} {:>11.1f} {:>9g} {:>7}'.format(
+            name, result['wall_ms'], result['cpu_ms'], result['peak_kib'], result['requests'], result['errors']))
+        if result['errors']:
+            print('    first error: {}'.format(result['first_error']))
+        for metric, base_value, change, regressed in comparison.get(name, ()):
+            if base_value is None:
+                print('    {} {}'.format(metric, change))
+            else:
+                print('    {:<9} baseline {:>11g} {:>9}{}'.format(metric, base_value, change,
+                                                                 '  REGRESSION' if regressed else ''))
+
+
+def main():
+    cli_args = get_cli_args()
+    if cli_args.list:
+        for scenario in SCENARIOS:
+            print('{:<22} {:<5} {:<60} {}'.format(scenario.name, scenario.kind, scenario.description,
+                                                   json.dumps(scenario.params)))
+        return 0
+    scenarios = select_scenarios(cli_args.scenarios, parse_overrides(cli_args.set))
+    baseline = None
+    if cli_args.baseline:
+        with open(cli_args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s %(name)s: %(message)s')
+    urllib3.disable_warnings()
+    work_dir = tempfile.mkdtemp(prefix='orca-bench-')
+    results = {}
+    with StubServers(*create_certificate(work_dir)) as stubs:
+        templates_dir = prepare_environment(work_dir, stubs)
+        for scenario in scenarios:
+            print('Running {} ...'.format(scenario.name), file=sys.stderr)
+            results[scenario.name] = run_scenario(scenario, stubs, templates_dir, cli_args.iterations,
+                                                  cli_args.latency / 1000)
+    if cli_args.keep_work_dir:
+        print('Work directory: {}'.format(work_dir), file=sys.stderr)
+    else:
+        import shutil
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    comparison = compare(results, baseline, cli_args.tolerance) if baseline else {}
+    print_report(results, comparison)
+
+    document = {
+        'version': BASELINE_VERSION,
+        'python': platform.python_version(),
+        'iterations': cli_args.iterations,
+        'latency_ms': cli_args.latency,
+        'scenarios': results,
+    }
+    if cli_args.output:
+        with open(cli_args.output, 'w') as output_file:
+            json.dump(document, output_file, indent=2, sort_keys=True)
+    if cli_args.save_baseline:
+        if os.path.exists(cli_args.save_baseline):
+            # Keep the scenarios that were not run in this invocation
+            with open(cli_args.save_baseline) as baseline_file:
+                document['scenarios'] = dict(json.load(baseline_file).get('scenarios', {}), **results)
+        with open(cli_args.save_baseline, 'w') as baseline_file:
+            json.dump(document, baseline_file, indent=2, sort_keys=True)
+        print('Baseline saved to {}'.format(cli_args.save_baseline), file=sys.stderr)
+    if any(regressed for rows in comparison.values() for _, _, _, regressed in rows):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
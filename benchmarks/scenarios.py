@@ -0,0 +1,104 @@
+"""
+Benchmark scenarios of the two hot paths: an Orca task handled by orca_group_change (monitor_loop and
+get_edited_groups), and a ticket step handled by JsonTemplateClient.run of the REST integration.
+"""
+import os
+from collections import namedtuple
+
+from fixtures import TicketFixture, TICKET_ID, WORKFLOW_NAME, STEP_NAME
+
+GROUP = 'group'
+REST = 'rest'
+
+Scenario = namedtuple('Scenario', ['name', 'kind', 'params', 'description'])
+
+SCENARIOS = [
+    Scenario('group-small', GROUP, {'group_size': 50, 'devices': 1, 'changed': 0.1},
+             'Small group on one device'),
+    Scenario('group-large', GROUP, {'group_size': 5000, 'devices': 1, 'changed': 0.1},
+             'Large group on one device'),
+    Scenario('group-huge', GROUP, {'group_size': 20000, 'devices': 1, 'changed': 0.05},
+             'Group of 20,000 members'),
+    Scenario('group-devices', GROUP, {'group_size': 500, 'devices': 10, 'changed': 0.1},
+             'Group on ten devices'),
+    Scenario('group-unchanged', GROUP, {'group_size': 5000, 'devices': 1, 'changed': 0},
+             'Large group that already matches the destinations'),
+    Scenario('group-repeated-task', GROUP, {'group_size': 5000, 'devices': 1, 'changed': 0.1, 'repeat_task': True},
+             'The same Orca task returned on every poll'),
+    Scenario('rest-small', REST, {'placeholders': 5, 'endpoints': 1},
+             'Few placeholders, single endpoint'),
+    Scenario('rest-placeholders', REST, {'placeholders': 200, 'endpoints': 1},
+             'Many placeholders, single endpoint'),
+    Scenario('rest-fanout', REST, {'placeholders': 20, 'endpoints': 16},
+             'Request sent to 16 endpoints'),
+]
+
+
+def get_scenario(name):
+    for scenario in SCENARIOS:
+        if scenario.name == name:
+            return scenario
+    raise KeyError("Unknown scenario '{}'".format(name))
+
+
+def stub_params(scenario):
+    """ The fixture parameters of the stub services for a scenario."""
+    params = dict(scenario.params)
+    if scenario.kind == GROUP:
+        # Orca task ids are unique per scenario so the task ledger of one scenario does not apply to another
+        params['task_prefix'] = scenario.name
+        return {'group': params}
+    return {'ticket': params}
+
+
+def group_iteration(scenario):
+    """
+    :return: A function that handles one Orca poll the way monitor_loop does
+    """
+    import orca_group_change
+
+    source = orca_group_change.get_sources()[0]
+
+    def iteration():
+        orca_response = source.orca_client.get_group_memebers()
+        orca_group_change.handle_orca_response(source, orca_response)
+
+    return iteration
+
+
+def rest_iteration(scenario, templates_dir):
+    """
+    :return: A function that handles one ticket step the way rest_integration does
+    """
+    from common.context import get_sc_helper
+    from common.third_party.generic.rest.template_client import JsonTemplateClient
+
+    fixture = TicketFixture(**scenario.params)
+    request_template_name = 'bench_request_{}.json'.format(scenario.name)
+    response_template_name = 'bench_response.json'
+    with open(os.path.join(templates_dir, request_template_name), 'w') as template_file:
+        template_file.write(fixture.request_template())
+    with open(os.path.join(templates_dir, response_template_name), 'w') as template_file:
+        template_file.write(fixture.response_template())
+
+    sc_helper = get_sc_helper('securechange')
+    client = JsonTemplateClient.from_conf(sc_helper, 'bench')
+    step_config = {
+        'endpoint': '/api/items/#Ids#',
+        'http_method': 'post',
+        'request_template_name': request_template_name,
+        'response_template_name': response_template_name,
+        'section_name': 'integration {}-{}'.format(WORKFLOW_NAME, STEP_NAME),
+    }
+
+    def iteration():
+        ticket = sc_helper.get_ticket_by_id(TICKET_ID)
+        client.run(ticket, **step_config)
+
+    return iteration
+
+
+def build_iteration(scenario, templates_dir):
+    if scenario.kind == GROUP:
+        return group_iteration(scenario)
+    return rest_iteration(scenario, templates_dir)
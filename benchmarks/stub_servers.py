@@ -0,0 +1,279 @@
+"""
+Local HTTPS stand-ins for SecureTrack, SecureChange and Orca, which is also the REST integration endpoint.
+Every service listens on its own port so connection pooling behaves as with real hosts, answers with the fixtures
+of the current scenario after a configurable latency and counts the requests it served.
+"""
+import json
+import multiprocessing
+import os
+import re
+import ssl
+import subprocess
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlsplit, parse_qs
+
+import requests
+
+from fixtures import GroupFixture, TicketFixture, TICKET_ID
+
+ORCA_GROUP_PATH = '/bridge/bench/connections'
+ORCA_UPDATE_PATH = '/bridge/bench/tickets'
+STATS_PATH = '/__stats'
+RESET_PATH = '/__reset'
+CONFIGURE_PATH = '/__configure'
+
+
+def create_certificate(directory):
+    """
+    Create a self signed certificate for the stub services with the openssl command.
+    :return: (certfile, keyfile)
+    """
+    certfile, keyfile = os.path.join(directory, 'stub.crt'), os.path.join(directory, 'stub.key')
+    subprocess.check_call(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                           '-subj', '/CN=127.0.0.1', '-keyout', keyfile, '-out', certfile],
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return certfile, keyfile
+
+
+class StubService:
+    """ Base of the stub services, subclasses map (method, path) to a response in handle()."""
+    name = None
+
+    def __init__(self):
+        self.requests = Counter()
+        self._lock = threading.Lock()
+        self.configure({})
+
+    def configure(self, params):
+        """ Switch to the fixtures of a scenario."""
+
+    def count(self, route):
+        with self._lock:
+            self.requests[route] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self.requests)
+
+    def reset(self):
+        with self._lock:
+            self.requests.clear()
+
+    def handle(self, method, path, query, body):
+        """
+        :return: (status code, content type, body, extra headers dict)
+        """
+        raise NotImplementedError
+
+
+class SecureTrackStub(StubService):
+    name = 'securetrack'
+    _device_objects = re.compile(r'^/securetrack/api/devices/(\d+)/network_objects/?$')
+    _device = re.compile(r'^/securetrack/api/devices/(\d+)$')
+
+    def configure(self, params):
+        self.fixture = GroupFixture(**params.get('group', {}))
+        self._objects_xml = {}
+
+    def handle(self, method, path, query, body):
+        if path == '/securetrack/api/network_objects/search':
+            self.count('GET network_objects/search')
+            name = query.get('name', [''])[0]
+            return 200, 'application/xml', self.fixture.search_xml(name), {}
+        match = self._device_objects.match(path)
+        if match:
+            self.count('GET devices/{id}/network_objects')
+            device_id = int(match.group(1))
+            if device_id not in self._objects_xml:
+                self._objects_xml[device_id] = self.fixture.network_objects_xml(device_id)
+            return 200, 'application/xml', self._objects_xml[device_id], {}
+        match = self._device.match(path)
+        if match:
+            self.count('GET devices/{id}')
+            return 200, 'application/xml', self.fixture.device_xml(int(match.group(1))), {}
+        return None
+
+
+class SecureChangeStub(StubService):
+    name = 'securechange'
+    _tickets = '/securechangeworkflow/api/securechange/tickets'
+
+    def configure(self, params):
+        self.fixture = TicketFixture(**params.get('ticket', {}))
+        self._ticket_number = TICKET_ID
+
+    def handle(self, method, path, query, body):
+        if method == 'POST' and path.rstrip('/') == self._tickets:
+            self.count('POST tickets')
+            with self._lock:
+                self._ticket_number += 1
+                ticket_id = self._ticket_number
+            location = 'https://localhost{}/{}'.format(self._tickets, ticket_id)
+            return 201, 'application/xml', '', {'Location': location}
+        if method == 'GET' and path == '{}/{}/steps/current'.format(self._tickets, TICKET_ID):
+            self.count('GET tickets/{id}/steps/current')
+            return 200, 'application/xml', '<step><tasks><task><status>ASSIGNED</status></task></tasks></step>', {}
+        if method == 'GET' and path == '{}/{}'.format(self._tickets, TICKET_ID):
+            self.count('GET tickets/{id}')
+            return 200, 'application/xml', self.fixture.ticket_xml(), {}
+        if method == 'PUT' and path.startswith('{}/{}/steps/'.format(self._tickets, TICKET_ID)):
+            self.count('PUT tickets/{id}/steps/{id}/tasks/{id}' + ('/fields/{id}' if '/fields/' in path else ''))
+            return 200, 'application/xml', '', {}
+        return None
+
+
+class OrcaStub(StubService):
+    """ Orca tasks and task updates, any other POST or PUT is answered as a REST integration endpoint."""
+    name = 'orca'
+
+    def configure(self, params):
+        self.fixture = GroupFixture(**params.get('group', {}))
+
+    def handle(self, method, path, query, body):
+        if method == 'GET' and path == ORCA_GROUP_PATH:
+            self.count('GET connections')
+            with self._lock:
+                task = self.fixture.orca_task_json()
+            return 200, 'application/json', task, {}
+        if method == 'POST' and path == ORCA_UPDATE_PATH:
+            self.count('POST tickets')
+            return 200, 'application/json', '{}', {}
+        if method in ('POST', 'PUT'):
+            self.count('{} {}'.format(method, re.sub(r'/\d+$', '/{id}', path)))
+            return 200, 'application/json', json.dumps({'result': 'ok {}'.format(path)}), {}
+        return None
+
+
+SERVICES = (SecureTrackStub, SecureChangeStub, OrcaStub)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _handle(self):
+        service = self.server.service
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        url = urlsplit(self.path)
+        if url.path == STATS_PATH:
+            response = 200, 'application/json', json.dumps(service.stats()), {}
+        elif url.path == RESET_PATH:
+            service.reset()
+            response = 200, 'application/json', '{}', {}
+        elif url.path == CONFIGURE_PATH:
+            params = json.loads(body.decode('utf-8'))
+            self.server.latency = float(params.get('latency', 0))
+            service.configure(params)
+            service.reset()
+            response = 200, 'application/json', '{}', {}
+        else:
+            if self.server.latency:
+                time.sleep(self.server.latency)
+            response = service.handle(self.command, url.path, parse_qs(url.query), body)
+            if response is None:
+                service.count('unexpected {} {}'.format(self.command, url.path))
+                response = 404, 'text/plain', 'Not found', {}
+        status, content_type, content, headers = response
+        content = content.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def _serve(certfile, keyfile, ports_queue, stop_event):
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(certfile, keyfile)
+    ports = {}
+    for service_class in SERVICES:
+        server = _ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+        server.service = service_class()
+        server.latency = 0.0
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        ports[service_class.name] = server.server_address[1]
+    ports_queue.put(ports)
+    stop_event.wait()
+
+
+class StubServers:
+    """
+    Run the stub services in a child process, so they do not add to the CPU time and memory measured in the
+    benchmark process.
+    """
+
+    def __init__(self, certfile, keyfile):
+        self.certfile = certfile
+        self.keyfile = keyfile
+        self.ports = None
+        self._process = None
+        self._stop_event = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        ports_queue = multiprocessing.Queue()
+        self._stop_event = multiprocessing.Event()
+        self._process = multiprocessing.Process(
+            target=_serve, args=(self.certfile, self.keyfile, ports_queue, self._stop_event), daemon=True)
+        self._process.start()
+        self.ports = ports_queue.get(timeout=30)
+
+    def stop(self):
+        if self._process is not None:
+            self._stop_event.set()
+            self._process.join(timeout=5)
+            if self._process.is_alive():
+                self._process.terminate()
+            self._process = None
+
+    def host(self, service):
+        return '127.0.0.1:{}'.format(self.ports[service])
+
+    def _admin(self, method, path, body=None):
+        results = {}
+        for service, port in self.ports.items():
+            response = requests.request(method, 'https://127.0.0.1:{}{}'.format(port, path), data=body,
+                                        verify=False, timeout=30)
+            response.raise_for_status()
+            results[service] = response.json()
+        return results
+
+    def configure(self, params, latency=0.0):
+        """
+        Switch all the services to the fixtures of a scenario and reset their request counts.
+        :param params: dict with the GroupFixture parameters under 'group' and the TicketFixture ones under 'ticket'
+        :param latency: Seconds to wait before answering a request
+        """
+        params = dict(params, latency=latency)
+        self._admin('POST', CONFIGURE_PATH, json.dumps(params))
+
+    def stats(self):
+        """
+        :return: dict of service name to a dict of route to the number of requests served since the last reset
+        """
+        return self._admin('GET', STATS_PATH)
+
+    def reset(self):
+        self._admin('POST', RESET_PATH)
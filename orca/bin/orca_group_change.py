@@ -1,56 +1,82 @@
 #!/usr/local/orca/python/bin/python3
 
 import argparse
+import copy
 import enum
+import functools
 import io
 import ipaddress
 import logging
-import socket
-import struct
+import os
+import re
 import sys
+import threading
 import time
 import traceback
 import daemonize
 import json
+import queue
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 sys.path.append('/usr/local/orca/lib')
-from pytos.common import exceptions
 from pytos.common.logging.logger import setup_loggers
 from pytos.common.logging.definitions import COMMON_LOGGER_NAME
-from pytos.common.functions.config import Secure_Config_Parser
-from pytos.securetrack.helpers import Secure_Track_Helper
-from pytos.securechange.helpers import Secure_Change_Helper
+from pytos.common.functions import str_to_bool
 from pytos.common.definitions.xml_tags import Attributes
-from pytos.common.rest_requests import POST_Request, GET_Request
 from pytos.securetrack.xml_objects.rest.rules import Group_Network_Object, Subnet_Network_Object, \
     Host_Network_Object, Range_Network_Object
 from pytos.securechange.xml_objects.rest import Ticket, Group_Change_Node, Elements, XML_List, \
     Group_Change_Member_Object, TYPE_HOST
-from common.secret_store import SecretDb
+from common import metrics
+from common.context import get_conf, get_secret_store, get_sc_helper, get_st_helper
+from common.st_object_index import get_object_index, address_key
+from common.group_diff import MembershipDiff
+from common.dns_resolver import DnsResolver
+from common.http_pool import get_session_pool, DEFAULT_MAX_CONNECTIONS_PER_HOST
+from common.http_policy import get_http_policy
+from common.task_ledger import TaskLedger, DEFAULT_LEDGER_PATH, destinations_hash
+from common.profiling import Profiler
+from common.orca_push import OrcaPushListener, AdaptivePollInterval, DEFAULT_PUSH_PORT, DEFAULT_PUSH_PATH, \
+    DEFAULT_PUSH_BIND_ADDRESS
 
 logger = logging.getLogger(COMMON_LOGGER_NAME)
-conf = Secure_Config_Parser(config_file_path="/usr/local/orca/conf/custom.conf")
-secret_helper = SecretDb()
-st_cred = (secret_helper.get_username('securetrack'), secret_helper.get_password('securetrack'))
-sc_cred = (secret_helper.get_username('securechange'), secret_helper.get_password('securechange'))
-sc_host = conf.get("securechange", "host")
-st_host = conf.get("securetrack", "host")
-sc_helper = Secure_Change_Helper(sc_host, sc_cred)
-st_helper = Secure_Track_Helper(st_host, st_cred)
-
-orca_host = conf.get("integration setup", "hostname")
-ticket_template_path = conf.get("integration setup", "change_group_ticket_template_path")
-group_path_url = conf.get("integration setup", "group_path_url")
-orca_update_task_url = conf.get("integration setup", "orca_update_task_url")
+conf = get_conf()
+secret_helper = get_secret_store()
 
+SETUP_SECTION_NAME = "integration setup"
+SOURCE_SECTION_PREFIX = "orca source "
+DEFAULT_SOURCE_NAME = "default"
 PID_FILE = '/var/run/orca_group_change.pid'
 CHANGE_ADDED_STATUS = "ADDED"
 CHANGE_CREATE_STATUS = "CREATE"
 NOT_CHANGE_STATUS = "NOT_CHANGED"
 AUTH_TOKEN_KEY = 'auth_header_integration'
+PUSH_TOKEN_KEY = 'orca_push'
 SUPPORTED_MODELS = ['Panorama_device_group', 'cp_domain_r80plus', 'asa', 'junos', 'fmg_adom']
-ORCA_TOKEN = secret_helper.get_password(AUTH_TOKEN_KEY)
 DEFAULT_POOL_INTERVAL = 60
+DEFAULT_POLL_MIN_INTERVAL = 10
+DEFAULT_POLL_MAX_INTERVAL = 600
+GROUP_WORKERS = int(conf.get("integration setup", "group_workers", default_value=4))
+MAX_CONCURRENT_TICKET_POSTS = int(conf.get("integration setup", "max_concurrent_ticket_posts", default_value=2))
+DEFAULT_OBJECT_INDEX_MAX_AGE = 0
+dns_resolver = DnsResolver.from_conf(conf)
+_ticket_post_semaphores = {}
+_ticket_post_semaphores_lock = threading.Lock()
+_ticket_templates = {}
+_ticket_template_lock = threading.Lock()
+DEFAULT_LEDGER_MAX_AGE = 30 * 24 * 60 * 60
+LEDGER_PRUNE_INTERVAL = 60 * 60
+PHASE_HISTOGRAM = 'orca_phase_duration_seconds'
+PHASE_ERRORS_COUNTER = 'orca_phase_errors_total'
+GROUPS_COUNTER = 'orca_groups_total'
+metrics.describe(PHASE_HISTOGRAM, "Seconds spent in each phase of handling Orca tasks")
+metrics.describe(PHASE_ERRORS_COUNTER, "Phases of handling Orca tasks that failed with an error")
+metrics.describe(GROUPS_COUNTER, "Groups of Orca tasks by source and reported status, resent is 'true' for ledger hits")
+
+
+def phase(name):
+    """ Time a phase of handling Orca tasks, e.g. with phase('orca_poll'): ..."""
+    return metrics.timed(PHASE_HISTOGRAM, PHASE_ERRORS_COUNTER, phase=name)
 
 
 class OrcaStatuses(enum.Enum):
@@ -61,12 +87,15 @@ class OrcaStatuses(enum.Enum):
 
 
 class OrcaClient:
-    def __init__(self, host, url_path, username=None, password=None):
+    def __init__(self, host, url_path, username=None, password=None, session_pool=None, policy=None,
+                 auth_token=None):
         self.host = host
         self.url_path = url_path
         self.login_data = self.get_login_data(username, password)
         self.headers = {"Content-Type": "application/json",
-                        'Authorization': ORCA_TOKEN}
+                        'Authorization': auth_token or secret_helper.get_password(AUTH_TOKEN_KEY)}
+        self.session_pool = session_pool or get_session_pool()
+        self.policy = policy or get_http_policy(conf)
 
     def get_login_data(self, username, password):
         login_data = {'username': username, 'password': password} if all((username, password)) else None
@@ -75,10 +104,12 @@ class OrcaClient:
     def get_group_memebers(self):
         logger.debug("Getting group name and members")
         try:
-            response = GET_Request(self.host, self.url_path, headers=self.headers,
-                                   expected_status_codes=200, verify_ssl=False,
-                                   login_data=self.login_data).response.content.decode('utf-8')
-        except (ValueError, IOError, exceptions.REST_HTTP_Exception) as error:
+            with phase('orca_poll'):
+                response = self.session_pool.request('get', self.host, self.url_path, headers=self.headers,
+                                                     expected_status_codes=200, verify_ssl=False,
+                                                     login_data=self.login_data,
+                                                     policy=self.policy).content.decode('utf-8')
+        except (ValueError, IOError) as error:
             msg = "Failed to get new tickets from orca. Error: {}".format(error)
             logger.error(msg)
             raise IOError
@@ -97,22 +128,118 @@ class OrcaClient:
                 "name": group_name,
                 "url": sc_url
             }
-            response = POST_Request(self.host, url_path, headers=self.headers, body=json.dumps(body),
-                                    expected_status_codes=[200, 201, 204], verify_ssl=False,
-                                    login_data=self.login_data).response.content.decode('utf-8')
+            with phase('orca_status_update'):
+                response = self.session_pool.request('post', self.host, url_path, headers=self.headers,
+                                                     body=json.dumps(body), expected_status_codes=[200, 201, 204],
+                                                     verify_ssl=False, login_data=self.login_data,
+                                                     policy=self.policy).content.decode('utf-8')
             logger.debug("Got response: {}".format(response))
-        except (ValueError, IOError, exceptions.REST_HTTP_Exception) as error:
+        except (ValueError, IOError) as error:
             msg = "Failed to update ticket {} on Orca as updated. Error: {}".format(uuid, error)
             logger.error(msg)
             raise IOError
 
 
+def get_ticket_post_semaphore(sc_host):
+    """ The tickets submitted to a SecureChange are limited by max_concurrent_ticket_posts for all the sources."""
+    with _ticket_post_semaphores_lock:
+        return _ticket_post_semaphores.setdefault(sc_host, threading.BoundedSemaphore(MAX_CONCURRENT_TICKET_POSTS))
+
+
+class OrcaSource:
+    """
+    An Orca endpoint and the SecureTrack and SecureChange whose groups it changes, read from an
+    [orca source <name>] section. Options missing from the section are read from the [integration setup] section.
+    Sources that use the same SecureTrack or SecureChange host and secure store key share its helper and sessions.
+    """
+
+    def __init__(self, name, section=SETUP_SECTION_NAME, sleep_time=DEFAULT_POOL_INTERVAL, push=False):
+        """
+        :param sleep_time: Polling interval, unless an [orca source] section sets poll_interval
+        :param push: Whether tasks are pushed, unless an [orca source] section sets push_enabled
+        """
+        self.name = name
+        self.section = section
+        self.orca_host = self.get("hostname")
+        self.group_path_url = self.get("group_path_url")
+        self.orca_update_task_url = self.get("orca_update_task_url")
+        self.ticket_template_path = self.get("change_group_ticket_template_path")
+        self.sc_host = self.get("securechange_host", conf.get("securechange", "host"))
+        self.sc_helper = get_sc_helper(self.get("securechange_key", "securechange"), self.sc_host)
+        self.st_helper = get_st_helper(self.get("securetrack_key", "securetrack"),
+                                       self.get("securetrack_host", conf.get("securetrack", "host")))
+        self.object_index_max_age = float(self.get("object_index_max_age", DEFAULT_OBJECT_INDEX_MAX_AGE))
+        self.task_ledger = TaskLedger(self._ledger_path())
+        if section == SETUP_SECTION_NAME:
+            self.poll_interval, self.push = sleep_time, push
+        else:
+            self.poll_interval = int(conf.get(section, "poll_interval", default_value=sleep_time))
+            self.push = str_to_bool(conf.get(section, "push_enabled", default_value=str(push)))
+        self.poll_min_interval = int(self.get("poll_min_interval", DEFAULT_POLL_MIN_INTERVAL))
+        self.poll_max_interval = int(self.get("poll_max_interval", DEFAULT_POLL_MAX_INTERVAL))
+        self.push_token_key = self.get("push_token_key", PUSH_TOKEN_KEY)
+        self.push_path = conf.get(section, "push_path", mandatory=False)
+        if self.push_path is None:
+            base_path = conf.get(SETUP_SECTION_NAME, "push_path", default_value=DEFAULT_PUSH_PATH).rstrip('/')
+            self.push_path = base_path if section == SETUP_SECTION_NAME else "{}/{}".format(base_path, name)
+        self.task_queue = queue.Queue()
+        session_pool = get_session_pool()
+        session_pool.set_host_limit(self.orca_host,
+                                    self.get("max_connections_per_host", DEFAULT_MAX_CONNECTIONS_PER_HOST))
+        self.orca_client = OrcaClient(self.orca_host, self.group_path_url, session_pool=session_pool,
+                                      policy=get_http_policy(conf, section),
+                                      auth_token=secret_helper.get_password(self.get("orca_token_key",
+                                                                                      AUTH_TOKEN_KEY)))
+
+    def get(self, option, default_value=None):
+        """ Read an option of the source, falling back to the [integration setup] section."""
+        value = conf.get(self.section, option, mandatory=False)
+        if value is None:
+            value = conf.get(SETUP_SECTION_NAME, option, mandatory=default_value is None, default_value=default_value)
+        return value
+
+    def _ledger_path(self):
+        """ Every source has its own ledger, Orca task ids are only unique within an Orca."""
+        path = conf.get(self.section, "task_ledger_path", mandatory=False)
+        if path is None:
+            path = conf.get(SETUP_SECTION_NAME, "task_ledger_path", default_value=DEFAULT_LEDGER_PATH)
+            if self.section != SETUP_SECTION_NAME:
+                root, extension = os.path.splitext(path)
+                path = "{}_{}{}".format(root, re.sub(r'[^A-Za-z0-9_.-]+', '-', self.name), extension)
+        return path
+
+    def get_ticket_link(self, ticket_id):
+        return get_ticket_link(self.sc_host, ticket_id)
+
+    def get_object_index(self):
+        return get_object_index(self.st_helper, self.object_index_max_age)
+
+    def __str__(self):
+        return "Orca source '{}' ({})".format(self.name, self.orca_host)
+
+
+def get_sources(sleep_time=DEFAULT_POOL_INTERVAL, push=False):
+    """
+    :return: An OrcaSource for every [orca source <name>] section, or a single source of the [integration setup]
+             section if there are none
+    """
+    sections = [section for section in conf.sections() if section.startswith(SOURCE_SECTION_PREFIX)]
+    if not sections:
+        return [OrcaSource(DEFAULT_SOURCE_NAME, SETUP_SECTION_NAME, sleep_time, push)]
+    return [OrcaSource(section[len(SOURCE_SECTION_PREFIX):].strip(), section, sleep_time, push)
+            for section in sections]
+
+
 def get_cli_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("-s", "--sleep-time",
                         type=int,
-                        help="Sleep time between fetching emails.",
+                        help="Sleep time between polls to Orca.",
                         default=DEFAULT_POOL_INTERVAL)
+    parser.add_argument("-p", "--push",
+                        action="store_true",
+                        default=str_to_bool(conf.get("integration setup", "push_enabled", default_value="false")),
+                        help="Listen for tasks pushed by Orca, polling is used as a fallback.")
     parser.add_argument("-n", "--no-daemonize",
                         action="store_true",
                         default=False,
@@ -124,7 +251,7 @@ def get_cli_args():
     return args
 
 
-def get_ticket_link(ticket_id):
+def get_ticket_link(sc_host, ticket_id):
     link_template = "https://{}/securechangeworkflow/pages/myRequest/myRequestsMain.seam?ticketId={}"
     ticket_link = link_template.format(sc_host, ticket_id)
     return ticket_link
@@ -141,10 +268,11 @@ def valid_device_ids(devices):
     return device_ids
 
 
-def get_group_objects_by_name(group_name):
+def get_group_objects_by_name(st_helper, group_name):
     logger.info("Getting all groups from all devices by name '{}' from first step".format(group_name))
     net_group_to_update = []
-    network_objects = st_helper.network_object_text_search(group_name, "name", exact_match=True)
+    with phase('st_group_search'):
+        network_objects = st_helper.network_object_text_search(group_name, "name", exact_match=True)
     for network_object in network_objects:
         if isinstance(network_object, Group_Network_Object) and network_object.display_name == group_name:
                 # and network_object.device_id in device_ids:
@@ -153,35 +281,58 @@ def get_group_objects_by_name(group_name):
     return net_group_to_update
 
 
-def get_edited_groups(groups_to_update, g_members):
+def get_destination_name(destination):
+    return destination.replace('*.', '')
+
+
+def get_edited_groups(groups_to_update, resolved_destinations, object_index, unresolved_destinations=(),
+                      unresolved_addresses=()):
+    """
+    Build the group changes needed to make the groups match the destinations.
+    Existing members of the unresolved destinations are kept as is instead of being deleted: the objects created for
+    them, named '<destination>_<address>' of their own address, and the members at their previously resolved addresses.
+    :param groups_to_update: SecureTrack group objects
+    :param resolved_destinations: A dict of destination name to the list of its resolved addresses
+    :param object_index: SecureTrackObjectIndex of the current cycle
+    :param unresolved_destinations: Destination names that could not be resolved
+    :param unresolved_addresses: Addresses the unresolved destinations resolved to before
+    :return: List of Group_Change_Node
+    """
+    def is_unresolved_member(m_obj, object_details):
+        if object_details in unresolved_addresses:
+            return True
+        # The name get_new_members gives to the objects it creates
+        ip = getattr(m_obj, 'ip', None)
+        suffix = "_{}".format(ip)
+        return ip is not None and m_obj.display_name.endswith(suffix) and \
+            m_obj.display_name[:-len(suffix)] in unresolved_destinations
+
     def get_members():
         logger.info("removing member from group '{}'".format(group.name))
         members = []
         is_deleted = False
-        tmp_resolved_members = resolved_members[:]
-        for member in group.members[:]:
-            m_obj = st_helper.network_object_text_search(member.uid.replace('{', '').replace('}', ''), "uid",
-                                                         exact_match=True, filter='uid')[0]
+        with phase('member_lookup'):
+            member_objects = [object_index.get_by_uid(device.id, member.uid) for member in group.members]
+        with phase('diff'):
+            group_diff = membership_diff.diff((address_key(m_obj) or m_obj.ip, m_obj) for m_obj in member_objects)
+        unchanged = {id(m_obj) for m_obj in group_diff.unchanged}
+        for m_obj in member_objects:
+            object_details = address_key(m_obj) or m_obj.ip
             if isinstance(m_obj, Subnet_Network_Object):
-                cidr = sum([bin(int(x)).count("1") for x in m_obj.netmask.split(".")])
-                ip_str = "{}/{}".format(m_obj.ip, cidr)
                 o_type = 'NETWORK'
-                object_details = ip_str
             elif isinstance(m_obj, Range_Network_Object):
-                object_details = '[{}-{}]'.format(m_obj.first_ip, m_obj.last_ip)
                 o_type = 'range'
-                ip_str = object_details
             else:
-                ip_str = m_obj.ip
                 o_type = 'HOST'
-                object_details = m_obj.ip
 
-            if ip_str not in tmp_resolved_members:
+            if id(m_obj) in unchanged:
+                status = NOT_CHANGE_STATUS
+            elif is_unresolved_member(m_obj, object_details):
+                logger.info("Keeping member '{}' of an unresolved destination".format(m_obj.display_name))
+                status = NOT_CHANGE_STATUS
+            else:
                 status = "DELETED"
                 is_deleted = True
-            else:
-                status = NOT_CHANGE_STATUS
-                tmp_resolved_members.remove(ip_str)
 
             new_member = Group_Change_Member_Object(name=m_obj.display_name,
                                                     num_id=None,
@@ -195,27 +346,22 @@ def get_edited_groups(groups_to_update, g_members):
                                                     comment=m_obj.comment,
                                                     attr_type='Object')
             members.append(new_member)
-        return tmp_resolved_members, is_deleted, members
+        return group_diff.added, is_deleted, members
 
     def get_new_members(device_id, device_name):
         logger.info('Getting new members')
         members = []
-        tmp_members = left_resolved_members[:]
-        network_objects = st_helper.get_network_objects_for_device(device_id)
-        for network_object in network_objects:
+        tmp_members = []
+        for ip in left_resolved_members:
+            network_object = object_index.get_by_address(device_id, ip)
             if isinstance(network_object, Subnet_Network_Object):
                 o_type = 'NETWORK'
-                cidr = sum([bin(int(x)).count("1") for x in network_object.netmask.split(".")])
-                ip_cidr = "{}/{}".format(network_object.ip, cidr)
-                if ip_cidr not in tmp_members:
-                    continue
-                tmp_members.remove(ip_cidr)
                 object_detail = "{}/{}".format(network_object.ip, network_object.netmask)
-            elif isinstance(network_object, Host_Network_Object) and network_object.ip in tmp_members:
+            elif isinstance(network_object, Host_Network_Object):
                 o_type = TYPE_HOST
                 object_detail = network_object.ip
-                tmp_members.remove(network_object.ip)
             else:
+                tmp_members.append(ip)
                 continue
 
             new_member = Group_Change_Member_Object(name=network_object.display_name,
@@ -233,17 +379,15 @@ def get_edited_groups(groups_to_update, g_members):
         # if no object found in device, create new device and add it to the group
         if tmp_members:
             for ip in tmp_members:
+                name = member_names[ip]
                 if '/' in ip:
                     o_type = 'NETWORK'
-                    ip, cidr = ip.split('/')
-                    mask = socket.inet_ntoa(struct.pack('!I', (1 << 32) - (1 << 32 - int(cidr))))
-                    object_detail = "{}/{}".format(ip, mask)
-                    index_value = "{}/{}".format(ip, cidr)
+                    network = ipaddress.ip_network(ip, strict=False)
+                    ip = ip.split('/')[0]
+                    object_detail = "{}/{}".format(ip, network.netmask)
                 else:
                     o_type = TYPE_HOST
                     object_detail = ip
-                    index_value = ip
-                name = g_members[resolved_members.index(index_value)]
                 try:
                     ipaddress.IPv4Address(name)
                 except ipaddress.AddressValueError:
@@ -266,41 +410,59 @@ def get_edited_groups(groups_to_update, g_members):
         return members
 
     group_changes = []
-    try:
-        resolved_members = []
-        g_members = [g.replace('*.', '') for g in g_members]
-        for g in g_members:
-            logger.debug("Resolving: {}".format(g))
-            resolved_members.append(socket.gethostbyname(g))
-    except Exception as e:
-        logger.error("One on the group member is not resolvable. Error: '{}'".format(e))
-    else:
-        logger.info("Resolved members: '{}'".format(resolved_members))
-        for group in groups_to_update:
-            logger.info("Edit group '{}'".format(group.to_xml_string()))
-            device = st_helper.get_device_by_id(group.device_id)
-            left_resolved_members, objects_deleted, new_members = get_members()
-            logger.debug('New members: {}'.format(new_members))
-            logger.debug('Resolved members: {}'.format(resolved_members))
-            if left_resolved_members or objects_deleted:
+    resolved_members, member_names = [], {}
+    for name, addresses in resolved_destinations.items():
+        for address in addresses:
+            if address not in member_names:
+                member_names[address] = name
+                resolved_members.append(address)
+    unresolved_destinations = set(unresolved_destinations)
+    unresolved_addresses = set(unresolved_addresses)
+    membership_diff = MembershipDiff(resolved_members)
+    logger.info("Resolved members: %s", len(resolved_members))
+    for group in groups_to_update:
+        logger.info("Edit group '%s'", group.display_name)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Group before the change:\n%s", group.to_xml_string())
+        device = object_index.get_device(group.device_id)
+        left_resolved_members, objects_deleted, new_members = get_members()
+        logger.debug('New members: %s', new_members)
+        logger.debug('Resolved members: %s', resolved_members)
+        if left_resolved_members or objects_deleted:
+            with phase('member_lookup'):
                 new_members.extend(get_new_members(device.id, device.name))
-                group_change_node = Group_Change_Node(
-                    name=group.display_name,
-                    management_name=device.name,
-                    management_id=device.id,
-                    change_implementation_status='NOT_SUPPORTED',
-                    members=XML_List(Elements.MEMBERS, new_members),
-                    change_action="UPDATE"
-                )
-                # print(group_change_node.to_xml_string())
-                group_changes.append(group_change_node)
+            group_change_node = Group_Change_Node(
+                name=group.display_name,
+                management_name=device.name,
+                management_id=device.id,
+                change_implementation_status='NOT_SUPPORTED',
+                members=XML_List(Elements.MEMBERS, new_members),
+                change_action="UPDATE"
+            )
+            # print(group_change_node.to_xml_string())
+            group_changes.append(group_change_node)
     return group_changes
 
 
-def update_groups(groups, orca_id, group_name):
-    logger.debug("Groups to update '{}'".format(groups))
+def get_ticket_template(ticket_template_path):
+    """
+    Get a copy of a group change ticket template. The template file is parsed once and parsed again only when it
+    is modified.
+    """
+    signature = os.stat(ticket_template_path).st_mtime_ns
+    with _ticket_template_lock:
+        cached = _ticket_templates.get(ticket_template_path)
+        if cached is None or cached[0] != signature:
+            logger.debug("Parsing the ticket template '{}'".format(ticket_template_path))
+            cached = _ticket_templates[ticket_template_path] = signature, Ticket.from_file(ticket_template_path)
+        template = cached[1]
+    return copy.deepcopy(template)
+
+
+def update_groups(source, groups, orca_id, group_name):
+    logger.debug("Groups to update '%s'", groups)
     if groups:
-        ticket = Ticket.from_file(ticket_template_path)
+        ticket = get_ticket_template(source.ticket_template_path)
         ticket.subject = "Generated from Orca ID {}".format(orca_id)
         current_task = ticket.get_last_step().get_last_task()
         group_change_field = current_task.get_field_list_by_type(Attributes.FIELD_TYPE_MULTI_GROUP_CHANGE)[0]
@@ -309,9 +471,11 @@ def update_groups(groups, orca_id, group_name):
         orca_task_field.text = orca_id
         group_name_field = current_task.get_field_list_by_name('Group Name')[0]
         group_name_field.text = group_name
-        logger.debug("The new ticket is:\n{}".format(ticket.to_xml_string()))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("The new ticket is:\n%s", ticket.to_xml_string())
         try:
-            ticket_id = sc_helper.post_ticket(ticket)
+            with get_ticket_post_semaphore(source.sc_host), phase('sc_ticket_post'):
+                ticket_id = source.sc_helper.post_ticket(ticket)
         except (ValueError, IOError) as e:
             logger.error(e)
             ticket_id = None
@@ -320,64 +484,271 @@ def update_groups(groups, orca_id, group_name):
         return ticket_id
 
 
-def monitor_loop(sleep_time=DEFAULT_POOL_INTERVAL, debug=False):
-    setup_loggers(conf.dict("log_levels"), log_to_stdout=debug, log_dir_path="/var/log", log_file="ps_orca_logger.log")
-    while True:
-        orca_client = OrcaClient(orca_host, group_path_url)
+def report_group_status(source, task_id, group, status, msg, ticket_id='N/A', sc_url='N/A'):
+    """
+    Record the outcome of a group in the task ledger and report it to Orca.
+    The ledger is updated first so a submitted ticket is remembered even if Orca could not be updated.
+    :return: The status
+    """
+    source.task_ledger.record(task_id, group['name'], destinations_hash(group['destinations']), ticket_id,
+                              status.value, msg, sc_url)
+    metrics.counter(GROUPS_COUNTER, source=source.name, status=status.name, resent='false').inc()
+    source.orca_client.update_orca_ticket(task_id, ticket_id, status=status.value, msg=msg, group_name=group['name'],
+                                          url_path=source.orca_update_task_url, sc_url=sc_url)
+    return status
+
+
+def process_group(source, task_id, group, object_index, resolved_destinations, unresolved_destinations):
+    """
+    Handle a single group of an Orca task: find it in SecureTrack, diff it, submit a ticket and update Orca.
+    :return: The Orca status that was reported for the group
+    """
+    g_name, members = group['name'], group['destinations']
+    if not members:
+        msg = "Destinations are missing"
+        return report_group_status(source, task_id, group, OrcaStatuses.Failed, msg)
+
+    groups_to_update = get_group_objects_by_name(source.st_helper, g_name)
+    if not groups_to_update:
+        msg = "Group name '{}' could not be found".format(g_name)
+        return report_group_status(source, task_id, group, OrcaStatuses.Failed, msg)
+
+    names = [get_destination_name(m) for m in members]
+    group_resolved = {n: resolved_destinations[n] for n in names if n in resolved_destinations}
+    group_unresolved = {n: unresolved_destinations[n] for n in names if n in unresolved_destinations}
+    unresolved_msg = ''
+    if group_unresolved:
+        unresolved_msg = " Unresolved destinations: {}".format(
+            ', '.join("{} ({})".format(n, e) for n, e in group_unresolved.items()))
+    if not group_resolved:
+        msg = "None of the destinations could be resolved." + unresolved_msg
+        return report_group_status(source, task_id, group, OrcaStatuses.Failed, msg)
+
+    # only if group has been found
+    unresolved_addresses = [address for n in group_unresolved for address in dns_resolver.last_addresses(n)]
+    edited_groups = get_edited_groups(groups_to_update, group_resolved, object_index, group_unresolved,
+                                      unresolved_addresses)
+    if edited_groups:
+        ticket_id = update_groups(source, edited_groups, task_id, group_name=g_name)
+        if ticket_id:
+            status = OrcaStatuses.Running
+            ticket_link = source.get_ticket_link(ticket_id)
+            msg = "SecureChange ticket has been submitted"
+        else:
+            status = OrcaStatuses.Failed
+            ticket_link = 'N/A'
+            msg = "Could not create a ticket ..."
+
+        return report_group_status(source, task_id, group, status, msg + unresolved_msg,
+                                   ticket_id=ticket_id, sc_url=ticket_link)
+    else:
+        status = OrcaStatuses.Succeeded
+        msg = "Update is not required the group is identical"
+        logger.info(msg)
+        return report_group_status(source, task_id, group, status, msg + unresolved_msg)
+
+
+def process_group_safely(source, task_id, group, *args):
+    """ Run process_group so that an error in one group does not affect the other groups of the task."""
+    try:
+        return process_group(source, task_id, group, *args)
+    except Exception as error:
+        return report_group_error(source, task_id, group, error)
+
+
+def report_group_error(source, task_id, group, error):
+    """
+    Log an unexpected error of a group and report the group as failed to Orca.
+    Must be called from the except block that caught the error.
+    :return: The Failed status
+    """
+    g_name = group.get('name')
+    exception_buffer = io.StringIO()
+    traceback.print_exc(file=exception_buffer)
+    logger.error("Failed to process group '%s': '%s', Traceback: '%s'", g_name, error, exception_buffer.getvalue())
+    try:
+        source.orca_client.update_orca_ticket(task_id, 'N/A', status=OrcaStatuses.Failed.value,
+                                              msg="An error occurred while processing the group: {}".format(error),
+                                              group_name=g_name, url_path=source.orca_update_task_url)
+    except IOError:
+        pass
+    return OrcaStatuses.Failed
+
+
+def resend_handled_group(source, task_id, group):
+    """
+    Report the stored status of a group that was already handled with the same destinations, without doing the
+    SecureTrack work again.
+    :return: The stored status or None if the group has to be processed
+    """
+    entry = source.task_ledger.get(task_id, group.get('name'))
+    if entry is None or entry.destinations_hash != destinations_hash(group['destinations']):
+        return None
+    status = OrcaStatuses(entry.status)
+    if status not in (OrcaStatuses.Running, OrcaStatuses.Succeeded):
+        return None
+    logger.info("Group '{}' of Orca task '{}' was already handled, status {}, ticket id '{}'".format(
+        entry.group_name, task_id, status.name, entry.ticket_id))
+    metrics.counter(GROUPS_COUNTER, source=source.name, status=status.name, resent='true').inc()
+    try:
+        source.orca_client.update_orca_ticket(task_id, entry.ticket_id, status=entry.status, msg=entry.message,
+                                              group_name=entry.group_name, url_path=source.orca_update_task_url,
+                                              sc_url=entry.sc_url)
+    except IOError:
+        pass
+    return status
+
+
+def handle_orca_response(source, orca_response):
+    """
+    Process all the groups of an Orca task concurrently and wait for all of them to finish.
+    Groups that are in the task ledger with the same destinations only get their stored status reported again.
+    :return: A dict of group name to the Orca status reported for it
+    """
+    results = {}
+    if not orca_response['groups']:
+        logger.info("No need to update a group. Group is equal to null")
+        return results
+
+    groups, destination_names = [], []
+    for group in orca_response['groups']:
+        # A malformed group is reported as failed, the other groups of the task are still processed
         try:
-            orca_response = orca_client.get_group_memebers()
-            if orca_response['groups']:
-                # device_ids = valid_device_ids(st_helper.get_devices_list())
-                # logger.debug("Device ids: {}".format(device_ids))
-                for group in orca_response['groups']:
-                    g_name, members = group['name'], group['destinations']
-                    if not members:
-                        msg = "Destinations are missing"
-                        orca_client.update_orca_ticket(orca_response["id"], 'N/A', status=OrcaStatuses.Failed.value,
-                                                       msg=msg,
-                                                       group_name=g_name, url_path=orca_update_task_url)
-                        continue
-
-                    groups_to_update = get_group_objects_by_name(g_name)
-                    if not groups_to_update:
-                        msg = "Group name '{}' could not be found".format(g_name)
-                        orca_client.update_orca_ticket(orca_response["id"], 'N/A',
-                                                       status=OrcaStatuses.Failed.value,
-                                                       msg=msg,
-                                                       group_name=g_name,
-                                                       url_path=orca_update_task_url)
-                        continue
-
-                    # only if group has been found
-                    edited_groups = get_edited_groups(groups_to_update, members)
-                    ticket_link = 'N/A'
-                    if edited_groups:
-                        ticket_id = update_groups(edited_groups, orca_response['id'], group_name=g_name)
-                        if ticket_id:
-                            status = OrcaStatuses.Running.value
-                            ticket_link = get_ticket_link(ticket_id)
-                            msg = "SecureChange ticket has been submitted"
-                        else:
-                            status = OrcaStatuses.Failed.value
-                            msg = "Could not create a ticket ..."
-
-                        orca_client.update_orca_ticket(orca_response["id"], ticket_id, status=status, msg=msg,
-                                                       group_name=g_name, url_path=orca_update_task_url,
-                                                       sc_url=ticket_link)
-                    else:
-                        msg = "Update is not required the group is identical"
-                        logger.info(msg)
-                        orca_client.update_orca_ticket(orca_response["id"], 'N/A', status=OrcaStatuses.Succeeded.value,
-                                                       msg=msg, group_name=g_name, url_path=orca_update_task_url)
-            else:
-                logger.info("No need to update a group. Group is equal to null")
+            status = resend_handled_group(source, orca_response['id'], group)
+            if status is None:
+                destination_names.extend([get_destination_name(d) for d in group.get('destinations') or ()])
         except Exception as error:
-            exception_buffer = io.StringIO()
-            traceback.print_exc(file=exception_buffer)
-            logger.debug("An error occurred: '%s', Traceback: '%s'", error, exception_buffer.getvalue())
+            status = report_group_error(source, orca_response['id'], group, error)
+        if status is None:
+            groups.append(group)
+        else:
+            results[group.get('name')] = status
+    if not groups:
+        return results
+
+    object_index = source.get_object_index()
+    with phase('dns_resolution'):
+        resolved_destinations, unresolved_destinations = dns_resolver.resolve(destination_names)
+    # device_ids = valid_device_ids(st_helper.get_devices_list())
+    # logger.debug("Device ids: {}".format(device_ids))
+    workers = min(GROUP_WORKERS, len(groups))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='orca-group') as executor:
+        futures = {}
+        for group in groups:
+            future = executor.submit(process_group_safely, source, orca_response['id'], group, object_index,
+                                     resolved_destinations, unresolved_destinations)
+            futures[future] = group.get('name')
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+
+    logger.info("{}: Orca task '{}' processed: {}".format(
+        source, orca_response['id'], ', '.join("{}={}".format(name, status.name) for name, status in results.items())))
+    logger.debug("SecureTrack requests for object lookups: {}".format(object_index.requests_count))
+    return results
+
+
+def start_push_listener(sources):
+    """ Listen for the tasks pushed to the sources in push mode, every source on its own push path."""
+    listener = OrcaPushListener(bind_address=conf.get("integration setup", "push_bind_address",
+                                                      default_value=DEFAULT_PUSH_BIND_ADDRESS),
+                                port=int(conf.get("integration setup", "push_port", default_value=DEFAULT_PUSH_PORT)),
+                                certfile=conf.get("integration setup", "push_certfile", mandatory=False),
+                                keyfile=conf.get("integration setup", "push_keyfile", mandatory=False))
+    for source in sources:
+        listener.add_route(source.push_path, source.task_queue, secret_helper.get_password(source.push_token_key))
+    listener.start()
+    return listener
+
+
+def start_metrics_export():
+    """
+    Start the metrics endpoint if metrics_port is set.
+    :return: The path of the metrics text file that is written after every cycle, or None
+    """
+    port = int(conf.get("integration setup", "metrics_port", default_value=0))
+    if port:
+        metrics.MetricsServer(conf.get("integration setup", "metrics_bind_address", default_value='127.0.0.1'),
+                              port).start()
+    return conf.get("integration setup", "metrics_textfile_path", mandatory=False)
+
+
+def export_metrics(textfile_path):
+    if textfile_path:
+        try:
+            metrics.write_textfile(textfile_path)
+        except OSError as error:
+            logger.error("Failed to write the metrics to '{}'. Error: '{}'".format(textfile_path, error))
+
+
+def run_source(source, profiler, metrics_textfile_path=None):
+    """
+    Poll an Orca source for group changes, and when push is enabled also handle the tasks pushed by it as they arrive.
+    Polling backs off exponentially while Orca has nothing for us and returns to the minimal interval after activity.
+    In polling mode the interval moves between poll_min_interval and poll_interval, in push mode polling is only a
+    fallback and moves between poll_interval and poll_max_interval.
+    """
+    if source.push:
+        poll_interval = AdaptivePollInterval(source.poll_interval, source.poll_max_interval)
+    else:
+        poll_interval = AdaptivePollInterval(source.poll_min_interval, source.poll_interval)
+    ledger_max_age = int(source.get("task_ledger_max_age", DEFAULT_LEDGER_MAX_AGE))
+    next_ledger_prune = time.monotonic()
+    logger.info("Handling the tasks of {}".format(source))
+    pushed_task = None
+    while True:
+        if time.monotonic() >= next_ledger_prune:
+            try:
+                source.task_ledger.prune(ledger_max_age)
+            except Exception as error:
+                logger.error("%s: Failed to prune the task ledger: '%s'", source, error)
+            next_ledger_prune = time.monotonic() + LEDGER_PRUNE_INTERVAL
+        results = {}
+        with profiler.profile(source=source.name, trigger='push' if pushed_task else 'poll') as profiled_run:
+            try:
+                if pushed_task is None:
+                    orca_response = source.orca_client.get_group_memebers()
+                else:
+                    orca_response = pushed_task
+                profiled_run.tags['task'] = orca_response.get('id')
+                results = handle_orca_response(source, orca_response)
+            except Exception as error:
+                exception_buffer = io.StringIO()
+                traceback.print_exc(file=exception_buffer)
+                logger.debug("%s: An error occurred: '%s', Traceback: '%s'", source, error,
+                             exception_buffer.getvalue())
+
+        source.orca_client.session_pool.log_metrics()
+        source.orca_client.policy.log_states()
+        export_metrics(metrics_textfile_path)
+        poll_interval.record(active=bool(results))
+        delay = poll_interval.next_delay()
+        logger.info("%s: Sleeping for %.1f seconds.", source, delay)
+        try:
+            pushed_task = source.task_queue.get(timeout=delay)
+        except queue.Empty:
+            pushed_task = None
+
 
-        logger.info("Sleeping for %s seconds.", sleep_time)
-        time.sleep(sleep_time)
+def monitor_loop(sleep_time=DEFAULT_POOL_INTERVAL, debug=False, push=False):
+    """
+    Handle the tasks of all the Orca sources, each source in its own thread with its own schedule.
+    :param sleep_time: Polling interval of the sources that do not set poll_interval
+    :param push: Whether the sources that do not set push_enabled are in push mode
+    """
+    setup_loggers(conf.dict("log_levels"), log_to_stdout=debug, log_dir_path="/var/log", log_file="ps_orca_logger.log")
+    sources = get_sources(sleep_time, push)
+    push_sources = [source for source in sources if source.push]
+    if push_sources:
+        start_push_listener(push_sources)
+    metrics_textfile_path = start_metrics_export()
+    profiler = Profiler.from_conf(conf, SETUP_SECTION_NAME, 'orca_group_change')
+    threads = [threading.Thread(target=run_source, name='orca-source-{}'.format(source.name),
+                                args=(source, profiler, metrics_textfile_path))
+               for source in sources]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
 
 
 def main():
@@ -385,9 +756,10 @@ def main():
     setup_loggers(conf.dict("log_levels"), log_to_stdout=cli_args.debug,
                   log_dir_path="/var/log", log_file="ps_orca_logger.log")
     if cli_args.no_daemonize:
-        monitor_loop(cli_args.sleep_time, cli_args.debug)
+        monitor_loop(cli_args.sleep_time, cli_args.debug, cli_args.push)
     else:
-        daemon = daemonize.Daemonize(app="Orca Group Change", pid=PID_FILE, action=monitor_loop, verbose=True)
+        action = functools.partial(monitor_loop, cli_args.sleep_time, push=cli_args.push)
+        daemon = daemonize.Daemonize(app="Orca Group Change", pid=PID_FILE, action=action, verbose=True)
         daemon.start()
 
 
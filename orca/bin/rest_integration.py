@@ -1,57 +1,209 @@
 #!/usr/local/orca/python/bin/python3
 
+import time
+
+_start_time = time.perf_counter()
+
 import argparse
+import json
 import logging
+import os
 import shlex
+import signal
 import sys
+import threading
+import traceback
+import xml.etree.ElementTree as ET
 
 from pytos.common.logging.logger import setup_loggers
 from pytos.common.logging.definitions import COMMON_LOGGER_NAME
-from pytos.common.functions.config import Secure_Config_Parser
-from pytos.securechange.helpers import Secure_Change_Helper, Secure_Change_API_Handler
+from pytos.common.functions import str_to_bool
 
 sys.path.append('/usr/local/orca/lib')
-from common.secret_store import SecretDb
-from common.third_party.generic.rest.template_client import JsonTemplateClient
+from common.context import StartupReport, get_conf, get_credentials, get_sc_helper
+from common.trigger_queue import TriggerQueue, DEFAULT_QUEUE_PATH
+from common import metrics
 
-secret_helper = SecretDb()
 logger = logging.getLogger(COMMON_LOGGER_NAME)
-conf = Secure_Config_Parser(config_file_path="/usr/local/orca/conf/custom.conf")
-sc_cred = (secret_helper.get_username('securechange'), secret_helper.get_password('securechange'))
-sc_host = conf.get("securechange", "host")
-sc_helper = Secure_Change_Helper(sc_host, sc_cred)
+startup_report = StartupReport(_start_time)
+startup_report.add("imports", time.perf_counter() - _start_time)
+INTEGRATION_SECTION_PREFIX = "integration "
+SETUP_SECTION_NAME = "integration setup"
+QUEUE_SECTION_NAME = "rest_integration"
+TRIGGERS_FOR_STEP = ('ADVANCE', 'CREATE', 'RESUBMIT')
+TRIGGERS_FOR_ACTION = ('CLOSE', 'CANCEL', 'REJECT', 'REDO', 'REOPEN', 'PRE_ASSIGNMENT_SCRIPT', 'AUTOMATION_FAILED')
+DEFAULT_QUEUE_WORKERS = 4
+DEFAULT_QUEUE_MAX_ATTEMPTS = 3
+DEFAULT_QUEUE_RETRY_DELAY = 60
+DEFAULT_QUEUE_POLL_INTERVAL = 1
+DEFAULT_QUEUE_WAIT_MAX_TIME = 30
+DEFAULT_QUEUE_NOT_READY_DELAY = 30
+DEFAULT_QUEUE_NOT_READY_MAX_AGE = 3600
+QUEUE_METRICS_INTERVAL = 60
+DEFAULT_METRICS_STATE_PATH = '/usr/local/orca/var/rest_integration_metrics.json'
+QUEUE_DEPTH_GAUGE = 'rest_trigger_queue_depth'
+QUEUE_RUNNING_GAUGE = 'rest_trigger_queue_running'
+QUEUE_OLDEST_AGE_GAUGE = 'rest_trigger_queue_oldest_age_seconds'
+metrics.describe(QUEUE_DEPTH_GAUGE, "Triggers pending in the local queue")
+metrics.describe(QUEUE_RUNNING_GAUGE, "Triggers of the local queue that are being handled")
+metrics.describe(QUEUE_OLDEST_AGE_GAUGE, "Seconds since the oldest pending trigger of the local queue was enqueued")
 
 
 def get_cli_args():
     parser = argparse.ArgumentParser('')
     parser.add_argument('--debug', action='store_true', help='Print out logging information to STDOUT.')
+    parser.add_argument('--startup-report', action='store_true', dest='startup_report',
+                        help='Print the duration of the startup phases to STDERR.')
+    parser.add_argument('--enqueue', action='store_true',
+                        help='Only add the trigger to the local queue, it is handled by the worker.')
+    parser.add_argument('--worker', action='store_true', help='Handle the triggers of the local queue.')
+    parser.add_argument('--queue-stats', action='store_true', dest='queue_stats',
+                        help='Print the depth and age of the local queue.')
+    parser.add_argument('--workflow', help='Name of the workflow of the trigger, triggers of workflows without '
+                                           'integration sections exit before loading the integration.')
     # Workaround for SC not passing arguments to the script
     args = parser.parse_args(shlex.split(' '.join(sys.argv[1:])))
     return args
 
 
-def main():
-    cli_args = get_cli_args()
+def get_integration_sections(conf):
+    return [section for section in conf.sections()
+            if section.startswith(INTEGRATION_SECTION_PREFIX) and section != SETUP_SECTION_NAME]
+
+
+def has_sections_for_trigger(conf, trigger, stage_name, workflow_name=None):
+    """
+    Check if a section can handle the trigger, before any helper is built.
+    Actions need an 'integration <workflow>-<action>' section. Steps need a section of the stage that was left with
+    the 'leave' timing, or any step section with the 'enter' timing, as the name of the next step is not known yet.
+    :param workflow_name: Only the sections of this workflow are checked, all of them if it is not known
+    """
+    sections = get_integration_sections(conf)
+    if workflow_name:
+        prefix = "{}{}-".format(INTEGRATION_SECTION_PREFIX, workflow_name)
+        sections = [section for section in sections if section.startswith(prefix)]
+    if trigger in TRIGGERS_FOR_ACTION:
+        actions = ('CLOSE', 'AUTOCLOSE') if trigger == 'CLOSE' else (trigger,)
+        return any(section.endswith("-{}".format(action)) for section in sections for action in actions)
+    if trigger in TRIGGERS_FOR_STEP:
+        action_suffixes = tuple("-{}".format(action) for action in TRIGGERS_FOR_ACTION + ('AUTOCLOSE',))
+        for section in sections:
+            if stage_name and section.endswith("-{}".format(stage_name)):
+                return True
+            if not section.endswith(action_suffixes) and \
+                    conf.get(section, 'timing', default_value='enter').lower() == 'enter':
+                return True
+    return False
+
+
+def read_ticket_info_node():
+    """
+    Read the ticket info XML that SecureChange writes to the standard input, without loading pytos.
+    :return: The ticket info XML node, or None in test mode
+    """
+    ticket_info_xml = sys.stdin.read()
+    logger.debug("Got the following XML input:\n%s", ticket_info_xml)
+    try:
+        ticket_info_node = ET.fromstring(ticket_info_xml)
+    except ET.ParseError as error:
+        logger.error("Could not parse ticket info XML. Error: '{}'".format(error))
+        return None
+    # The ticket info has no child nodes in test mode
+    return ticket_info_node if len(ticket_info_node) else None
+
+
+def get_trigger_queue(conf):
+    return TriggerQueue(conf.get(QUEUE_SECTION_NAME, 'queue_path', default_value=DEFAULT_QUEUE_PATH))
+
+
+def get_metrics_state_file(conf):
+    """
+    :return: (MetricsStateFile, text file path) when metrics_textfile_path is set, otherwise (None, None)
+    """
+    textfile_path = conf.get(QUEUE_SECTION_NAME, 'metrics_textfile_path', mandatory=False)
+    if not textfile_path:
+        return None, None
+    state_path = conf.get(QUEUE_SECTION_NAME, 'metrics_state_path', default_value=DEFAULT_METRICS_STATE_PATH)
+    return metrics.MetricsStateFile(state_path), textfile_path
+
+
+def flush_metrics(state_file, textfile_path):
+    """ Add the metrics of this process to the metrics of the previous runs and export them."""
+    if state_file is None or not (metrics.histograms() or metrics.counters() or metrics.gauges()):
+        return
+    try:
+        state_file.flush(textfile_path)
+    except OSError as error:
+        logger.error("Failed to export the metrics to '{}'. Error: '{}'".format(textfile_path, error))
+
+
+def setup_logging(conf, cli_args):
     setup_loggers(conf.dict('log_levels'), log_to_stdout=cli_args.debug,
                   log_dir_path="/var/log", log_file="ps_orca_logger.log")
 
-    logger.info("Reading ticket info")
-    try:
-        ticket_info = sc_helper.read_ticket_info()
-    except ValueError:
-        logger.info("Testing")
-        sys.exit(0)
 
-    logger.info('Script is called for ticket id "{}"'.format(ticket_info.id))
+def main():
+    cli_args = get_cli_args()
     try:
-        template_client = JsonTemplateClient.from_conf(sc_helper, sc_cred[0])
-    except (NameError, ValueError) as error:
-        logger.error(error)
-        sys.exit(1)
+        if cli_args.queue_stats:
+            print(json.dumps(get_trigger_queue(get_conf()).metrics()))
+        elif cli_args.worker:
+            run_worker(cli_args)
+        else:
+            try:
+                handle_trigger(cli_args)
+            finally:
+                # Every trigger is a separate process, its metrics are merged with the ones of the previous triggers
+                flush_metrics(*get_metrics_state_file(get_conf()))
+    finally:
+        if cli_args.startup_report:
+            startup_report.print()
+    sys.exit(0)
+
+
+def handle_trigger(cli_args):
+    with startup_report.phase("configuration"):
+        conf = get_conf()
+        setup_logging(conf, cli_args)
+    if not get_integration_sections(conf):
+        logger.info("No integration sections are configured, exiting")
+        return
+
+    logger.info("Reading ticket info")
+    with startup_report.phase("read ticket info"):
+        ticket_info_node = read_ticket_info_node()
+        if ticket_info_node is None:
+            logger.info("Testing")
+            return
+    ticket_id = int(ticket_info_node.findtext('id'))
+    stage_name = ticket_info_node.findtext('current_stage/name')
+    workflow_name = cli_args.workflow or ticket_info_node.findtext('workflow/name')
+
+    logger.info('Script is called for ticket id "{}"'.format(ticket_id))
+    # The same environment variable Secure_Change_API_Handler reads the trigger from
+    trigger = os.environ.get("SCW_EVENT")
+    if not has_sections_for_trigger(conf, trigger, stage_name, workflow_name):
+        logger.info("No integration section for trigger '{}' of step '{}' in workflow '{}', exiting".format(
+            trigger, stage_name, workflow_name or 'unknown'))
+        return
+
+    if cli_args.enqueue or str_to_bool(conf.get(QUEUE_SECTION_NAME, 'queue_enabled', default_value='false')):
+        with startup_report.phase("enqueue"):
+            get_trigger_queue(conf).enqueue(ticket_id, trigger, stage_name)
+        logger.info("Trigger '{}' of ticket id '{}' was queued".format(trigger, ticket_id))
+        return
+
+    from pytos.securechange.helpers import Secure_Change_API_Handler
+    from pytos.securechange.xml_objects.securechange_api import Ticket_Info
+    ticket_info = Ticket_Info(ticket_info_node)
+    sc_helper = get_sc_helper('securechange')
+    with startup_report.phase("template client"):
+        template_client = build_template_client(sc_helper)
 
     logger.info("before ticket")
     pre_step_name = ticket_info.current_stage_name
-    ticket = sc_helper.get_ticket_by_id(ticket_info.id)
+    with startup_report.phase("fetch ticket"):
+        ticket = sc_helper.get_ticket_by_id(ticket_info.id)
     logger.info("")
     logger.info("Ticket info")
     logger.info(ticket_info)
@@ -60,15 +212,126 @@ def main():
     logger.info("")
     logger.info(ticket_handler)
     logger.info("")
-    triggers_for_step = ('ADVANCE', 'CREATE', 'RESUBMIT')
-    ticket_handler.register_action(triggers_for_step, template_client.handle_step, ticket, pre_step_name)
-    trigger_for_action = ('CLOSE', 'CANCEL', 'REJECT', 'REDO', 'REOPEN', 'PRE_ASSIGNMENT_SCRIPT', 'AUTOMATION_FAILED')
+    ticket_handler.register_action(TRIGGERS_FOR_STEP, template_client.handle_step, ticket, pre_step_name)
     func_args = (ticket, ticket_handler._get_trigger_action())
-    ticket_handler.register_action(trigger_for_action, template_client.handle_action, *func_args)
+    ticket_handler.register_action(TRIGGERS_FOR_ACTION, template_client.handle_action, *func_args)
 
     logger.info('before run')
-    ticket_handler.run()
-    sys.exit(0)
+    with startup_report.phase("handle trigger"):
+        ticket_handler.run()
+
+
+def build_template_client(sc_helper):
+    from common.third_party.generic.rest.template_client import JsonTemplateClient
+    try:
+        return JsonTemplateClient.from_conf(sc_helper, get_credentials('securechange')[0])
+    except (NameError, ValueError) as error:
+        logger.error(error)
+        sys.exit(1)
+
+
+def handle_queued_trigger(template_client, sc_helper, item):
+    logger.info("Handling trigger '{}' of ticket id '{}', queued {:.1f} seconds ago, attempt {}".format(
+        item.trigger, item.ticket_id, time.time() - item.enqueued_at, item.attempts))
+    ticket = sc_helper.get_ticket_by_id(item.ticket_id)
+    if item.trigger in TRIGGERS_FOR_STEP:
+        template_client.handle_step(ticket, item.prev_step_name)
+    elif item.trigger in TRIGGERS_FOR_ACTION:
+        template_client.handle_action(ticket, item.trigger)
+
+
+def queue_worker(trigger_queue, template_client, sc_helper, stop_event, max_attempts, retry_delay, poll_interval,
+                 not_ready_delay, not_ready_max_age):
+    from common.third_party.generic.rest.ticket_wait import TicketNotReadyError
+    while not stop_event.is_set():
+        item = trigger_queue.claim()
+        if item is None:
+            stop_event.wait(poll_interval)
+            continue
+        try:
+            handle_queued_trigger(template_client, sc_helper, item)
+        except TicketNotReadyError as error:
+            # Waiting here would hold the worker, the trigger is checked again later
+            if time.time() - item.enqueued_at < not_ready_max_age:
+                logger.info("Ticket id '{}' is not ready, trigger '{}' is checked again in {} seconds".format(
+                    item.ticket_id, item.trigger, not_ready_delay))
+                trigger_queue.retry(item, not_ready_delay, count_attempt=False)
+            else:
+                logger.error("Dropping trigger '{}' of ticket id '{}'. Error: '{}'".format(
+                    item.trigger, item.ticket_id, error))
+                trigger_queue.complete(item)
+        except Exception as error:
+            if item.attempts < max_attempts:
+                delay = retry_delay * 2 ** (item.attempts - 1)
+                logger.error("Failed to handle trigger '{}' of ticket id '{}', retrying in {} seconds. Error: '{}'"
+                             .format(item.trigger, item.ticket_id, delay, error))
+                trigger_queue.retry(item, delay)
+            else:
+                logger.error("Failed to handle trigger '{}' of ticket id '{}' after {} attempts, dropping it. "
+                             "Error: '{}'\n{}".format(item.trigger, item.ticket_id, item.attempts, error,
+                                                      traceback.format_exc()))
+                trigger_queue.complete(item)
+        else:
+            trigger_queue.complete(item)
+
+
+def run_worker(cli_args):
+    conf = get_conf()
+    setup_logging(conf, cli_args)
+    trigger_queue = get_trigger_queue(conf)
+    try:
+        trigger_queue.recover()
+    except IOError as error:
+        logger.error(error)
+        sys.exit(1)
+    sc_helper = get_sc_helper('securechange')
+    workers_count = int(conf.get(QUEUE_SECTION_NAME, 'queue_workers', default_value=DEFAULT_QUEUE_WORKERS))
+    worker_args = (
+        int(conf.get(QUEUE_SECTION_NAME, 'queue_max_attempts', default_value=DEFAULT_QUEUE_MAX_ATTEMPTS)),
+        int(conf.get(QUEUE_SECTION_NAME, 'queue_retry_delay', default_value=DEFAULT_QUEUE_RETRY_DELAY)),
+        float(conf.get(QUEUE_SECTION_NAME, 'queue_poll_interval', default_value=DEFAULT_QUEUE_POLL_INTERVAL)),
+        float(conf.get(QUEUE_SECTION_NAME, 'queue_not_ready_delay', default_value=DEFAULT_QUEUE_NOT_READY_DELAY)),
+        float(conf.get(QUEUE_SECTION_NAME, 'queue_not_ready_max_age',
+                       default_value=DEFAULT_QUEUE_NOT_READY_MAX_AGE)),
+    )
+    wait_max_time = float(conf.get(QUEUE_SECTION_NAME, 'queue_wait_max_time',
+                                   default_value=DEFAULT_QUEUE_WAIT_MAX_TIME))
+    metrics_state_file, metrics_textfile_path = get_metrics_state_file(conf)
+    stop_event = threading.Event()
+    for signal_number in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signal_number, lambda *_: stop_event.set())
+
+    logger.info("Starting {} queue workers on '{}'".format(workers_count, trigger_queue.path))
+    workers = []
+    for index in range(workers_count):
+        # The template client keeps the state of the current run, each worker thread has its own
+        template_client = build_template_client(sc_helper)
+        template_client.wait_strategy.max_time = wait_max_time
+        workers.append(threading.Thread(target=queue_worker, name='queue-worker-{}'.format(index),
+                                        args=(trigger_queue, template_client, sc_helper, stop_event) + worker_args))
+    for worker in workers:
+        worker.start()
+    while not stop_event.wait(QUEUE_METRICS_INTERVAL):
+        record_queue_metrics(trigger_queue)
+        for name, labels, histogram in metrics.histograms():
+            snapshot = histogram.snapshot()
+            logger.info("{} {}: {count} observations, {sum:.1f} seconds in total".format(name, labels, **snapshot))
+        flush_metrics(metrics_state_file, metrics_textfile_path)
+    logger.info("Stopping queue workers, waiting for the running triggers")
+    for worker in workers:
+        worker.join()
+    record_queue_metrics(trigger_queue)
+    flush_metrics(metrics_state_file, metrics_textfile_path)
+
+
+def record_queue_metrics(trigger_queue):
+    """ Log the depth and age of the queue and set them on the queue gauges."""
+    queue_metrics = trigger_queue.metrics()
+    logger.info("Trigger queue: {depth} pending, {running} running, oldest pending {oldest_age} seconds".format(
+        **queue_metrics))
+    metrics.gauge(QUEUE_DEPTH_GAUGE).set(queue_metrics['depth'])
+    metrics.gauge(QUEUE_RUNNING_GAUGE).set(queue_metrics['running'])
+    metrics.gauge(QUEUE_OLDEST_AGE_GAUGE).set(queue_metrics['oldest_age'])
 
 
 if __name__ == '__main__':
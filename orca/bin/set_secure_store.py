@@ -12,7 +12,7 @@ from pytos.common.functions import str_to_bool
 
 CREDENTIAL_ITEMS = ["securetrack", "securechange"]
 conf = Secure_Config_Parser(config_file_path="/usr/local/orca/conf/custom.conf")
-secret_helper = SecretDb()
+secret_helper = SecretDb.shared()
 
 
 def get_cli_args():
@@ -92,49 +92,51 @@ def main():
     if cli_args.optional_credentials_to_set:
         credential_items_to_set = cli_args.optional_credentials_to_set
     credentials = {}
-    for credential_item in credential_items_to_set:
-        username_key = "username_" + credential_item
-        password_key = "password_" + credential_item
-        try:
-            try:
-                credentials[username_key] = secret_helper.get_username(credential_item)
-            except ValueError:
-                credentials[username_key] = None
-
+    # The values are written to the secure store once, when all the items were set or Control+D was pressed
+    with secret_helper.transaction():
+        for credential_item in credential_items_to_set:
+            username_key = "username_" + credential_item
+            password_key = "password_" + credential_item
             try:
-                credentials[password_key] = secret_helper.get_password(credential_item)
-            except ValueError:
-                credentials[password_key] = None
-
-            if not credentials[username_key] or cli_args.overwrite:
-                print("\r\rPlease enter the username for {}:".format(credential_item), end=' ')
-                username_string = input()
-                secret_helper.set_username(credential_item, username_string)
-                print("\r\rUsername for {} set.".format(credential_item))
-            else:
-                print("\r\rUsername for {} already set, skipping.".format(credential_item))
-            if not credentials[password_key] or cli_args.overwrite:
-                password_valid = False
-                password_string = ""
-                while not password_valid:
-                    password_string = getpass.unix_getpass(
-                        "\r\rPlease enter the password for {}:".format(credential_item))
-                    confirm_password_string = getpass.unix_getpass(
-                        "\r\rPlease confirm the password for {}:".format(credential_item))
-                    if password_string == confirm_password_string:
-                        password_valid = True
-                    else:
-                        print("\r\rThe passwords for {} do not match.".format(credential_item))
-                secret_helper.set_password(credential_item, password_string)
-                print("\r\rPassword for {} set.".format(credential_item))
-            else:
-                print("\r\rPassword for {} already set, skipping.".format(credential_item))
-        except KeyboardInterrupt:
-            sys.stdout.write("\r\r" + 75 * " ")
-            continue
-        except EOFError:
-            print("\nControl+D pressed, exiting.")
-            sys.exit(0)
+                try:
+                    credentials[username_key] = secret_helper.get_username(credential_item)
+                except ValueError:
+                    credentials[username_key] = None
+
+                try:
+                    credentials[password_key] = secret_helper.get_password(credential_item)
+                except ValueError:
+                    credentials[password_key] = None
+
+                if not credentials[username_key] or cli_args.overwrite:
+                    print("\r\rPlease enter the username for {}:".format(credential_item), end=' ')
+                    username_string = input()
+                    secret_helper.set_username(credential_item, username_string)
+                    print("\r\rUsername for {} set.".format(credential_item))
+                else:
+                    print("\r\rUsername for {} already set, skipping.".format(credential_item))
+                if not credentials[password_key] or cli_args.overwrite:
+                    password_valid = False
+                    password_string = ""
+                    while not password_valid:
+                        password_string = getpass.unix_getpass(
+                            "\r\rPlease enter the password for {}:".format(credential_item))
+                        confirm_password_string = getpass.unix_getpass(
+                            "\r\rPlease confirm the password for {}:".format(credential_item))
+                        if password_string == confirm_password_string:
+                            password_valid = True
+                        else:
+                            print("\r\rThe passwords for {} do not match.".format(credential_item))
+                    secret_helper.set_password(credential_item, password_string)
+                    print("\r\rPassword for {} set.".format(credential_item))
+                else:
+                    print("\r\rPassword for {} already set, skipping.".format(credential_item))
+            except KeyboardInterrupt:
+                sys.stdout.write("\r\r" + 75 * " ")
+                continue
+            except EOFError:
+                print("\nControl+D pressed, exiting.")
+                break
     print("\r\r")
 
     sys.exit(0)
@@ -0,0 +1,98 @@
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+CONF_FILE_PATH = "/usr/local/orca/conf/custom.conf"
+
+_conf = None
+_sc_helpers = {}
+_st_helpers = {}
+_lock = threading.Lock()
+
+
+def get_conf():
+    """
+    Get the configuration of the process, custom.conf is parsed once on the first call.
+    """
+    global _conf
+    if _conf is None:
+        with _lock:
+            if _conf is None:
+                from pytos.common.functions.config import Secure_Config_Parser
+                _conf = Secure_Config_Parser(config_file_path=CONF_FILE_PATH)
+    return _conf
+
+
+def get_secret_store():
+    from common.secret_store import SecretDb
+    return SecretDb.shared()
+
+
+def get_credentials(secure_store_key):
+    """
+    :return: (username, password) stored in the secure store for the key
+    """
+    secret_store = get_secret_store()
+    return secret_store.get_username(secure_store_key), secret_store.get_password(secure_store_key)
+
+
+def get_sc_helper(secure_store_key='securechange', host=None):
+    """
+    Get the SecureChange helper that uses the credentials of a secure store key, built once per host and key.
+    :param host: The host of the [securechange] section by default
+    """
+    host = host or get_conf().get("securechange", "host")
+    try:
+        return _sc_helpers[(host, secure_store_key)]
+    except KeyError:
+        pass
+    from pytos.securechange.helpers import Secure_Change_Helper
+    sc_helper = Secure_Change_Helper(host, get_credentials(secure_store_key))
+    with _lock:
+        return _sc_helpers.setdefault((host, secure_store_key), sc_helper)
+
+
+def get_st_helper(secure_store_key='securetrack', host=None):
+    """
+    Get the SecureTrack helper that uses the credentials of a secure store key, built once per host and key.
+    :param host: The host of the [securetrack] section by default
+    """
+    host = host or get_conf().get("securetrack", "host")
+    try:
+        return _st_helpers[(host, secure_store_key)]
+    except KeyError:
+        pass
+    from pytos.securetrack.helpers import Secure_Track_Helper
+    st_helper = Secure_Track_Helper(host, get_credentials(secure_store_key))
+    with _lock:
+        return _st_helpers.setdefault((host, secure_store_key), st_helper)
+
+
+class StartupReport:
+    """
+    Durations of the startup phases of a script, printed with the --startup-report option.
+    """
+
+    def __init__(self, start_time=None):
+        self.start_time = time.perf_counter() if start_time is None else start_time
+        self.phases = []
+
+    def add(self, name, duration):
+        self.phases.append((name, duration))
+
+    @contextmanager
+    def phase(self, name):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start_time)
+
+    def __str__(self):
+        lines = ["{:<32} {:>9.1f} ms".format(name, duration * 1000) for name, duration in self.phases]
+        lines.append("{:<32} {:>9.1f} ms".format("total", (time.perf_counter() - self.start_time) * 1000))
+        return "\n".join(lines)
+
+    def print(self, stream=None):
+        print(self, file=stream or sys.stderr)
@@ -0,0 +1,153 @@
+import ipaddress
+import logging
+import socket
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from pytos.common.logging.definitions import COMMON_LOGGER_NAME
+
+logger = logging.getLogger(COMMON_LOGGER_NAME)
+
+DEFAULT_WORKERS = 16
+DEFAULT_TTL = 300
+DEFAULT_NEGATIVE_TTL = 60
+DEFAULT_TIMEOUT = 30
+
+
+class DnsResolver:
+    """
+    Resolve Orca destinations concurrently.
+    Results are kept in a TTL cache and failures in a negative cache, both living as long as the resolver does,
+    so a daemon that keeps one resolver does not resolve the same names on every monitor cycle.
+    """
+
+    def __init__(self, max_workers=DEFAULT_WORKERS, ttl=DEFAULT_TTL, negative_ttl=DEFAULT_NEGATIVE_TTL,
+                 timeout=DEFAULT_TIMEOUT):
+        """
+        :param max_workers: Maximum number of concurrent lookups
+        :param ttl: Seconds to keep resolved addresses
+        :param negative_ttl: Seconds to remember that a name could not be resolved
+        :param timeout: Seconds to wait for a batch of lookups before reporting the pending names as unresolved
+        """
+        self.max_workers = max_workers
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.timeout = timeout
+        self._cache = {}
+        self._negative_cache = {}
+        self._last_addresses = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_conf(cls, conf, section="integration setup"):
+        return cls(max_workers=int(conf.get(section, 'dns_workers', default_value=DEFAULT_WORKERS)),
+                   ttl=int(conf.get(section, 'dns_cache_ttl', default_value=DEFAULT_TTL)),
+                   negative_ttl=int(conf.get(section, 'dns_negative_cache_ttl', default_value=DEFAULT_NEGATIVE_TTL)),
+                   timeout=int(conf.get(section, 'dns_timeout', default_value=DEFAULT_TIMEOUT)))
+
+    @staticmethod
+    def _parse_literal(name):
+        try:
+            network = ipaddress.IPv4Network(name)
+        except ValueError:
+            return None
+        if network.prefixlen == network.max_prefixlen:
+            return [str(network.network_address)]
+        return [str(network)]
+
+    @staticmethod
+    def _lookup(name):
+        addresses = {info[4][0] for info in socket.getaddrinfo(name, None, socket.AF_INET, socket.SOCK_STREAM)}
+        return sorted(addresses, key=lambda address: ipaddress.IPv4Address(address))
+
+    def _get_cached(self, name, now):
+        with self._lock:
+            try:
+                addresses, expires = self._cache[name]
+            except KeyError:
+                pass
+            else:
+                if expires > now:
+                    return addresses, None
+                del self._cache[name]
+            try:
+                error, expires = self._negative_cache[name]
+            except KeyError:
+                pass
+            else:
+                if expires > now:
+                    return None, error
+                del self._negative_cache[name]
+        return None, None
+
+    def last_addresses(self, name):
+        """
+        :return: The addresses the name resolved to the last time it was resolved by this resolver, or an empty list
+        """
+        with self._lock:
+            return list(self._last_addresses.get(name, ()))
+
+    def resolve(self, names):
+        """
+        Resolve names to all of their A records.
+        :param names: An iterable of host names, IP addresses or CIDR networks
+        :return: (OrderedDict of name to list of addresses, OrderedDict of unresolved name to error message)
+        """
+        names = list(OrderedDict.fromkeys(names))
+        now = time.monotonic()
+        resolved, unresolved, to_lookup = OrderedDict(), OrderedDict(), []
+        for name in names:
+            literal = self._parse_literal(name)
+            if literal:
+                resolved[name] = literal
+                continue
+            addresses, error = self._get_cached(name, now)
+            if addresses:
+                resolved[name] = addresses
+            elif error:
+                unresolved[name] = error
+            else:
+                to_lookup.append(name)
+
+        if to_lookup:
+            logger.debug("Resolving {} names, {} served from cache".format(len(to_lookup),
+                                                                           len(resolved) + len(unresolved)))
+            executor = ThreadPoolExecutor(max_workers=min(self.max_workers, len(to_lookup)))
+            futures = {executor.submit(self._lookup, name): name for name in to_lookup}
+            done, not_done = wait(futures, timeout=self.timeout)
+            executor.shutdown(wait=False)
+            now = time.monotonic()
+            results, timed_out = {}, set()
+            for future in done:
+                name = futures[future]
+                try:
+                    results[name] = future.result(), None
+                except (OSError, UnicodeError) as error:
+                    results[name] = None, str(error)
+            for future in not_done:
+                timed_out.add(futures[future])
+                results[futures[future]] = None, "Timed out after {} seconds".format(self.timeout)
+
+            with self._lock:
+                for name, (addresses, error) in results.items():
+                    if addresses:
+                        self._cache[name] = addresses, now + self.ttl
+                        self._last_addresses[name] = addresses
+                    elif name not in timed_out:
+                        self._negative_cache[name] = error or "No address records", now + self.negative_ttl
+
+            for name in to_lookup:
+                addresses, error = results[name]
+                if addresses:
+                    resolved[name] = addresses
+                else:
+                    unresolved[name] = error or "No address records"
+
+        # Keep the order in which the names were given
+        ordered_resolved = OrderedDict((name, resolved[name]) for name in names if name in resolved)
+        ordered_unresolved = OrderedDict((name, unresolved[name]) for name in names if name in unresolved)
+        for name, error in ordered_unresolved.items():
+            logger.warning("Could not resolve '{}'. Error: '{}'".format(name, error))
+        return ordered_resolved, ordered_unresolved
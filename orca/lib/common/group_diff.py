@@ -0,0 +1,130 @@
+import bisect
+import ipaddress
+from collections import namedtuple
+
+GroupDiff = namedtuple('GroupDiff', ['unchanged', 'deleted', 'added'])
+
+
+def parse_address(address):
+    """
+    Get the address interval of a normalized address, as returned by st_object_index.address_key.
+    Intervals of IPv4 and IPv6 addresses are kept apart by the version in the high bits, so they never overlap.
+    :param address: 'ip', 'ip/cidr' or '[first-last]'
+    :return: (first, last) integers or None if the address can not be parsed
+    """
+    if not address:
+        return None
+    try:
+        if address.startswith('['):
+            first, last = (ipaddress.ip_address(ip.strip()) for ip in address.strip('[]').split('-', 1))
+            if first.version != last.version or first > last:
+                return None
+        elif '/' not in address:
+            first = last = ipaddress.ip_address(address)
+        else:
+            network = ipaddress.ip_network(address, strict=False)
+            first, last = network.network_address, network.broadcast_address
+    except ValueError:
+        return None
+    version = first.version << 128
+    return version | int(first), version | int(last)
+
+
+class IntervalIndex:
+    """
+    Sorted address intervals that answer in O(log n) whether an interval is covered by one of them, using the maximal
+    end of every prefix, and whether one of them lies within an interval, using the minimal end of every suffix.
+    """
+
+    def __init__(self, intervals):
+        intervals = sorted(intervals)
+        self._starts = [first for first, _ in intervals]
+        self._prefix_max_end = []
+        max_end = -1
+        for _, last in intervals:
+            max_end = max(max_end, last)
+            self._prefix_max_end.append(max_end)
+        self._suffix_min_end = [0] * len(intervals)
+        min_end = None
+        for position in range(len(intervals) - 1, -1, -1):
+            last = intervals[position][1]
+            min_end = last if min_end is None else min(min_end, last)
+            self._suffix_min_end[position] = min_end
+
+    def __len__(self):
+        return len(self._starts)
+
+    def covers(self, interval):
+        """ Is the interval within one of the intervals of the index."""
+        position = bisect.bisect_right(self._starts, interval[0]) - 1
+        return position >= 0 and self._prefix_max_end[position] >= interval[1]
+
+    def has_within(self, interval):
+        """ Is one of the intervals of the index within the interval."""
+        position = bisect.bisect_left(self._starts, interval[0])
+        return position < len(self._starts) and self._suffix_min_end[position] <= interval[1]
+
+
+def deduplicate(addresses):
+    """
+    Remove the addresses that are repeated or covered by another address, e.g. a host within a subnet.
+    Addresses that can not be parsed are only deduplicated by their text.
+    :return: A list of the remaining addresses, in their original order
+    """
+    unique, intervals = {}, {}
+    for address in addresses:
+        if address in unique:
+            continue
+        unique[address] = None
+        interval = parse_address(address)
+        if interval is not None:
+            intervals.setdefault(interval, address)
+    # Widest interval first among intervals with the same start, so it covers the rest
+    covered, max_end = set(), -1
+    for interval in sorted(intervals, key=lambda item: (item[0], -item[1])):
+        if interval[1] <= max_end:
+            covered.add(intervals[interval])
+        max_end = max(max_end, interval[1])
+    kept_addresses = set(intervals.values())
+    return [address for address in unique
+            if address not in covered and (address in kept_addresses or parse_address(address) is None)]
+
+
+class MembershipDiff:
+    """
+    Diff of the current members of groups against the addresses they should have.
+    A member is unchanged if it matches or contains one of the addresses, an address is added only if no unchanged
+    member covers it, so a host that is already part of a subnet or range member is not added again.
+    The addresses are indexed once and can be diffed against any number of groups, in O(n log n) each.
+    """
+
+    def __init__(self, addresses):
+        self.addresses = deduplicate(addresses)
+        self._intervals = [(address, parse_address(address)) for address in self.addresses]
+        self._texts = {address for address, interval in self._intervals if interval is None}
+        self._index = IntervalIndex(interval for _, interval in self._intervals if interval is not None)
+
+    def diff(self, members):
+        """
+        :param members: Iterable of (address, member) of the current members of a group
+        :return: GroupDiff of the unchanged and deleted members and of the addresses to add
+        """
+        unchanged, deleted, unchanged_intervals, unchanged_texts = [], [], [], set()
+        for address, member in members:
+            interval = parse_address(address)
+            if interval is None:
+                is_unchanged = address in self._texts
+            else:
+                is_unchanged = self._index.has_within(interval)
+            if is_unchanged:
+                unchanged.append(member)
+                if interval is None:
+                    unchanged_texts.add(address)
+                else:
+                    unchanged_intervals.append(interval)
+            else:
+                deleted.append(member)
+        unchanged_index = IntervalIndex(unchanged_intervals)
+        added = [address for address, interval in self._intervals
+                 if (address not in unchanged_texts if interval is None else not unchanged_index.covers(interval))]
+        return GroupDiff(unchanged, deleted, added)
@@ -0,0 +1,269 @@
+import logging
+import random
+import threading
+import time
+
+import requests
+import urllib3
+
+from pytos.common.logging.definitions import COMMON_LOGGER_NAME
+
+logger = logging.getLogger(COMMON_LOGGER_NAME)
+
+DEFAULT_POLICY_SECTION = 'integration setup'
+DEFAULT_RETRY_STATUS_CODES = (429, 502, 503, 504)
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+# Status codes of requests that were refused without being handled, safe to resend for any method
+UNHANDLED_STATUS_CODES = (429, 503)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitOpenError(IOError):
+    pass
+
+
+def _is_connect_error(error):
+    """ Check if the request failed before it was sent, e.g. the connection was refused or timed out."""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if not isinstance(error, requests.exceptions.ConnectionError):
+        return False
+    reason = error.args[0] if error.args else None
+    reason = getattr(reason, 'reason', reason)
+    return isinstance(reason, urllib3.exceptions.NewConnectionError)
+
+
+class TokenBucket:
+    """
+    Limit the rate of calls to rate per second, allowing bursts of up to burst calls.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = max(float(burst), 1.0)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """ Wait until a call is allowed.
+        :return: The number of seconds waited
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class CircuitBreaker:
+    """
+    Stop calling a host after failure_threshold consecutive failures.
+    After reset_timeout seconds a single probe call is allowed, the breaker closes if it succeeds.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def _set_state(self, state):
+        if state != self.state:
+            log = logger.info if state == CLOSED else logger.warning
+            log("Circuit breaker for '{}' changed from {} to {}, consecutive failures: {}".format(
+                self.name, self.state, state, self.failures))
+            self.state = state
+
+    def before_call(self):
+        """
+        :raise CircuitOpenError: If the host should not be called now
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self._set_state(HALF_OPEN)
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+            raise CircuitOpenError("Circuit breaker for '{}' is {}, not sending the request".format(
+                self.name, self.state))
+
+    def record_success(self):
+        with self._lock:
+            self._probing = False
+            self._set_state(CLOSED)
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._probing = False
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self._set_state(OPEN)
+
+
+class HttpPolicy:
+    """
+    Outbound call policy for the hosts of an integration: a token bucket rate limit, retries with jittered
+    exponential backoff on transient errors and a circuit breaker, all kept per host.
+    """
+
+    def __init__(self, rate_limit=0, rate_limit_burst=1, max_attempts=3, backoff=1.0, backoff_max=30.0,
+                 retry_status_codes=DEFAULT_RETRY_STATUS_CODES, failure_threshold=5, reset_timeout=30):
+        """
+        :param rate_limit: Calls per second to a host, 0 for no limit
+        :param max_attempts: Attempts of a call including the first one
+        :param backoff: Seconds of the first retry delay, doubled on every retry up to backoff_max
+        :param failure_threshold: Consecutive failures that open the circuit breaker of a host, 0 to disable it
+        :param reset_timeout: Seconds before an open circuit breaker lets a probe call through
+        """
+        self.rate_limit = float(rate_limit)
+        self.rate_limit_burst = rate_limit_burst
+        self.max_attempts = max(int(max_attempts), 1)
+        self.backoff = float(backoff)
+        self.backoff_max = float(backoff_max)
+        self.retry_status_codes = tuple(retry_status_codes)
+        self.failure_threshold = int(failure_threshold)
+        self.reset_timeout = float(reset_timeout)
+        self._buckets = {}
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_conf(cls, conf, section=DEFAULT_POLICY_SECTION):
+        """
+        Read the policy from a configuration section, options missing from it are read from the integration setup
+        section.
+        """
+        def get(option, default):
+            fallback = conf.get(DEFAULT_POLICY_SECTION, option, default_value=default)
+            return conf.get(section, option, default_value=fallback)
+
+        retry_status_codes = get('retry_status_codes', ','.join(str(code) for code in DEFAULT_RETRY_STATUS_CODES))
+        return cls(
+            rate_limit=float(get('rate_limit', 0)),
+            rate_limit_burst=float(get('rate_limit_burst', 1)),
+            max_attempts=int(get('retry_max_attempts', 3)),
+            backoff=float(get('retry_backoff', 1)),
+            backoff_max=float(get('retry_backoff_max', 30)),
+            retry_status_codes=[int(code) for code in str(retry_status_codes).split(',') if code.strip()],
+            failure_threshold=int(get('breaker_failure_threshold', 5)),
+            reset_timeout=float(get('breaker_reset_timeout', 30)),
+        )
+
+    def _host_state(self, host):
+        with self._lock:
+            try:
+                return self._buckets[host], self._breakers[host]
+            except KeyError:
+                bucket = TokenBucket(self.rate_limit, self.rate_limit_burst) if self.rate_limit > 0 else None
+                breaker = CircuitBreaker(host, self.failure_threshold, self.reset_timeout) \
+                    if self.failure_threshold > 0 else None
+                self._buckets[host], self._breakers[host] = bucket, breaker
+                return bucket, breaker
+
+    def _is_host_failure(self, error):
+        """ Only a 4xx status that is not retried shows that the host is healthy."""
+        status_code = getattr(error, 'status_code', None)
+        return status_code is None or status_code >= 500 or status_code in self.retry_status_codes
+
+    def _is_transient(self, method, error):
+        # Only resend a request that may have been handled if that is safe
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+        status_code = getattr(error, 'status_code', None)
+        if status_code is not None:
+            return status_code in self.retry_status_codes and (idempotent or status_code in UNHANDLED_STATUS_CODES)
+        if _is_connect_error(error):
+            return True
+        return idempotent and isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+    def retry_delay(self, attempt):
+        """ Full jitter: a random delay up to the exponential backoff of the attempt."""
+        return random.uniform(0, min(self.backoff_max, self.backoff * 2 ** (attempt - 1)))
+
+    def call(self, host, method, send):
+        """
+        Call send() under the policy of the host.
+        :param send: A function that sends the request and raises IOError if it failed
+        :raise CircuitOpenError: If the circuit breaker of the host is open
+        """
+        bucket, breaker = self._host_state(host)
+        attempt = 1
+        while True:
+            if breaker is not None:
+                breaker.before_call()
+            if bucket is not None:
+                bucket.acquire()
+            try:
+                result = send()
+            except IOError as error:
+                if breaker is not None:
+                    if self._is_host_failure(error):
+                        breaker.record_failure()
+                    else:
+                        # The host answered, it is healthy even if the request was rejected
+                        breaker.record_success()
+                if not self._is_transient(method, error) or attempt >= self.max_attempts:
+                    raise
+                delay = self.retry_delay(attempt)
+                logger.warning("{} request to '{}' failed, attempt {} of {}, retrying in {:.1f} seconds. "
+                               "Error: '{}'".format(method.upper(), host, attempt, self.max_attempts, delay, error))
+                time.sleep(delay)
+                attempt += 1
+            except Exception:
+                # Also ends the probe of a half-open breaker
+                if breaker is not None:
+                    breaker.record_failure()
+                raise
+            else:
+                if breaker is not None:
+                    breaker.record_success()
+                return result
+
+    def states(self):
+        """
+        :return: A dict of host to the state and consecutive failures of its circuit breaker
+        """
+        with self._lock:
+            breakers = list(self._breakers.items())
+        return {host: {'state': breaker.state, 'failures': breaker.failures}
+                for host, breaker in breakers if breaker is not None}
+
+    def log_states(self):
+        for host, host_state in self.states().items():
+            log = logger.debug if host_state['state'] == CLOSED else logger.warning
+            log("Circuit breaker for '{}' is {state}, {failures} consecutive failures".format(host, **host_state))
+
+
+_policies = {}
+_policies_lock = threading.Lock()
+
+
+def get_http_policy(conf, section=DEFAULT_POLICY_SECTION):
+    """
+    Get the policy of a configuration section, policies are kept for the life of the process so the state of the
+    hosts is shared by all the calls made under the same section.
+    """
+    with _policies_lock:
+        try:
+            return _policies[section]
+        except KeyError:
+            policy = _policies[section] = HttpPolicy.from_conf(conf, section)
+            return policy
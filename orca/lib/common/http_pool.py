@@ -0,0 +1,153 @@
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPBasicAuth, HTTPDigestAuth
+
+from pytos.common.logging.definitions import COMMON_LOGGER_NAME
+
+logger = logging.getLogger(COMMON_LOGGER_NAME)
+
+DEFAULT_MAX_CONNECTIONS_PER_HOST = 10
+DEFAULT_TIMEOUT = 300
+
+
+class HttpStatusError(IOError):
+    def __init__(self, method, url, status_code, content):
+        self.status_code = status_code
+        self.content = content
+        super().__init__("{} '{}' returned unexpected status code {}. Response: '{}'".format(
+            method.upper(), url, status_code, content))
+
+
+class HttpSessionPool:
+    """
+    Keep-alive HTTP sessions shared by all the clients of a process.
+    There is one session per protocol and host, each holding up to max_connections_per_host reusable connections,
+    so repeated calls to the same host skip the TCP and TLS handshakes. A host can be given its own limit.
+    """
+
+    def __init__(self, max_connections_per_host=DEFAULT_MAX_CONNECTIONS_PER_HOST):
+        self.max_connections_per_host = max_connections_per_host
+        self._host_limits = {}
+        self._sessions = {}
+        self._requests_count = {}
+        self._lock = threading.Lock()
+
+    def _mount_adapter(self, session, hostname, protocol):
+        max_connections = self._host_limits.get(hostname, self.max_connections_per_host)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_connections, pool_block=True)
+        session.mount("{}://".format(protocol), adapter)
+
+    def set_host_limit(self, hostname, max_connections):
+        """
+        Set the connection limit of a host, for all protocols. When several clients set a limit for the same host,
+        the highest one is kept.
+        """
+        with self._lock:
+            max_connections = max(int(max_connections), self._host_limits.get(hostname, 0))
+            if self._host_limits.get(hostname) == max_connections:
+                return
+            self._host_limits[hostname] = max_connections
+            for (protocol, session_hostname), session in self._sessions.items():
+                if session_hostname == hostname:
+                    self._mount_adapter(session, hostname, protocol)
+
+    def session(self, hostname, protocol='https'):
+        key = (protocol, hostname)
+        with self._lock:
+            try:
+                return self._sessions[key]
+            except KeyError:
+                session = requests.Session()
+                self._mount_adapter(session, hostname, protocol)
+                self._sessions[key] = session
+                self._requests_count[key] = 0
+                return session
+
+    @staticmethod
+    def get_auth(login_data, auth_method='basic'):
+        if not login_data:
+            return None
+        auth_class = HTTPDigestAuth if str(auth_method).lower().endswith('digest') else HTTPBasicAuth
+        return auth_class(login_data['username'], login_data['password'])
+
+    def request(self, method, hostname, uri, protocol='https', expected_status_codes=(200,), headers=None, body=None,
+                login_data=None, auth_method='basic', verify_ssl=False, proxies=None, timeout=DEFAULT_TIMEOUT,
+                policy=None):
+        """
+        Send a request on the pooled session of the host.
+        :param expected_status_codes: A status code or a list of status codes, any other status raises HttpStatusError
+        :param policy: http_policy.HttpPolicy for rate limiting, retries and circuit breaking, None for a single attempt
+        :return: requests.Response
+        :raise IOError: On connection errors or unexpected status codes
+        """
+        if isinstance(expected_status_codes, int):
+            expected_status_codes = (expected_status_codes,)
+        url = "{}://{}{}".format(protocol, hostname, uri)
+        session = self.session(hostname, protocol)
+        auth = self.get_auth(login_data, auth_method)
+
+        def send():
+            with self._lock:
+                self._requests_count[(protocol, hostname)] += 1
+            response = session.request(method.upper(), url, headers=headers, data=body, verify=verify_ssl,
+                                       auth=auth, proxies=proxies or None, timeout=timeout)
+            if response.status_code not in expected_status_codes:
+                raise HttpStatusError(method, url, response.status_code,
+                                      response.content.decode('utf-8', 'replace'))
+            return response
+
+        if policy is None:
+            return send()
+        return policy.call("{}://{}".format(protocol, hostname), method, send)
+
+    def metrics(self):
+        """
+        :return: A dict of 'protocol://host' to its number of requests, opened connections and reused connections
+        """
+        metrics = {}
+        with self._lock:
+            sessions = list(self._sessions.items())
+        for (protocol, hostname), session in sessions:
+            connections = 0
+            pools = session.get_adapter("{}://".format(protocol)).poolmanager.pools
+            for pool_key in list(pools.keys()):
+                pool = pools.get(pool_key)
+                if pool is not None:
+                    connections += pool.num_connections
+            requests_count = self._requests_count[(protocol, hostname)]
+            metrics["{}://{}".format(protocol, hostname)] = {
+                'requests': requests_count,
+                'connections': connections,
+                'reused': max(requests_count - connections, 0)
+            }
+        return metrics
+
+    def log_metrics(self):
+        for host, host_metrics in self.metrics().items():
+            logger.debug("HTTP pool '{}': {requests} requests, {connections} connections opened, "
+                         "{reused} reused".format(host, **host_metrics))
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+
+_session_pool = None
+_session_pool_lock = threading.Lock()
+
+
+def get_session_pool(max_connections_per_host=None):
+    """
+    Get the process wide session pool, the connection limit is only used when the pool is created.
+    Use HttpSessionPool.set_host_limit for the limit of a single host.
+    """
+    global _session_pool
+    with _session_pool_lock:
+        if _session_pool is None:
+            _session_pool = HttpSessionPool(max_connections_per_host or DEFAULT_MAX_CONNECTIONS_PER_HOST)
+        return _session_pool
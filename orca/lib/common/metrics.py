@@ -0,0 +1,402 @@
+import bisect
+import fcntl
+import json
+import logging
+import os
+import socketserver
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from pytos.common.logging.definitions import COMMON_LOGGER_NAME
+
+logger = logging.getLogger(COMMON_LOGGER_NAME)
+
+DEFAULT_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+PHASE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+DEFAULT_METRICS_PORT = 9464
+METRICS_PATH = '/metrics'
+
+
+class Histogram:
+    """
+    Distribution of observed values in cumulative buckets, like a Prometheus histogram.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self._counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        """
+        :return: dict with the cumulative count of each bucket upper bound ('+Inf' for all), the sum and the count
+        """
+        with self._lock:
+            counts, total, count = list(self._counts), self.sum, self.count
+        cumulative, buckets = 0, {}
+        for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+            cumulative += bucket_count
+            buckets[bound] = cumulative
+        return {'buckets': buckets, 'sum': total, 'count': count}
+
+    def state(self):
+        """
+        :return: dict with the bucket upper bounds, the count of each bucket (not cumulative, the last one is for
+                 values above all the bounds), the sum and the count
+        """
+        with self._lock:
+            return {'buckets': list(self.buckets), 'counts': list(self._counts), 'sum': self.sum, 'count': self.count}
+
+
+class Counter:
+    """
+    Value that only goes up, like a Prometheus counter.
+    """
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class Gauge:
+    """
+    Value that can go up and down, like a Prometheus gauge.
+    """
+
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value):
+        self.value = float(value)
+
+
+_histograms = {}
+_counters = {}
+_gauges = {}
+_descriptions = {}
+_lock = threading.Lock()
+
+
+def _labels_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def histogram(name, buckets=DEFAULT_BUCKETS, **labels):
+    """
+    Get the histogram of a metric name and label values, it is created on the first call.
+    """
+    key = (name, _labels_key(labels))
+    with _lock:
+        try:
+            return _histograms[key]
+        except KeyError:
+            metric = _histograms[key] = Histogram(buckets)
+            return metric
+
+
+def histograms():
+    """
+    :return: A list of (name, labels dict, Histogram) of all the histograms of the process
+    """
+    with _lock:
+        items = list(_histograms.items())
+    return [(name, dict(labels), metric) for (name, labels), metric in items]
+
+
+def counter(name, **labels):
+    """
+    Get the counter of a metric name and label values, it is created on the first call.
+    """
+    key = (name, _labels_key(labels))
+    with _lock:
+        try:
+            return _counters[key]
+        except KeyError:
+            metric = _counters[key] = Counter()
+            return metric
+
+
+def counters():
+    """
+    :return: A list of (name, labels dict, Counter) of all the counters of the process
+    """
+    with _lock:
+        items = list(_counters.items())
+    return [(name, dict(labels), metric) for (name, labels), metric in items]
+
+
+def gauge(name, **labels):
+    """
+    Get the gauge of a metric name and label values, it is created on the first call.
+    """
+    key = (name, _labels_key(labels))
+    with _lock:
+        try:
+            return _gauges[key]
+        except KeyError:
+            metric = _gauges[key] = Gauge()
+            return metric
+
+
+def gauges():
+    """
+    :return: A list of (name, labels dict, Gauge) of all the gauges of the process
+    """
+    with _lock:
+        items = list(_gauges.items())
+    return [(name, dict(labels), metric) for (name, labels), metric in items]
+
+
+def describe(name, description):
+    """ Set the HELP text of a metric name in the exported metrics."""
+    with _lock:
+        _descriptions[name] = description
+
+
+@contextmanager
+def timed(name, errors_name=None, buckets=PHASE_BUCKETS, **labels):
+    """
+    Observe the seconds the block takes in the histogram of name and labels.
+    :param errors_name: Counter that is incremented, with the same labels, when the block raises an exception
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        if errors_name:
+            counter(errors_name, **labels).inc()
+        raise
+    finally:
+        histogram(name, buckets, **labels).observe(time.perf_counter() - start)
+
+
+def _state_key(name, labels):
+    return json.dumps([name, sorted(labels.items())])
+
+
+def collect():
+    """
+    :return: The state of all the metrics of the process, a dict with the 'counters', 'gauges' and 'histograms' of
+             the process by key. Every counter and gauge has its name, labels and value, every histogram its name,
+             labels and Histogram.state
+    """
+    state = {'counters': {}, 'gauges': {}, 'histograms': {}}
+    for name, labels, metric in counters():
+        state['counters'][_state_key(name, labels)] = {'name': name, 'labels': labels, 'value': metric.value}
+    for name, labels, metric in gauges():
+        state['gauges'][_state_key(name, labels)] = {'name': name, 'labels': labels, 'value': metric.value}
+    for name, labels, metric in histograms():
+        state['histograms'][_state_key(name, labels)] = dict(metric.state(), name=name, labels=labels)
+    return state
+
+
+def _combine_states(base, other, sign):
+    """
+    Add (sign 1) or subtract (sign -1) the values of other to a copy of base.
+    Gauges are not added, the gauges of other replace the ones of base when adding and are ignored when subtracting.
+    """
+    result = json.loads(json.dumps(base))
+    result_gauges = result.setdefault('gauges', {})
+    if sign > 0:
+        result_gauges.update(json.loads(json.dumps(other.get('gauges', {}))))
+    for key, metric in other.get('counters', {}).items():
+        current = result['counters'].setdefault(key, dict(metric, value=0.0))
+        current['value'] += sign * metric['value']
+    for key, metric in other.get('histograms', {}).items():
+        current = result['histograms'].get(key)
+        if current is None or current['buckets'] != metric['buckets']:
+            # A histogram whose buckets changed starts over
+            current = result['histograms'][key] = dict(metric, counts=[0] * len(metric['counts']), sum=0.0, count=0)
+        current['counts'] = [mine + sign * theirs for mine, theirs in zip(current['counts'], metric['counts'])]
+        current['sum'] += sign * metric['sum']
+        current['count'] += sign * metric['count']
+    return result
+
+
+def merge_states(base, other):
+    """
+    :return: A new state with the values of other added to the values of base
+    """
+    return _combine_states(base, other, 1)
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels, extra=()):
+    items = sorted(labels.items()) + list(extra)
+    if not items:
+        return ''
+    return '{{{}}}'.format(','.join('{}="{}"'.format(name, _escape_label(value)) for name, value in items))
+
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def render(state=None):
+    """
+    Format metrics in the Prometheus text exposition format.
+    :param state: A state returned by collect or merge_states, the metrics of the process by default
+    """
+    if state is None:
+        state = collect()
+    with _lock:
+        descriptions = dict(_descriptions)
+    families = {}
+    for metric in state['counters'].values():
+        families.setdefault((metric['name'], 'counter'), []).append(metric)
+    for metric in state.get('gauges', {}).values():
+        families.setdefault((metric['name'], 'gauge'), []).append(metric)
+    for metric in state['histograms'].values():
+        families.setdefault((metric['name'], 'histogram'), []).append(metric)
+
+    lines = []
+    for (name, metric_type), metrics in sorted(families.items()):
+        if name in descriptions:
+            lines.append('# HELP {} {}'.format(name, descriptions[name].replace('\n', ' ')))
+        lines.append('# TYPE {} {}'.format(name, metric_type))
+        for metric in sorted(metrics, key=lambda m: sorted(m['labels'].items())):
+            labels = metric['labels']
+            if metric_type in ('counter', 'gauge'):
+                lines.append('{}{} {}'.format(name, _format_labels(labels), _format_value(metric['value'])))
+                continue
+            cumulative = 0
+            for bound, count in zip(metric['buckets'] + ['+Inf'], metric['counts']):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(name, _format_labels(labels, [('le', _format_value(bound))]),
+                                                     cumulative))
+            lines.append('{}_sum{} {}'.format(name, _format_labels(labels), _format_value(metric['sum'])))
+            lines.append('{}_count{} {}'.format(name, _format_labels(labels), metric['count']))
+    return '\n'.join(lines) + '\n'
+
+
+def _write_atomically(path, text):
+    """ Write to a temporary file renamed over path, readers never see a partial file."""
+    directory, file_name = os.path.split(path)
+    temp_fd, temp_path = tempfile.mkstemp(prefix='.' + file_name + '.', dir=directory or None)
+    try:
+        with os.fdopen(temp_fd, 'w') as temp_file:
+            temp_file.write(text)
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def write_textfile(path, state=None):
+    """
+    Write metrics in the Prometheus text format to a file, e.g. for the textfile collector of the node exporter.
+    :param state: A state returned by collect or merge_states, the metrics of the process by default
+    """
+    _write_atomically(path, render(state))
+
+
+class MetricsStateFile:
+    """
+    JSON file that accumulates the metrics of short lived processes, every process adds what it observed since its
+    previous flush. The processes serialize their updates with a lock file next to the state file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._flushed = {'counters': {}, 'histograms': {}}
+        self._lock = threading.Lock()
+
+    def load(self):
+        try:
+            with open(self.path) as state_file:
+                return json.load(state_file)
+        except FileNotFoundError:
+            return {'counters': {}, 'histograms': {}}
+        except ValueError as error:
+            logger.warning("Metrics state file '{}' is not valid, starting over. Error: '{}'".format(self.path, error))
+            return {'counters': {}, 'histograms': {}}
+
+    def flush(self, textfile_path=None):
+        """
+        Add the metrics of the process observed since the previous flush to the state file.
+        :param textfile_path: Also write the accumulated metrics in the Prometheus text format to this file
+        :return: The accumulated state
+        """
+        with self._lock:
+            current = collect()
+            delta = _combine_states(current, self._flushed, -1)
+            lock_fd = os.open(self.path + '.lock', os.O_RDWR | os.O_CREAT, 0o664)
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX)
+                state = merge_states(self.load(), delta)
+                _write_atomically(self.path, json.dumps(state))
+                if textfile_path:
+                    write_textfile(textfile_path, state)
+            finally:
+                os.close(lock_fd)
+            self._flushed = current
+        return state
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    server_version = 'OrcaMetrics'
+
+    def log_message(self, fmt, *args):
+        logger.debug("Metrics endpoint: {} - {}".format(self.address_string(), fmt % args))
+
+    def do_GET(self):
+        if self.path.split('?')[0].rstrip('/') != METRICS_PATH:
+            self.send_error(404)
+            return
+        payload = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class MetricsServer:
+    """
+    HTTP endpoint that serves the metrics of the process in the Prometheus text format on /metrics.
+    """
+
+    def __init__(self, bind_address='127.0.0.1', port=DEFAULT_METRICS_PORT):
+        self._server = _ThreadingHTTPServer((bind_address, port), _MetricsRequestHandler)
+        self._thread = None
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='metrics-endpoint', daemon=True)
+        self._thread.start()
+        logger.info("Serving metrics on http://{}:{}{}".format(self.address[0], self.address[1], METRICS_PATH))
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,151 @@
+import hmac
+import ipaddress
+import json
+import logging
+import random
+import socketserver
+import ssl
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from pytos.common.logging.definitions import COMMON_LOGGER_NAME
+
+logger = logging.getLogger(COMMON_LOGGER_NAME)
+
+DEFAULT_PUSH_PORT = 8443
+DEFAULT_PUSH_PATH = '/orca/tasks'
+DEFAULT_PUSH_BIND_ADDRESS = '127.0.0.1'
+MAX_BODY_SIZE = 10 * 1024 * 1024
+
+
+def is_loopback_address(address):
+    if address == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(address).is_loopback
+    except ValueError:
+        return False
+
+
+class AdaptivePollInterval:
+    """
+    Polling interval that drops to the minimum after a cycle with work and doubles after every idle cycle,
+    up to the maximum. Every delay is randomized by +-jitter so several daemons do not poll in lockstep.
+    """
+
+    def __init__(self, min_interval, max_interval, jitter=0.1):
+        self.min_interval = min(min_interval, max_interval)
+        self.max_interval = max_interval
+        self.jitter = jitter
+        self.interval = self.min_interval
+
+    def record(self, active):
+        if active:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * 2, self.max_interval)
+
+    def next_delay(self):
+        return max(0, self.interval * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _PushRequestHandler(BaseHTTPRequestHandler):
+    server_version = 'OrcaPushListener'
+
+    def log_message(self, fmt, *args):
+        logger.debug("Push listener: {} - {}".format(self.address_string(), fmt % args))
+
+    def _reply(self, status_code, body):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        try:
+            task_queue, auth_token = self.server.listener.routes[self.path.rstrip('/')]
+        except KeyError:
+            self._reply(404, {'error': 'Not found'})
+            return
+        auth_header = self.headers.get('Authorization', '')
+        if not hmac.compare_digest(auth_header.encode('utf-8'), auth_token.encode('utf-8')):
+            logger.warning("Rejected pushed task from '{}': bad authorization header".format(self.address_string()))
+            self._reply(401, {'error': 'Unauthorized'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            length = -1
+        # The body is not read, the connection can not be reused
+        if length < 0:
+            self.close_connection = True
+            self._reply(400, {'error': 'Invalid Content-Length'})
+            return
+        if length > MAX_BODY_SIZE:
+            self.close_connection = True
+            self._reply(413, {'error': "Body is larger than {} bytes".format(MAX_BODY_SIZE)})
+            return
+        try:
+            task = json.loads(self.rfile.read(length).decode('utf-8'))
+            if not isinstance(task, dict) or 'id' not in task or not isinstance(task.get('groups'), list):
+                raise ValueError("Task must be an object with 'id' and 'groups'")
+        except ValueError as error:
+            self._reply(400, {'error': str(error)})
+            return
+        logger.info("Received pushed Orca task '{}' with {} groups".format(task['id'], len(task['groups'])))
+        task_queue.put(task)
+        self._reply(202, {'taskId': task['id'], 'accepted': True})
+
+
+class OrcaPushListener:
+    """
+    Small HTTP endpoint that lets Orca push group change tasks instead of waiting for the next poll.
+    A task has the same format as the response of the Orca groups URL and is put as is on the task queue of the
+    path it was posted to. Requests must carry an Authorization header identical to the token of the path.
+    """
+
+    def __init__(self, task_queue=None, auth_token=None, bind_address=DEFAULT_PUSH_BIND_ADDRESS,
+                 port=DEFAULT_PUSH_PORT, path=DEFAULT_PUSH_PATH, certfile=None, keyfile=None):
+        self.routes = {}
+        if task_queue is not None:
+            self.add_route(path, task_queue, auth_token)
+        self._server = _ThreadingHTTPServer((bind_address, port), _PushRequestHandler)
+        self._server.listener = self
+        if certfile:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certfile, keyfile)
+            self._server.socket = context.wrap_socket(self._server.socket, server_side=True)
+        elif not is_loopback_address(bind_address):
+            logger.warning("Listening for pushed Orca tasks on '{}' without TLS, the authorization tokens are sent "
+                           "in clear text. Set push_certfile and push_keyfile, or bind to 127.0.0.1 behind a TLS "
+                           "proxy.".format(bind_address or '0.0.0.0'))
+        self._thread = None
+
+    def add_route(self, path, task_queue, auth_token):
+        """ Put the tasks posted to path on task_queue, the requests must carry auth_token."""
+        if not auth_token:
+            raise ValueError("An authorization token is required for the push path '{}'".format(path))
+        path = path.rstrip('/')
+        if path in self.routes:
+            raise ValueError("The push path '{}' is used more than once".format(path))
+        self.routes[path] = (task_queue, auth_token)
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='orca-push-listener', daemon=True)
+        self._thread.start()
+        logger.info("Listening for pushed Orca tasks on {}:{} {}".format(self.address[0], self.address[1],
+                                                                        ', '.join(sorted(self.routes))))
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
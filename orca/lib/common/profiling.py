@@ -0,0 +1,194 @@
+import cProfile
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from pytos.common.functions import str_to_bool
+from pytos.common.logging.definitions import COMMON_LOGGER_NAME
+
+logger = logging.getLogger(COMMON_LOGGER_NAME)
+
+DEFAULT_PROFILE_DIR = '/var/log/orca_profiles'
+DEFAULT_MAX_PROFILES = 20
+DEFAULT_SAMPLING_INTERVAL = 0.01
+CPROFILE_MODE = 'cprofile'
+SAMPLING_MODE = 'sampling'
+MODES = (CPROFILE_MODE, SAMPLING_MODE)
+_unsafe_chars = re.compile(r'[^A-Za-z0-9_.-]+')
+
+
+class StackSampler:
+    """
+    Sampling profiler that records the stacks of all the threads of the process at a fixed interval.
+    Unlike cProfile it also sees the worker threads, and its overhead does not depend on the number of calls.
+    """
+
+    def __init__(self, interval=DEFAULT_SAMPLING_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._sample_loop, name='stack-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
+
+    def _sample_loop(self):
+        own_id = threading.get_ident()
+        while not self._stop_event.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append("{} ({}:{})".format(code.co_name, os.path.basename(code.co_filename),
+                                                     code.co_firstlineno))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def dump(self, path):
+        """ Write the stacks in the collapsed format of flame graph tools, one stack and its sample count per line."""
+        with open(path, 'w') as profile_file:
+            for stack, count in self.stacks.most_common():
+                profile_file.write("{} {}\n".format(stack, count))
+
+
+class ProfiledRun:
+    """
+    A run that may be profiled. Tags added while the run is in progress, e.g. the id of a task that was just read,
+    are part of the file name of the dump.
+    """
+
+    def __init__(self, tags):
+        self.tags = tags
+        self.profiled = False
+        self.elapsed = None
+        self.path = None
+
+
+class Profiler:
+    """
+    Opt-in profiling of trigger runs and poll cycles: a sample_rate share of the runs is profiled, and the profile
+    is only kept when the run took at least latency_threshold seconds. One run is profiled at a time, concurrent
+    runs are not profiled. Only the max_profiles newest dumps of the prefix are kept in the directory.
+    """
+
+    def __init__(self, prefix, enabled=False, mode=CPROFILE_MODE, sample_rate=1.0, latency_threshold=0.0,
+                 directory=DEFAULT_PROFILE_DIR, max_profiles=DEFAULT_MAX_PROFILES,
+                 sampling_interval=DEFAULT_SAMPLING_INTERVAL):
+        if mode not in MODES:
+            raise ValueError("Unknown profile mode '{}', expected one of: {}".format(mode, ', '.join(MODES)))
+        self.prefix = prefix
+        self.enabled = enabled
+        self.mode = mode
+        self.sample_rate = sample_rate
+        self.latency_threshold = latency_threshold
+        self.directory = directory
+        self.max_profiles = max_profiles
+        self.sampling_interval = sampling_interval
+        self._active = threading.Lock()
+
+    @classmethod
+    def from_conf(cls, conf, section, prefix):
+        """
+        Read the profile_* options of a configuration section.
+        :param prefix: Start of the file names of the dumps
+        """
+        def option(name, default):
+            return conf.get(section, name, default_value=default)
+
+        return cls(prefix,
+                   enabled=str_to_bool(option('profile_enabled', 'false')),
+                   mode=option('profile_mode', CPROFILE_MODE).lower(),
+                   sample_rate=float(option('profile_sample_rate', 1.0)),
+                   latency_threshold=float(option('profile_latency_threshold', 0)),
+                   directory=option('profile_dir', DEFAULT_PROFILE_DIR),
+                   max_profiles=int(option('profile_max_files', DEFAULT_MAX_PROFILES)),
+                   sampling_interval=float(option('profile_sampling_interval', DEFAULT_SAMPLING_INTERVAL)))
+
+    @contextmanager
+    def profile(self, **tags):
+        """
+        Profile the block if profiling is enabled and the run is sampled.
+        :param tags: Values that identify the run in the file name, e.g. ticket, workflow and step
+        :return: ProfiledRun
+        """
+        run = ProfiledRun(tags)
+        if not self.enabled or random.random() >= self.sample_rate or not self._active.acquire(blocking=False):
+            yield run
+            return
+        try:
+            if self.mode == SAMPLING_MODE:
+                profiler = StackSampler(self.sampling_interval)
+                profiler.start()
+            else:
+                profiler = cProfile.Profile()
+                profiler.enable()
+            run.profiled = True
+            start = time.perf_counter()
+            try:
+                yield run
+            finally:
+                run.elapsed = time.perf_counter() - start
+                if self.mode == SAMPLING_MODE:
+                    profiler.stop()
+                else:
+                    profiler.disable()
+                if run.elapsed >= self.latency_threshold:
+                    self._dump(profiler, run)
+        finally:
+            self._active.release()
+
+    def _file_name(self, run):
+        parts = [self.prefix, time.strftime('%Y%m%d-%H%M%S')]
+        parts.extend("{}-{}".format(name, value) for name, value in run.tags.items() if value is not None)
+        parts.append("{}ms".format(int(run.elapsed * 1000)))
+        extension = '.folded' if self.mode == SAMPLING_MODE else '.prof'
+        return _unsafe_chars.sub('-', '_'.join(str(part) for part in parts))[:200] + extension
+
+    def _dump(self, profiler, run):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            run.path = os.path.join(self.directory, self._file_name(run))
+            if self.mode == SAMPLING_MODE:
+                profiler.dump(run.path)
+            else:
+                profiler.dump_stats(run.path)
+            logger.info("Run took {:.3f} seconds, profile written to '{}'".format(run.elapsed, run.path))
+            self._remove_old_profiles()
+        except OSError as error:
+            logger.error("Failed to write the profile to '{}'. Error: '{}'".format(self.directory, error))
+
+    def _remove_old_profiles(self):
+        profiles = []
+        for name in os.listdir(self.directory):
+            if name.startswith(self.prefix + '_'):
+                path = os.path.join(self.directory, name)
+                try:
+                    profiles.append((os.path.getmtime(path), path))
+                except OSError:
+                    # Removed by another process
+                    continue
+        if len(profiles) <= self.max_profiles:
+            return
+        profiles.sort()
+        for _, path in profiles[:len(profiles) - self.max_profiles]:
+            try:
+                os.remove(path)
+            except OSError as error:
+                logger.debug("Failed to remove the old profile '{}'. Error: '{}'".format(path, error))
@@ -1,7 +1,11 @@
 import base64
+import fcntl
 import logging
 import os
 import pickle
+import tempfile
+import threading
+from contextlib import contextmanager
 from getpass import getpass
 
 from Crypto.Cipher import AES
@@ -11,6 +15,9 @@ from pytos.common.logging.definitions import COMMON_LOGGER_NAME
 
 logger = logging.getLogger(COMMON_LOGGER_NAME)
 
+_shared_stores = {}
+_shared_stores_lock = threading.Lock()
+
 
 class Secret_Store_Helper(object):
     """
@@ -31,8 +38,11 @@ class Secret_Store_Helper(object):
     BLOCK_SIZE = 16
     IV_SIZE = 16
 
-    def __init__(self, secret_data_path=None):
-
+    def __init__(self, secret_data_path=None, lazy=False):
+        """
+        :param secret_data_path: The directory of the passphrase and secrets files, the default files if not set
+        :param lazy: If True the files are only read on the first access to the store
+        """
         if secret_data_path:
             self.passphrase_path = secret_data_path + "/secret.passphrase"
             self.secretdb_path = secret_data_path + "/secret.db"
@@ -40,7 +50,86 @@ class Secret_Store_Helper(object):
             self.passphrase_path = Secret_Store_Helper.PASSPHRASE_FILE
             self.secretdb_path = Secret_Store_Helper.SECRETSDB_FILE
 
-        self.db = {}
+        self._db = {}
+        self.passphrase = None
+        self._loaded = False
+        self._signature = None
+        self._lock = threading.RLock()
+        self._pending = None
+        # Salts only depend on the key, cipher keys on the salt and the passphrase, values on the stored ciphertext
+        self._salts = {}
+        self._cipher_keys = {}
+        self._values = {}
+        if not lazy:
+            self._load()
+
+    @classmethod
+    def shared(cls, secret_data_path=None):
+        """
+        Get the store instance shared by the whole process, it is loaded on its first use.
+        """
+        with _shared_stores_lock:
+            try:
+                return _shared_stores[(cls, secret_data_path)]
+            except KeyError:
+                store = _shared_stores[(cls, secret_data_path)] = cls(secret_data_path, lazy=True)
+                return store
+
+    @property
+    def db(self):
+        self._ensure_loaded()
+        return self._db
+
+    @db.setter
+    def db(self, db):
+        self._db = db
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self._load()
+
+    def _file_signature(self):
+        signature = []
+        for path in (self.passphrase_path, self.secretdb_path):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                signature.append(None)
+            else:
+                signature.append((stat.st_ino, stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+    def has_changed(self):
+        """
+        Check if the store files were changed on disk since they were loaded, only the files metadata is read.
+        """
+        return self._loaded and self._file_signature() != self._signature
+
+    def refresh(self):
+        """
+        Reload the store if its files were changed on disk since they were loaded.
+        :return: True if the store was reloaded
+        """
+        if not self._loaded:
+            self._ensure_loaded()
+            return False
+        if not self.has_changed():
+            return False
+        with self._lock:
+            if not self.has_changed():
+                return False
+            logger.debug("Secret store files changed on disk, reloading.")
+            self._load()
+            return True
+
+    def _load(self):
+        # The signature is taken before reading so a write made while loading triggers another reload
+        self._signature = self._file_signature()
+        self._db = {}
+        self._cipher_keys.clear()
+        self._values.clear()
         # Load passphrase
         try:
             with open(self.passphrase_path) as passphrase_file_obj:
@@ -53,6 +142,7 @@ class Secret_Store_Helper(object):
             self._create_passphrase()
         self._init_secret_db()
         self._load_passphrase()
+        self._loaded = True
 
     def _create_passphrase(self):
         # Create a new passphrase if one does not exist.
@@ -88,19 +178,76 @@ class Secret_Store_Helper(object):
     def read_db_file(self):
         with open(self.secretdb_path, 'rb') as secrets_db_file_obj:
             try:
-                self.db = pickle.load(secrets_db_file_obj)
+                self._db = pickle.load(secrets_db_file_obj)
             except (UnicodeDecodeError, EOFError):
                 raise IOError("Could not unpickle encrypted DB.")
-        if self.db == {}:
+        if self._db == {}:
             raise IOError("Encrypted DB is empty.")
 
     def write_db_file(self, db):
-        with open(self.secretdb_path, 'wb') as secrets_db_file_obj:
-            pickle.dump(db, secrets_db_file_obj)
-            self._ensure_file_permissions()
+        """
+        Write the secrets database to a temporary file and rename it over the current one, so readers always see
+        either the previous or the new complete file.
+        """
+        db_dir, db_file_name = os.path.split(self.secretdb_path)
+        temp_fd, temp_path = tempfile.mkstemp(prefix="." + db_file_name + ".", dir=db_dir or None)
+        try:
+            with os.fdopen(temp_fd, 'wb') as secrets_db_file_obj:
+                pickle.dump(db, secrets_db_file_obj)
+                secrets_db_file_obj.flush()
+                os.fsync(secrets_db_file_obj.fileno())
+            os.chmod(temp_path, 0o664)
+            os.replace(temp_path, self.secretdb_path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+        self._ensure_file_permissions()
+        self._signature = self._file_signature()
+
+    @contextmanager
+    def _write_lock(self):
+        """ Serialize the writers of all processes, readers never take this lock."""
+        with self._lock:
+            lock_fd = os.open(self.secretdb_path + ".lock", os.O_RDWR | os.O_CREAT, 0o664)
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX)
+                yield
+            finally:
+                os.close(lock_fd)
+
+    def _update_db(self, update):
+        """
+        Apply changes to the latest secrets database on disk and write it once.
+        :param update: A function that gets the database dict and changes it in place
+        """
+        with self._write_lock():
+            self.refresh()
+            try:
+                update(self.db)
+            except Exception:
+                # Drop the partial changes, the next access reloads the database from disk
+                self._signature = None
+                raise
+            self.write_db_file(self.db)
 
     def _get_salt_for_key(self, key):
-        return PBKDF2(key, Secret_Store_Helper.SALT_SEED).read(len(Secret_Store_Helper.SALT_SEED))
+        try:
+            return self._salts[key]
+        except KeyError:
+            salt = self._salts[key] = PBKDF2(key, Secret_Store_Helper.SALT_SEED).read(
+                len(Secret_Store_Helper.SALT_SEED))
+            return salt
+
+    def _get_cipher_key(self, salt):
+        self._ensure_loaded()
+        try:
+            return self._cipher_keys[salt]
+        except KeyError:
+            key = self._cipher_keys[salt] = PBKDF2(self.passphrase, salt).read(Secret_Store_Helper.KEY_SIZE)
+            return key
 
     def _encrypt(self, plaintext, salt):
         """ Pad plaintext, then encrypt it with a new, randomly initialised cipher. Will not preserve trailing whitespace in plaintext!"""
@@ -109,7 +256,7 @@ class Secret_Store_Helper(object):
         init_vector = os.urandom(Secret_Store_Helper.IV_SIZE)
 
         # Prepare cipher key:
-        key = PBKDF2(self.passphrase, salt).read(Secret_Store_Helper.KEY_SIZE)
+        key = self._get_cipher_key(salt)
 
         cipher = AES.new(key, AES.MODE_CBC, init_vector)  # Create cipher
 
@@ -120,7 +267,7 @@ class Secret_Store_Helper(object):
         """ Reconstruct the cipher object and decrypt. Will not preserve trailing whitespace in the retrieved value!"""
 
         # Prepare cipher key:
-        key = PBKDF2(self.passphrase, salt).read(Secret_Store_Helper.KEY_SIZE)
+        key = self._get_cipher_key(salt)
 
         # Extract IV:
         init_vector = ciphertext[:Secret_Store_Helper.IV_SIZE]
@@ -136,19 +283,63 @@ class Secret_Store_Helper(object):
         os.chmod(self.secretdb_path, 0o664)
 
     def set(self, key, value):
-        """ Store key-value pair safely and save to disk."""
+        """ Store key-value pair safely and save to disk, or when the current transaction ends."""
+        self.set_many({key: value})
+
+    def set_many(self, values):
+        """
+        Store several key-value pairs with a single write to disk.
+        :param values: A dict of key to value
+        """
+        with self._lock:
+            if self._pending is not None:
+                self._pending.update(values)
+                return
+
+            def update(db):
+                for key, value in values.items():
+                    db[key] = self._encrypt(value, self._get_salt_for_key(key))
+                    self._values.pop(key, None)
 
-        self.db[key] = self._encrypt(value, self._get_salt_for_key(key))
-        with open(self.secretdb_path, 'wb') as secrets_db_file_obj:
-            pickle.dump(self.db, secrets_db_file_obj)
-            self._ensure_file_permissions()
+            self._update_db(update)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Group the values set in the block into a single write to disk when the block exits without an error.
+        Values set in the block are not returned by get until the block exits.
+        """
+        with self._lock:
+            if self._pending is not None:
+                yield
+                return
+            self._pending = {}
+            try:
+                yield
+                pending, self._pending = self._pending, None
+                if pending:
+                    self.set_many(pending)
+            finally:
+                self._pending = None
 
     def get(self, key):
-        """ Fetch key-value pair."""
+        """ Fetch key-value pair, decrypted values are kept until the store changes on disk."""
+        self.refresh()
         try:
-            return self._decrypt(self.db[key], self._get_salt_for_key(key))
-        except IndexError:
-            logger.error("Could not find encrypted value '%s' .", key)
+            return self._values[key]
+        except KeyError:
+            pass
+        # A reload clears the store under the lock, a reader must not see it half loaded
+        with self._lock:
+            try:
+                return self._values[key]
+            except KeyError:
+                pass
+            try:
+                value = self._values[key] = self._decrypt(self.db[key], self._get_salt_for_key(key))
+                return value
+            except IndexError:
+                logger.error("Could not find encrypted value '%s' .", key)
 
     def ensure(self, key):
         """ Test if key is stored, if not, prompt the user for it while hiding their input from shoulder-surfers."""
@@ -229,11 +420,13 @@ class SecretDb(Secret_Store_Helper):
             logger.info(msg)
             raise ValueError(msg)
 
-        db = self.db
-        for suffix in [self.USERNAME_SUFFIX, self.PASSWORD_SUFFIX]:
-            try:
-                del db[section + suffix]
-            except KeyError as e:
-                msg = "Failed to delete section '{}', Error: '{}'".format(section + suffix, e)
-                raise KeyError(msg)
-        self.write_db_file(db)
\ No newline at end of file
+        def update(db):
+            for suffix in [self.USERNAME_SUFFIX, self.PASSWORD_SUFFIX]:
+                self._values.pop(section + suffix, None)
+                try:
+                    del db[section + suffix]
+                except KeyError as e:
+                    msg = "Failed to delete section '{}', Error: '{}'".format(section + suffix, e)
+                    raise KeyError(msg)
+
+        self._update_db(update)
\ No newline at end of file
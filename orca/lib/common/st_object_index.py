@@ -0,0 +1,139 @@
+import functools
+import ipaddress
+import logging
+import threading
+import time
+
+from pytos.common.logging.definitions import COMMON_LOGGER_NAME
+from pytos.securetrack.xml_objects.rest.rules import Subnet_Network_Object, Host_Network_Object, \
+    Range_Network_Object
+
+logger = logging.getLogger(COMMON_LOGGER_NAME)
+
+
+def normalize_uid(uid):
+    return uid.replace('{', '').replace('}', '')
+
+
+@functools.lru_cache(maxsize=256)
+def netmask_to_cidr(netmask):
+    if str(netmask).isdigit():
+        return int(netmask)
+    return ipaddress.IPv4Network("0.0.0.0/{}".format(netmask)).prefixlen
+
+
+def address_key(network_object):
+    """
+    Get the normalized address of a network object, as used by Orca destinations.
+    :param network_object: SecureTrack network object
+    :return: 'ip' for hosts, 'ip/cidr' for subnets, '[first-last]' for ranges, None for any other object
+    """
+    if isinstance(network_object, Subnet_Network_Object):
+        return "{}/{}".format(network_object.ip, netmask_to_cidr(network_object.netmask))
+    elif isinstance(network_object, Range_Network_Object):
+        return '[{}-{}]'.format(network_object.first_ip, network_object.last_ip)
+    elif isinstance(network_object, Host_Network_Object):
+        return network_object.ip
+    return None
+
+
+class SecureTrackObjectIndex:
+    """
+    Index of SecureTrack network objects that lives for one monitor cycle, or for a few seconds when it is shared
+    through get_object_index.
+    The network objects of a device are fetched once, on first use, and then looked up by uid or by address,
+    so a cycle costs a request per device instead of a request per group member.
+    The index is shared by the groups processed concurrently in a cycle, each device is loaded by a single thread.
+    """
+
+    def __init__(self, st_helper):
+        self._st_helper = st_helper
+        self.created_at = time.monotonic()
+        self._devices = {}
+        self._uid_index = {}
+        self._address_index = {}
+        self.requests_count = 0
+        self._lock = threading.Lock()
+        self._device_locks = {}
+
+    def _get_device_lock(self, device_id):
+        with self._lock:
+            return self._device_locks.setdefault(device_id, threading.Lock())
+
+    def _count_request(self):
+        with self._lock:
+            self.requests_count += 1
+
+    def get_device(self, device_id):
+        try:
+            return self._devices[device_id]
+        except KeyError:
+            pass
+        with self._get_device_lock(device_id):
+            if device_id not in self._devices:
+                self._count_request()
+                self._devices[device_id] = self._st_helper.get_device_by_id(device_id)
+        return self._devices[device_id]
+
+    def _load_device_objects(self, device_id):
+        if device_id in self._address_index:
+            return
+        with self._get_device_lock(device_id):
+            if device_id in self._address_index:
+                return
+            logger.debug("Indexing network objects for device id '{}'".format(device_id))
+            self._count_request()
+            uid_index, address_index = {}, {}
+            for network_object in self._st_helper.get_network_objects_for_device(device_id):
+                uid_index[normalize_uid(network_object.uid)] = network_object
+                key = address_key(network_object)
+                if key is not None:
+                    address_index.setdefault(key, network_object)
+            self._uid_index[device_id] = uid_index
+            self._address_index[device_id] = address_index
+        logger.debug("Indexed {} network objects for device id '{}'".format(len(uid_index), device_id))
+
+    def get_by_uid(self, device_id, uid):
+        """
+        Get a network object of a device by its uid, falling back to a SecureTrack search for objects
+        that are not part of the device object list (e.g. shared objects).
+        """
+        self._load_device_objects(device_id)
+        uid = normalize_uid(uid)
+        try:
+            return self._uid_index[device_id][uid]
+        except KeyError:
+            logger.debug("Object uid '{}' is not indexed for device id '{}', searching".format(uid, device_id))
+            self._count_request()
+            network_object = self._st_helper.network_object_text_search(uid, "uid", exact_match=True,
+                                                                        filter='uid')[0]
+            self._uid_index[device_id][uid] = network_object
+            return network_object
+
+    def get_by_address(self, device_id, address):
+        """
+        Get a network object of a device by its normalized address.
+        :param address: 'ip', 'ip/cidr' or '[first-last]'
+        :return: The first matching network object, or None
+        """
+        self._load_device_objects(device_id)
+        return self._address_index[device_id].get(address)
+
+
+_shared_indexes = {}
+_shared_indexes_lock = threading.Lock()
+
+
+def get_object_index(st_helper, max_age=0):
+    """
+    Get an object index of the SecureTrack of st_helper. The cycles that start within max_age seconds of each other
+    share the index, so the Orca sources that change groups on the same SecureTrack fetch its objects once.
+    :param max_age: Seconds an index is shared for, 0 for an index per cycle
+    """
+    if max_age <= 0:
+        return SecureTrackObjectIndex(st_helper)
+    with _shared_indexes_lock:
+        index = _shared_indexes.get(id(st_helper))
+        if index is None or time.monotonic() - index.created_at > max_age:
+            index = _shared_indexes[id(st_helper)] = SecureTrackObjectIndex(st_helper)
+        return index
@@ -0,0 +1,95 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+from collections import namedtuple
+from contextlib import closing
+
+from pytos.common.logging.definitions import COMMON_LOGGER_NAME
+
+logger = logging.getLogger(COMMON_LOGGER_NAME)
+
+DEFAULT_LEDGER_PATH = '/usr/local/orca/var/task_ledger.db'
+
+LedgerEntry = namedtuple('LedgerEntry', ['task_id', 'group_name', 'destinations_hash', 'ticket_id', 'status', 'message',
+                                         'sc_url', 'updated_at'])
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    task_id TEXT NOT NULL,
+    group_name TEXT NOT NULL,
+    destinations_hash TEXT NOT NULL,
+    ticket_id TEXT,
+    status INTEGER NOT NULL,
+    message TEXT NOT NULL DEFAULT '',
+    sc_url TEXT NOT NULL DEFAULT 'N/A',
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (task_id, group_name)
+);
+CREATE INDEX IF NOT EXISTS tasks_updated ON tasks (updated_at);
+"""
+
+
+def destinations_hash(destinations):
+    """
+    Hash of the destinations of a group, the order of the destinations does not matter.
+    """
+    content = json.dumps(sorted(set(destinations or ())))
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+class TaskLedger:
+    """
+    Outcome of every group of the Orca tasks that were handled, stored in SQLite so it survives restarts of the
+    daemon. Entries are kept per task id and group name along with a hash of the destinations they were handled with.
+    """
+
+    def __init__(self, path=DEFAULT_LEDGER_PATH, timeout=30):
+        self.path = path
+        self.timeout = timeout
+        ledger_dir = os.path.dirname(path)
+        if ledger_dir:
+            os.makedirs(ledger_dir, exist_ok=True)
+        with closing(self._connect()) as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(_SCHEMA)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+
+    def get(self, task_id, group_name):
+        """
+        :return: LedgerEntry or None if the group of the task was never handled
+        """
+        with closing(self._connect()) as connection:
+            row = connection.execute(
+                "SELECT task_id, group_name, destinations_hash, ticket_id, status, message, sc_url, updated_at "
+                "FROM tasks WHERE task_id = ? AND group_name = ?", (str(task_id), group_name)).fetchone()
+        return LedgerEntry(*row) if row is not None else None
+
+    def record(self, task_id, group_name, digest, ticket_id, status, message='', sc_url='N/A'):
+        """
+        :param digest: destinations_hash() of the destinations the group was handled with
+        :param status: The numeric Orca status
+        """
+        with closing(self._connect()) as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO tasks "
+                "(task_id, group_name, destinations_hash, ticket_id, status, message, sc_url, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (str(task_id), group_name, digest, None if ticket_id is None else str(ticket_id), int(status),
+                 message, sc_url, time.time()))
+
+    def prune(self, max_age):
+        """
+        Remove the entries that were not updated in the last max_age seconds.
+        :return: The number of removed entries
+        """
+        with closing(self._connect()) as connection:
+            removed = connection.execute("DELETE FROM tasks WHERE updated_at < ?",
+                                         (time.time() - max_age,)).rowcount
+        if removed:
+            logger.info("Removed {} entries older than {} seconds from the task ledger".format(removed, max_age))
+        return removed
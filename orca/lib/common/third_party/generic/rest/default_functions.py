@@ -1,31 +1,19 @@
 import logging
 
-from pytos.securechange.helpers import Secure_Change_Helper
 from pytos.securechange.xml_objects.rest import Step_Field_Approve_Reject, Step_Field_Text, Step_Field_Text_Area
-from pytos.common.functions import Secure_Config_Parser
 from pytos.common.definitions.xml_tags import Attributes
 from pytos.common.logging.definitions import THIRD_PARTY_LOGGER_NAME
 from .placeholders import PlaceHolders
-from common.secret_store import SecretDb
+from .ticket_index import TicketFieldIndex
+from common.context import get_conf, get_sc_helper
 
-secret_helper = SecretDb()
-conf = Secure_Config_Parser(config_file_path="/usr/local/orca/conf/custom.conf")
-sc_cred = (secret_helper.get_username('securechangeworkflow'), secret_helper.get_password('securechangeworkflow'))
-sc_host = conf.get("securechange", "host")
-sc_helper = Secure_Change_Helper(sc_host, sc_cred)
+SC_SECURE_STORE_KEY = 'securechangeworkflow'
+conf = get_conf()
 logger = logging.getLogger(THIRD_PARTY_LOGGER_NAME)
 
 
 def get_first_field_in_ticket(ticket, **kwargs):
-    for step in ticket.steps[::-1]:
-        task = step.get_last_task()
-        try:
-            field = task.get_field_list_by_type(kwargs['field_type'])[0]
-        except IndexError:
-            continue
-        return field
-    else:
-        return None
+    return TicketFieldIndex.for_ticket(ticket).latest_field_of_type(kwargs['field_type'])
 
 
 def approve_reject_on_severity(ticket, severity):
@@ -47,7 +35,7 @@ def approve_reject_on_severity(ticket, severity):
         else:
             approve_field.approved = True
             approve_field.reason = "The ticket has been approved by the script"
-        sc_helper.put_field(approve_field)
+        get_sc_helper(SC_SECURE_STORE_KEY).put_field(approve_field)
 
 
 class Functions:
@@ -69,7 +57,7 @@ class Functions:
             current_task.remove_all_fields()
         current_task.mark_as_done()
         try:
-            sc_helper.put_task(current_task)
+            get_sc_helper(SC_SECURE_STORE_KEY).put_task(current_task)
         except (IOError, ValueError) as e:
             raise IOError("Failed to advance step. Error was: '{}'".format(e))
 
@@ -102,7 +90,7 @@ class Functions:
             approve_field.approved = True
             approve_field.reason = "The ticket has been approved by the script"
 
-        sc_helper.put_field(approve_field)
+        get_sc_helper(SC_SECURE_STORE_KEY).put_field(approve_field)
 
     @classmethod
     def approve_reject_on_critical(cls, ticket, **kwargs):
@@ -118,7 +106,7 @@ class Functions:
     def cancel_ticket(cls, ticket, **kwargs):
         logger.info("Canceling ticket id '{}'".format(ticket.id))
         try:
-            sc_helper.cancel_ticket(ticket.id)
+            get_sc_helper(SC_SECURE_STORE_KEY).cancel_ticket(ticket.id)
         except (ValueError, IOError) as e:
             logger.error(e)
 
@@ -1,51 +1,119 @@
 import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
 
-
-from pytos.common.functions import Secure_Config_Parser
 from pytos.common.definitions.xml_tags import Attributes
 from pytos.common.logging.definitions import THIRD_PARTY_LOGGER_NAME
 from pytos.securechange.xml_objects.restapi.step.access_request.designer import DesignerResult
-from common.secret_store import SecretDb
+from common.context import get_conf, get_credentials
+from ..ticket_index import TicketFieldIndex
 
-conf = Secure_Config_Parser(config_file_path="/usr/local/orca/conf/custom.conf")
+conf = get_conf()
 logger = logging.getLogger(THIRD_PARTY_LOGGER_NAME)
-secret_helper = SecretDb()
+DESIGNER_WORKERS = int(conf.get('rest_integration', 'designer_workers', default_value=8))
+DESIGNER_TIMEOUT = int(conf.get('rest_integration', 'designer_timeout', default_value=120))
 
 
-def designer_commands(ticket):
-    for step in ticket.steps[::-1]:
-        task = step.get_last_task()
+def get_sc_cred():
+    return get_credentials('securechangeworkflow')
+
+
+def get_devices_commands(multi_ar_field, management_ids, sc_cred):
+    """
+    Get the designer commands of several devices concurrently.
+    Up to designer_workers devices are fetched at a time, a device that does not answer within designer_timeout
+    seconds of the start of its request is reported as failed. The workers are daemon threads so a device that hangs
+    does not keep the process alive, and its worker is replaced so the other devices are still fetched.
+    :return: (dict of management id to commands, dict of management id to error) both in the order of management_ids
+    """
+    pending = queue.Queue()
+    for management_id in management_ids:
+        pending.put(management_id)
+    finished = queue.Queue()
+    started = {}
+
+    def fetch_devices():
+        while True:
+            try:
+                management_id = pending.get_nowait()
+            except queue.Empty:
+                return
+            started[management_id] = time.monotonic()
+            try:
+                commands = multi_ar_field.get_designer_commands(management_id, *sc_cred)
+                finished.put((management_id, str(commands), None))
+            except Exception as e:
+                finished.put((management_id, None, str(e)))
+
+    def start_worker():
+        threading.Thread(target=fetch_devices, name='designer', daemon=True).start()
+
+    for _ in range(max(1, min(DESIGNER_WORKERS, len(management_ids)))):
+        start_worker()
+    results, errors = {}, {}
+    while len(results) + len(errors) < len(management_ids):
+        running = {m: start + DESIGNER_TIMEOUT for m, start in list(started.items())
+                   if m not in results and m not in errors}
+        wait_time = min(running.values(), default=time.monotonic() + DESIGNER_TIMEOUT) - time.monotonic()
         try:
-            multi_ar_field = task.get_field_list_by_type(Attributes.FIELD_TYPE_MULTI_ACCESS_REQUEST)[0]
-        except IndexError:
+            management_id, commands, error = finished.get(timeout=max(wait_time, 0))
+        except queue.Empty:
+            now = time.monotonic()
+            for management_id, deadline in running.items():
+                if deadline <= now:
+                    errors[management_id] = "Timed out after {} seconds".format(DESIGNER_TIMEOUT)
+                    start_worker()
+            continue
+        if management_id in errors:
+            # Answered after it timed out
             continue
-        sc_cred = (
-            secret_helper.get_username('securechangeworkflow'),
-            secret_helper.get_password('securechangeworkflow')
-        )
+        if error is None:
+            results[management_id] = commands
+        else:
+            errors[management_id] = error
+    for management_id, error in errors.items():
+        logger.warning("Failed to get designer commands for management id '{}'. Error: '{}'".format(
+            management_id, error))
+    ordered_results = OrderedDict((m, results[m]) for m in management_ids if m in results)
+    ordered_errors = OrderedDict((m, errors[m]) for m in management_ids if m in errors)
+    return ordered_results, ordered_errors
+
+
+def designer_commands(ticket):
+    """
+    Get the designer commands of the latest access request step whose devices return commands. When all the devices
+    of all the steps fail, the errors of the devices of the latest step are returned.
+    """
+    latest_errors = None
+    sc_cred = None
+    field_index = TicketFieldIndex.for_ticket(ticket)
+    for multi_ar_field in field_index.fields_of_type(Attributes.FIELD_TYPE_MULTI_ACCESS_REQUEST):
+        if sc_cred is None:
+            sc_cred = get_sc_cred()
         designer_results = multi_ar_field.get_designer_results(*sc_cred)
         if not designer_results:
             return ''
-        device_to_commands = {}
-        for device_suggestion in designer_results.device_suggestion:
-            try:
-                commands = multi_ar_field.get_designer_commands(device_suggestion.management_id, *sc_cred)
-            except IOError as e:
-                logger.info(e)
-                continue
-            device_to_commands[device_suggestion.management_id] = str(commands)
+        management_ids = list(OrderedDict.fromkeys(
+            device_suggestion.management_id for device_suggestion in designer_results.device_suggestion))
+        device_to_commands, device_errors = get_devices_commands(multi_ar_field, management_ids, sc_cred)
+        # The failed devices are reported with their errors
+        for management_id, error in device_errors.items():
+            device_errors[management_id] = "Failed to get designer commands: {}".format(error)
         if device_to_commands:
-            return str(device_to_commands)
+            device_to_commands.update(device_errors)
+            return str(dict((m, device_to_commands[m]) for m in management_ids))
+        if latest_errors is None and device_errors:
+            latest_errors = device_errors
+        # No device returned commands, fall back to the previous access request step
+    if latest_errors:
+        return str(dict(latest_errors))
 
 
 def designer_status(ticket):
-    for step in ticket.steps[::-1]:
-        task = step.get_last_task()
-        try:
-            multi_ar_field = task.get_field_list_by_type(Attributes.FIELD_TYPE_MULTI_ACCESS_REQUEST)[0]
-        except IndexError:
-            continue
-
+    field_index = TicketFieldIndex.for_ticket(ticket)
+    for multi_ar_field in field_index.fields_of_type(Attributes.FIELD_TYPE_MULTI_ACCESS_REQUEST):
         if hasattr(multi_ar_field, 'designer_result'):
             is_failed = multi_ar_field.designer_result.status == DesignerResult.DESIGNER_CANNOT_COMPUTE
             return "Error: Problem with Designer" if is_failed else ""
@@ -54,19 +122,11 @@ def designer_status(ticket):
 
 
 def designer_results_json(ticket):
-    for step in ticket.steps[::-1]:
-        task = step.get_last_task()
-        try:
-            multi_ar_field = task.get_field_list_by_type(Attributes.FIELD_TYPE_MULTI_ACCESS_REQUEST)[0]
-        except IndexError:
-            continue
-
+    field_index = TicketFieldIndex.for_ticket(ticket)
+    for multi_ar_field in field_index.fields_of_type(Attributes.FIELD_TYPE_MULTI_ACCESS_REQUEST):
         if hasattr(multi_ar_field, 'designer_result') and \
                         multi_ar_field.designer_result.status != DesignerResult.DESIGNER_CANNOT_COMPUTE:
-            sc_cred = (
-                secret_helper.get_username('securechangeworkflow'),
-                secret_helper.get_password('securechangeworkflow')
-            )
+            sc_cred = get_sc_cred()
             response = multi_ar_field.get_designer_results(*sc_cred, as_json=True)
             if response:
                 return response.decode()
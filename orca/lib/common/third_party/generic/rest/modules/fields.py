@@ -2,17 +2,15 @@ import logging
 
 from pytos.common.definitions.xml_tags import Attributes
 from pytos.common.logging.definitions import THIRD_PARTY_LOGGER_NAME
+from ..ticket_index import TicketFieldIndex
 
 logger = logging.getLogger(THIRD_PARTY_LOGGER_NAME)
 
 
 def approve_reject_reason(ticket):
-    for step in ticket.steps[::-1]:
-        task = step.get_last_task()
-        try:
-            approve_reject_field = task.get_field_list_by_type(Attributes.FIELD_TYPE_APPROVE_REJECT)[0]
-        except IndexError:
-            continue
+    approve_reject_field = TicketFieldIndex.for_ticket(ticket).latest_field_of_type(
+        Attributes.FIELD_TYPE_APPROVE_REJECT)
+    if approve_reject_field is not None:
         return approve_reject_field.reason
     else:
         msg = "The approve-reject status has not been found in all of the ticket id '{}' steps"
@@ -20,12 +18,9 @@ def approve_reject_reason(ticket):
 
 
 def approve_reject_status(ticket):
-    for step in ticket.steps[::-1]:
-        task = step.get_last_task()
-        try:
-            approve_reject_field = task.get_field_list_by_type(Attributes.FIELD_TYPE_APPROVE_REJECT)[0]
-        except IndexError:
-            continue
+    approve_reject_field = TicketFieldIndex.for_ticket(ticket).latest_field_of_type(
+        Attributes.FIELD_TYPE_APPROVE_REJECT)
+    if approve_reject_field is not None:
         status = 'Approved' if approve_reject_field.approved == "true" else 'Rejected'
         return status
     else:
@@ -34,12 +29,9 @@ def approve_reject_status(ticket):
 
 
 def selected_plus_options(ticket):
-    for step in ticket.steps[::-1]:
-        task = step.get_last_task()
-        try:
-            field = task.get_field_list_by_type(Attributes.FIELD_TYPE_DROP_DOWN_LIST)[0]
-        except IndexError:
-            continue
+    field = TicketFieldIndex.for_ticket(ticket).latest_field_of_type(
+        Attributes.FIELD_TYPE_DROP_DOWN_LIST)
+    if field is not None:
         return "{} selected from [{}]".format(field.selection, ', '.join(o.value for o in field.options))
     else:
         msg = "The drop down field has not been found in all of the ticket id '{}' steps"
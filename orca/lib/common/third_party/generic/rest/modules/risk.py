@@ -7,6 +7,7 @@ from pytos.securechange.xml_objects.restapi.step.access_request.risk import Viol
     Violation_Any_Service, Violation_Not_Allowed_Group_Member_service_Object, \
     Violation_Allowed_Group_Member_service_Object, Violation_Group_Destination, Violation_Group_Source, \
     RestrictedCellViolation, BlockedOnlyCellViolation
+from ..ticket_index import TicketFieldIndex
 
 
 logger = logging.getLogger(THIRD_PARTY_LOGGER_NAME)
@@ -14,12 +15,9 @@ NO_RISK = "no risk"
 
 
 def risk_status(ticket):
-    for step in ticket.steps[::-1]:
-        task = step.get_last_task()
-        try:
-            multi_access_request_field = task.get_field_list_by_type(Attributes.FIELD_TYPE_MULTI_ACCESS_REQUEST)[0]
-        except IndexError:
-            continue
+    multi_access_request_field = TicketFieldIndex.for_ticket(ticket).latest_field_of_type(
+        Attributes.FIELD_TYPE_MULTI_ACCESS_REQUEST)
+    if multi_access_request_field is not None:
         for ar in multi_access_request_field.access_requests:
             if ar.risk_analysis_result.has_risk():
                 return "YES"
@@ -59,13 +57,9 @@ def risk_results(ticket):
         }
     }
     risk_results_per_ar = {}
-    for step in ticket.steps[::-1]:
-        task = step.get_last_task()
-        try:
-            multi_access_request_field = task.get_field_list_by_type(Attributes.FIELD_TYPE_MULTI_ACCESS_REQUEST)[0]
-        except IndexError:
-            continue
-
+    multi_access_request_field = TicketFieldIndex.for_ticket(ticket).latest_field_of_type(
+        Attributes.FIELD_TYPE_MULTI_ACCESS_REQUEST)
+    if multi_access_request_field is not None:
         for ar in multi_access_request_field.access_requests:
             if NO_RISK == ar.risk_analysis_result.status.lower().strip():
                 risk_results_per_ar[ar.order] = NO_RISK
@@ -1,28 +1,19 @@
 import logging
 
-from pytos.securechange.helpers import Secure_Change_Helper
 from pytos.securechange.xml_objects.restapi.step.access_request.accessrequest import Any_Access_Request_Device
-from pytos.common.functions import Secure_Config_Parser
 from pytos.common.definitions.xml_tags import Attributes
 from pytos.common.logging.definitions import THIRD_PARTY_LOGGER_NAME
-from common.secret_store import SecretDb
+from common.context import get_sc_helper
+from ..ticket_index import TicketFieldIndex
+from ..ticket_history import get_ticket_history
 
-conf = Secure_Config_Parser(config_file_path="/usr/local/orca/conf/custom.conf")
 logger = logging.getLogger(THIRD_PARTY_LOGGER_NAME)
-secret_helper = SecretDb()
-sc_cred = (secret_helper.get_username('securechangeworkflow'), secret_helper.get_password('securechangeworkflow'))
-sc_host = conf.get("securechange", "host")
-sc_helper = Secure_Change_Helper(sc_host, sc_cred)
+SC_SECURE_STORE_KEY = 'securechangeworkflow'
 
 
 def firewall_list(ticket):
-    for step in ticket.steps[::-1]:
-        task = step.get_last_task()
-        try:
-            field = task.get_field_list_by_type(Attributes.FIELD_TYPE_MULTI_ACCESS_REQUEST)[0]
-        except IndexError:
-            continue
-
+    field = TicketFieldIndex.for_ticket(ticket).latest_field_of_type(Attributes.FIELD_TYPE_MULTI_ACCESS_REQUEST)
+    if field is not None:
         targets = {}
         for ar in field.access_requests:
             for t in ar.targets.get_contents():
@@ -68,21 +59,24 @@ def reject_reason(ticket):
 
 
 def ticket_start_time(ticket):
-    submitted_time = sc_helper.get_ticket_history_by_id(ticket.id)[0].as_time_obj()
+    submitted_time = get_ticket_history(get_sc_helper(SC_SECURE_STORE_KEY), ticket.id).start_time
+    if submitted_time is None:
+        logger.warning("No history for ticket id '{}'".format(ticket.id))
+        return ''
     return submitted_time.strftime("%Y/%m/%d %H:%M:%S")
 
 
 def ticket_end_time(ticket):
-    close_time = sc_helper.get_ticket_history_by_id(ticket.id)[-1].as_time_obj()
+    close_time = get_ticket_history(get_sc_helper(SC_SECURE_STORE_KEY), ticket.id).end_time
+    if close_time is None:
+        logger.warning("No history for ticket id '{}'".format(ticket.id))
+        return ''
     return close_time.strftime("%Y/%m/%d %H:%M:%S")
 
 
 def automatic_step_failure_reason(ticket):
-    histories = sc_helper.get_ticket_history_by_id(ticket.id)
-    for history in histories[::-1]:
-        if 'Automatic step failed' in history.description:
-            return history.description
-    return ''
+    history = get_ticket_history(get_sc_helper(SC_SECURE_STORE_KEY), ticket.id).last_automatic_step_failure
+    return history.description if history else ''
 
 
 def step_handler(ticket):
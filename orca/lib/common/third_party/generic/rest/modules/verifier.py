@@ -2,19 +2,15 @@ import logging
 
 from pytos.common.definitions.xml_tags import Attributes
 from pytos.common.logging.definitions import THIRD_PARTY_LOGGER_NAME
+from ..ticket_index import TicketFieldIndex
 
 logger = logging.getLogger(THIRD_PARTY_LOGGER_NAME)
 
 
 def verifier_status(ticket):
     logger.debug("Validating if ARs on ticket id '{}' are already implemented".format(ticket.id))
-    for step in ticket.steps[::-1]:
-        task = step.get_last_task()
-        try:
-            ar_field = task.get_field_list_by_type(Attributes.FIELD_TYPE_MULTI_ACCESS_REQUEST)[0]
-        except IndexError:
-            continue
-
+    ar_field = TicketFieldIndex.for_ticket(ticket).latest_field_of_type(Attributes.FIELD_TYPE_MULTI_ACCESS_REQUEST)
+    if ar_field is not None:
         verified = [ar.verifier_result.is_implemented() if ar.verifier_result else False for ar in
                     ar_field.access_requests]
         return "Fully implemented" if all(verified) else "Not implemented"
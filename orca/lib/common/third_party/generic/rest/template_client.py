@@ -4,29 +4,57 @@ import logging
 import os
 import re
 import sys
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from configparser import NoSectionError
 from importlib import import_module
 
 from pytos.securechange.helpers import Secure_Change_Helper
 from pytos.securechange.xml_objects.rest import Step_Field_Approve_Reject, Step_Field_Date, Step_Field_Multi_Access_Request, \
     Step_Field_Multiple_Selection, Step_Field_Checkbox, Step_Field_Multi_Group_Change, \
-    Step_Field_Multi_Hyperlink, Step_Field_Multi_Network_Object, Ticket
+    Step_Field_Multi_Hyperlink, Step_Field_Multi_Network_Object
 from pytos.common.logging.definitions import THIRD_PARTY_LOGGER_NAME
-from pytos.common.functions import Secure_Config_Parser
-from pytos.common.rest_requests import POST_Request, PUT_Request, RESTAuthMethods
-from common.secret_store import SecretDb
+from common import metrics
+from common.context import get_conf, get_secret_store
+from common.http_pool import get_session_pool, DEFAULT_TIMEOUT
+from common.http_policy import get_http_policy
+from common.profiling import Profiler
 
 from .default_functions import Functions
 from .placeholders import PlaceHolders
-
-secret_helper = SecretDb()
-conf = Secure_Config_Parser(config_file_path="/usr/local/orca/conf/custom.conf")
+from .ticket_cache import TicketSnapshotCache
+from .template_engine import CompiledTemplate, load_compiled_template
+from .ticket_index import TicketFieldIndex
+from .ticket_wait import WaitStrategy, wait_for_no_pending_tasks
+from . import ticket_history
+
+secret_helper = get_secret_store()
+conf = get_conf()
 logger = logging.getLogger(THIRD_PARTY_LOGGER_NAME)
 
 templates_root_dir = '/usr/local/orca/templates'
 SECURE_STORE_KEY = 'rest_integration'
 AUTH_TOKEN_KEY = 'auth_header_integration'
-plugins_root_dir = conf.get(SECURE_STORE_KEY, 'plugins_root_dir', default_value='/usr/local/orca/plugins')
+DEFAULT_PLUGINS_ROOT_DIR = '/usr/local/orca/plugins'
+SECTION_PREFIX = 'integration '
+DEFAULT_FANOUT_WORKERS = 8
+DEFAULT_FANOUT_SUCCESS_THRESHOLD = 1.0
+PHASE_HISTOGRAM = 'rest_phase_duration_seconds'
+PHASE_ERRORS_COUNTER = 'rest_phase_errors_total'
+PLACEHOLDER_HISTOGRAM = 'rest_placeholder_duration_seconds'
+FUNCTION_HISTOGRAM = 'rest_function_duration_seconds'
+FUNCTION_ERRORS_COUNTER = 'rest_function_errors_total'
+metrics.describe(PHASE_HISTOGRAM, "Seconds spent in each phase of handling a ticket step or action")
+metrics.describe(PHASE_ERRORS_COUNTER, "Phases of handling a ticket step or action that failed with an error")
+metrics.describe(PLACEHOLDER_HISTOGRAM, "Seconds spent resolving a placeholder, by placeholder name")
+metrics.describe(FUNCTION_HISTOGRAM, "Seconds spent in a pre or post function, by function name")
+metrics.describe(FUNCTION_ERRORS_COUNTER, "Pre and post functions that failed with an error, by function name")
+profiler = Profiler.from_conf(conf, SECURE_STORE_KEY, 'rest_integration')
+
+
+def phase(name):
+    """ Time a phase of handling a ticket step or action, e.g. with phase('send'): ..."""
+    return metrics.timed(PHASE_HISTOGRAM, PHASE_ERRORS_COUNTER, phase=name)
 
 
 class Timing(enum.Enum):
@@ -35,28 +63,48 @@ class Timing(enum.Enum):
 
 
 class RestClient:
-    def __init__(self, hostname, username, password, proxy, protocol, auth_method, verify_ssl, header):
+    def __init__(self, hostname, username, password, proxy, protocol, auth_method, verify_ssl, header,
+                 session_pool=None, policy=None):
         self._protocol = protocol
         self._headers = header
         self._proxy_dict = proxy or {}
         self._login_data = {'username': username, 'password': password} if all((username, password)) else None
         self._hostname = hostname
         self.verify_ssl = verify_ssl
-        self._auth_method = RESTAuthMethods.Basic if auth_method.lower() == 'basic' else RESTAuthMethods.Digest
+        self._auth_method = 'basic' if auth_method.lower() == 'basic' else 'digest'
+        self._session_pool = session_pool or get_session_pool()
+        self.policy = policy
+
+    def _send(self, http_method, endpoint, data, expected_status_codes, timeout=DEFAULT_TIMEOUT):
+        response = self._session_pool.request(http_method, self._hostname, endpoint, protocol=self._protocol,
+                                              auth_method=self._auth_method, headers=self._headers,
+                                              login_data=self._login_data, body=json.dumps(data),
+                                              proxies=self._proxy_dict, verify_ssl=False, timeout=timeout,
+                                              policy=self.policy,
+                                              expected_status_codes=expected_status_codes).content.decode('utf-8')
+        try:
+            return json.loads(response)
+        except ValueError:
+            return response
+
+    def post(self, endpoint, data, expected_status_codes, timeout=DEFAULT_TIMEOUT):
+        return self._send('post', endpoint, data, expected_status_codes, timeout)
 
-    def post(self, endpoint, data, expected_status_codes):
-        response = POST_Request(proxies=self._proxy_dict, hostname=self._hostname, uri=endpoint,
-                            auth_method=self._auth_method, headers=self._headers, login_data=self._login_data,
-                            body=json.dumps(data), protocol=self._protocol, verify_ssl=False,
-                            expected_status_codes=expected_status_codes).response.content.decode('utf-8')
-        return response if isinstance(response, str) else json.loads(response)
+    def put(self, endpoint, data, expected_status_codes, timeout=DEFAULT_TIMEOUT):
+        return self._send('put', endpoint, data, expected_status_codes, timeout)
 
-    def put(self, endpoint, data, expected_status_codes):
-        response = PUT_Request(proxies=self._proxy_dict, hostname=self._hostname, uri=endpoint,
-                           auth_method=self._auth_method, headers=self._headers, login_data=self._login_data,
-                           body=json.dumps(data), protocol=self._protocol, verify_ssl=False,
-                           expected_status_codes=expected_status_codes).response.content.decode('utf-8')
-        return response if isinstance(response, str) else json.loads(response)
+
+def merge_responses(responses):
+    """
+    Merge the responses of several endpoints into one response for the response template.
+    Dicts are merged key by key, other values of the same key are joined in the order of the responses.
+    """
+    if len(responses) == 1:
+        return responses[0]
+    if all(isinstance(response, dict) for response in responses):
+        keys = OrderedDict((key, None) for response in responses for key in response)
+        return {key: merge_responses([response[key] for response in responses if key in response]) for key in keys}
+    return ', '.join(str(response) for response in responses)
 
 
 class JsonTemplateClient:
@@ -73,13 +121,40 @@ class JsonTemplateClient:
         self._encoding = encoding
         self._replacement_regex = re.compile(r'({0}.*?{0})'.format(self._specifier))
         self.kwargs = kwargs
-        self.plugins = self._load_plugins()
+        self._plugins = None
         self.ticket = None
         self.sc_helper = kwargs.get('sc_helper', None)
         self.sc_username = kwargs.get('sc_username', None)
+        self.wait_strategy = WaitStrategy.from_conf(kwargs)
+        self._client = None
+        self._tickets = None
+        self._section_name = None
+        self._assignment = None
+
+    def _get_ticket(self, ticket_id):
+        if self._tickets is None:
+            self._tickets = TicketSnapshotCache(self.sc_helper)
+        return self._tickets.get(ticket_id)
+
+    def _invalidate_ticket(self, ticket_id):
+        if self._tickets is not None:
+            self._tickets.invalidate(ticket_id)
+
+    @property
+    def plugins(self):
+        """ The custom functions plugins, loaded on the first lookup of a function."""
+        if self._plugins is None:
+            self._plugins = self._load_plugins()
+        return self._plugins
 
     @property
     def client(self):
+        """ The REST client of the integration, built once per run."""
+        if self._client is None:
+            self._client = self._build_client()
+        return self._client
+
+    def _build_client(self):
         header = json.loads(self.kwargs.get('header', '{}').replace("'", '"'))
         if not header:
             header = {'Content-Type': 'application/json', 'Accept': 'application/json', 'charset': self._encoding}
@@ -106,21 +181,21 @@ class JsonTemplateClient:
             'verify_ssl': self.kwargs.get('verify_ssl', False),
             'auth_method': self.kwargs.get('auth_method', 'basic'),
             'proxy': self.kwargs.get('proxy', {}),
-            'header': header
+            'header': header,
+            'policy': get_http_policy(conf, self._section_name or 'integration setup')
         }
         return RestClient(**params)
 
-    def get_template(self, template_name):
+    def get_compiled_template(self, template_name):
         logger.debug("Loading template '{}' from '{}'".format(template_name, self._templates_root_dir))
         full_template_path = os.path.join(self._templates_root_dir, template_name)
-        try:
-            with open(full_template_path, encoding=self._encoding) as f:
-                try:
-                    return json.load(f)
-                except ValueError as e:
-                    raise IOError("Failed to load file as JSON. Error: '{}'".format(e))
-        except OSError as error:
-            raise IOError("Failed to read JSON template '{}'. Error: '{}'".format(template_name, error))
+        with phase('template_load'):
+            return load_compiled_template(full_template_path, self._replacement_regex, self._specifier,
+                                          self._encoding)
+
+    def get_template(self, template_name):
+        """ Get the JSON data of a template, the returned data is shared and must not be modified."""
+        return self.get_compiled_template(template_name).data
 
     def _get_fields_value(self, fields):
         values = []
@@ -170,141 +245,206 @@ class JsonTemplateClient:
                 string = method(ticket, string)
         return string
 
-    def _find_replacement(self, ticket, step_name, placeholder, string_to_replace):
-        ticket = self.sc_helper.get_ticket_by_id(ticket.id)
+    def _resolve_placeholder(self, ticket, step_name, placeholder):
+        """ Get the replacement of a placeholder, or the placeholder itself if it cannot be resolved.
+        :param placeholder: template_engine.Placeholder
+        """
+        ticket = self._get_ticket(ticket.id)
         ticket.sc_hostname = self.sc_helper.hostname
-        f, *func = self._get_sc_field_name_from_placeholder(placeholder).split('|')
+        f, func = placeholder.name, placeholder.funcs
         try:
             method = self._find_method(f.lower())
         except AttributeError:
             logger.debug(
-                "No placeholder function with place holder name '{}', trying field name".format(placeholder))
-            logger.info("Getting field value for placeholder '{}'".format(placeholder))
+                "No placeholder function with place holder name '{}', trying field name".format(placeholder.text))
+            logger.info("Getting field value for placeholder '{}'".format(placeholder.text))
+            field_index = TicketFieldIndex.for_ticket(ticket)
             if step_name:
                 logger.info("Parsing JSON template for step '{}'".format(step_name))
-                step = ticket.get_step_by_name(step_name)
-                fields = []
-                for task in step.tasks:
-                    fields.extend(task.get_field_list_by_name(f, case_sensitive=False))
+                fields = field_index.fields_named(f, step_name)
                 if fields:
-                    replace_string = self._apply_func_on_string(ticket, self._get_fields_value(fields), func)
-                    v = string_to_replace.replace(placeholder, replace_string)
-                else:
-                    logger.error("Step '{}' has no field '{}'".format(step_name, f))
-                    v = placeholder
+                    return self._apply_func_on_string(ticket, self._get_fields_value(fields), func)
+                logger.error("Step '{}' has no field '{}'".format(step_name, f))
+                return placeholder.text
             else:
                 logger.debug("Trying to find the field for placeholder '{}' in all of the steps".format(f))
-                for step in ticket.steps[::-1]:
-                    fields = []
-                    for task in step.tasks:
-                        fields.extend(task.get_field_list_by_name(f, case_sensitive=False))
-                    if fields:
-                        replace_string = self._apply_func_on_string(ticket, self._get_fields_value(fields), func)
-                        v = string_to_replace.replace(placeholder, replace_string)
-                        break
-                else:
-                    logger.error("Cannot find field name '{}' in ticket id '{}'".format(f, ticket.id))
-                    v = placeholder
+                fields = field_index.fields_named(f)
+                if fields:
+                    return self._apply_func_on_string(ticket, self._get_fields_value(fields), func)
+                logger.error("Cannot find field name '{}' in ticket id '{}'".format(f, ticket.id))
+                return placeholder.text
         else:
-            replace_string = self._apply_func_on_string(ticket, str(method(ticket)), func)
-            v = string_to_replace.replace(placeholder, replace_string)
-        return v
-
-    def _parse_json_template(self, ticket, step_name, json_data):
-        """ Parse JSON file template
-        :param ticket: SecureChange ticket object
-        :param step_name:  SecureChange step name
-        :param json_data: JSON data template
-        :param callback: a function for the place holder
-        :return: formatted JSON template
+            return self._apply_func_on_string(ticket, str(method(ticket)), func)
+
+    def _render_templates(self, ticket, step_name, *compiled_templates):
+        """ Render compiled templates, every distinct placeholder of all the templates is resolved once.
+        :return: A list with the output of each template
         """
         logger.info("Parsing JSON template")
-        for k, v in json_data.items():
-            if isinstance(v, dict):
-                self._parse_json_template(ticket, step_name, json_data=v)
-            elif isinstance(v, list):
-                for item in v:
-                    self._parse_json_template(ticket, step_name, json_data=item)
-            elif isinstance(v, str):
-                placeholders = self._replacement_regex.findall(v)
-                for placeholder in placeholders:
-                    v = self._find_replacement(ticket, step_name, placeholder, v)
-                    json_data[k] = v
-        return json_data
-
-    def _update_response(self, response, response_template):
-        logger.info("Updating response values in fields")
+        values = {}
+        for compiled_template in compiled_templates:
+            for text, placeholder in compiled_template.placeholders.items():
+                if text not in values:
+                    with metrics.timed(PLACEHOLDER_HISTOGRAM, placeholder=placeholder.name):
+                        values[text] = self._resolve_placeholder(ticket, step_name, placeholder)
+        return [compiled_template.render(values) for compiled_template in compiled_templates]
+
+    def _collect_response_values(self, response, response_template, values):
+        """ Map the values of a response to the names of the fields in the placeholders of the response template
+        :param values: dict of field name to value that is filled
+        """
         if isinstance(response, dict) and isinstance(response_template, dict):
             for key in response:
                 if key not in response_template:
                     logger.debug("Key '{}' has not been found in the response template, skipping".format(key))
                     continue
-                placeholders = self._update_response(response[key], response_template[key])
+                placeholders = self._collect_response_values(response[key], response_template[key], values)
 
                 if not placeholders:
                     logger.warning("No placeholders have been found for key '{}'".format(key))
                 else:
                     for placeholder in placeholders:
-                        field_name = placeholder.strip(self._specifier)
-                        step_task = self.ticket.get_last_task()
-                        try:
-                            field = step_task.get_field_list_by_name(field_name)[0]
-                        except IndexError as e:
-                            msg = "Field name '{}' could not be found in step name '{}'"
-                            logger.error(msg.format(field_name, self.ticket.get_last_step().name))
-                        else:
-                            field.set_field_value(response[key])
-                            try:
-                                self.sc_helper.put_field(field)
-                            except (ValueError, IOError) as error:
-                                msg = "Failed to update field name '{}' in ticket id '{}', Error: '{}'"
-                                logger.error(msg.format(field_name, self.ticket.id, error))
+                        values[placeholder.strip(self._specifier)] = response[key]
         else:
             placeholders = self._replacement_regex.findall(str(response_template))
             return placeholders
 
-    def send(self, http_method, endpoint, body, expected_status_codes):
+    def _update_response(self, response, response_template):
+        """ Write the values of the response to the fields of the last task with a single task update."""
+        logger.info("Updating response values in fields")
+        values = OrderedDict()
+        self._collect_response_values(response, response_template, values)
+        if not values:
+            return
+        ticket = self._get_ticket(self.ticket.id)
+        step_task = ticket.get_last_task()
+        fields = []
+        for field_name, value in values.items():
+            try:
+                field = step_task.get_field_list_by_name(field_name)[0]
+            except IndexError as e:
+                msg = "Field name '{}' could not be found in step name '{}'"
+                logger.error(msg.format(field_name, ticket.get_last_step().name))
+            else:
+                field.set_field_value(value)
+                fields.append(field)
+        if fields:
+            self._put_fields(ticket, step_task, fields)
+
+    def _put_fields(self, ticket, step_task, fields):
+        try:
+            self.sc_helper.put_task(step_task)
+        except (ValueError, IOError) as error:
+            msg = "Failed to update task id '{}' in ticket id '{}', updating the fields one by one. Error: '{}'"
+            logger.warning(msg.format(step_task.id, ticket.id, error))
+            for field in fields:
+                try:
+                    self.sc_helper.put_field(field)
+                except (ValueError, IOError) as error:
+                    msg = "Failed to update field name '{}' in ticket id '{}', Error: '{}'"
+                    logger.error(msg.format(field.name, ticket.id, error))
+        else:
+            logger.debug("Updated {} fields of task id '{}' in ticket id '{}'".format(
+                len(fields), step_task.id, ticket.id))
+        finally:
+            self._invalidate_ticket(ticket.id)
+
+    def send(self, http_method, endpoint, body, expected_status_codes, timeout=DEFAULT_TIMEOUT):
         """ Posting http request
         :param http_method: post or put
         :param endpoint: url path
         :param body: http payload
         :param expected_status_codes: http status code
+        :param timeout: seconds to wait for the response
         :return: None
         """
         logger.debug("Send JSON request: \nHTTP method: '{}'\n URL path: '{}'\n Body: '{}'".format(http_method, endpoint, body))
         method = getattr(self.client, http_method)
-        response = method(
-            endpoint=endpoint,
-            data=body,
-            expected_status_codes=expected_status_codes
-        )
+        with phase('send'):
+            response = method(
+                endpoint=endpoint,
+                data=body,
+                expected_status_codes=expected_status_codes,
+                timeout=timeout
+            )
         logger.debug("Endpoint '{}' response: {}".format(endpoint, response))
         return response
 
+    def fan_out(self, http_method, endpoints, body, expected_status_codes, workers=DEFAULT_FANOUT_WORKERS,
+                timeout=DEFAULT_TIMEOUT, success_threshold=DEFAULT_FANOUT_SUCCESS_THRESHOLD):
+        """ Send the same request to several endpoints concurrently
+        :param workers: Maximum number of requests sent at once
+        :param timeout: Seconds to wait for the response of each endpoint
+        :param success_threshold: Minimal share of the endpoints that must succeed
+        :return: The merged responses of the endpoints that succeeded
+        :raise IOError: If the share of endpoints that succeeded is lower than success_threshold
+        """
+        # Duplicate endpoints get a single request
+        endpoints = list(OrderedDict.fromkeys(endpoints))
+        workers = min(int(workers), len(endpoints))
+        timeout = float(timeout)
+        success_threshold = float(success_threshold)
+        logger.info("Sending request to {} endpoints with {} workers".format(len(endpoints), workers))
+        # Build the client before the workers use it
+        self.client
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='fanout') as executor:
+            futures = OrderedDict(
+                (endpoint, executor.submit(self.send, http_method, endpoint, body, expected_status_codes, timeout))
+                for endpoint in endpoints)
+        responses, errors = OrderedDict(), OrderedDict()
+        for endpoint, future in futures.items():
+            try:
+                responses[endpoint] = future.result()
+            except (IOError, ValueError) as error:
+                errors[endpoint] = error
+        for endpoint, error in errors.items():
+            logger.error("Request to endpoint '{}' failed. Error: '{}'".format(endpoint, error))
+        logger.info("Endpoints status: {} succeeded, {} failed".format(len(responses), len(errors)))
+        if not responses or len(responses) / len(endpoints) < success_threshold:
+            raise IOError("Request failed for {} of {} endpoints: {}".format(
+                len(errors), len(endpoints), ', '.join(errors)))
+        return merge_responses(list(responses.values()))
+
     def reassign_task(self, ticket):
         reassigned = False
-        ticket = self.sc_helper.get_ticket_by_id(ticket.id)
+        ticket = self._get_ticket(ticket.id)
         last_task = ticket.get_last_step().get_last_task()
         if last_task.is_waiting_to_be_assigned():
             self.sc_helper.reassign_task_by_username(last_task, self.sc_username, 'Reassigned by integration script')
-            ticket = self.sc_helper.get_ticket_by_id(ticket.id)
+            self._invalidate_ticket(ticket.id)
+            ticket = self._get_ticket(ticket.id)
             reassigned = True
         return reassigned, ticket
 
     def reverse_reassigned_ticket(self, ticket, reassigned):
         last_task = ticket.get_last_step().get_last_task()
         if reassigned:
-            ticket = self.sc_helper.get_ticket_by_id(ticket.id)
+            ticket = self._get_ticket(ticket.id)
             step = ticket.get_last_step()
             new_last_task = step.get_last_task()
             if last_task.id == new_last_task.id:
                 args = (ticket.workflow.id, step.name, new_last_task.name)
                 participant = self.sc_helper.get_participants_by_task(*args)[0]
                 self.sc_helper.reassign_task_by_username(new_last_task, participant, 'Reassigned by integration script')
+                self._invalidate_ticket(ticket.id)
+
+    def _assign_for_run(self, ticket):
+        """ Assign the last task to the integration user the first time the run needs to write to the ticket.
+        The assignment is reversed once, when the run ends.
+        """
+        if self._assignment is None:
+            self._assignment = self.reassign_task(ticket)
+        return self._assignment[1]
+
+    def _release_run_assignment(self):
+        if self._assignment is not None:
+            reassigned, ticket = self._assignment
+            self._assignment = None
+            self.reverse_reassigned_ticket(ticket, reassigned)
 
     def pre_post_operations(self, ticket, func_names, **kwargs):
         if func_names:
-            reassigned_status, ticket = self.reassign_task(ticket)
+            ticket = self._assign_for_run(ticket)
             last_method_status = None
             for func_name in func_names.replace(' ', '').split(','):
                 logger.info("Executing function '{}'".format(func_name))
@@ -321,9 +461,13 @@ class JsonTemplateClient:
                         logger.error("Cannot find post customized function '{}' in Functions".format(func_name))
                         return
                     logger.debug("The method '{}' was found in default functions".format(func_name))
-                last_method_status = method(ticket, **kwargs)
+                try:
+                    with metrics.timed(FUNCTION_HISTOGRAM, FUNCTION_ERRORS_COUNTER, function=func_name):
+                        last_method_status = method(ticket, **kwargs)
+                finally:
+                    # Functions may write to the ticket (put_field, put_task)
+                    self._invalidate_ticket(ticket.id)
 
-            self.reverse_reassigned_ticket(ticket, reassigned_status)
             return last_method_status
 
     def run(self, ticket, **kwargs):
@@ -335,40 +479,61 @@ class JsonTemplateClient:
         :return: None
         """
         self.ticket = ticket
-        do_not_send_request = self.pre_post_operations(ticket, kwargs.get('pre', ''), **kwargs)
+        self._client = None
+        self._section_name = kwargs.get('section_name')
+        self._tickets = TicketSnapshotCache(self.sc_helper)
+        self._tickets.seed(ticket)
+        self._assignment = None
+        ticket_history.clear_cache(ticket.id)
+        workflow_name = ticket.workflow.name
+        step_name = (self._section_name or '').replace("{}{}-".format(SECTION_PREFIX, workflow_name), '', 1)
+        with profiler.profile(ticket=ticket.id, workflow=workflow_name, step=step_name or None):
+            try:
+                self._run(ticket, **kwargs)
+            finally:
+                self._release_run_assignment()
+        logger.debug("Ticket snapshots for ticket id '{}': {}".format(ticket.id, self._tickets))
+        get_session_pool().log_metrics()
+        if self._client is not None and self._client.policy is not None:
+            self._client.policy.log_states()
+
+    def _run(self, ticket, **kwargs):
+        with phase('pre_functions'):
+            do_not_send_request = self.pre_post_operations(ticket, kwargs.get('pre', ''), **kwargs)
         try:
-            template = self.get_template(kwargs['request_template_name'])
+            template = self.get_compiled_template(kwargs['request_template_name'])
         except (IOError, KeyError) as e:
             logger.warning('Cannot get template')
         else:
             if not do_not_send_request:
                 status_codes = kwargs.get('expected_status_codes', '200, 201, 204').split(',')
                 expected_status_codes = [int(status) for status in status_codes if status]
-                json_data = self._parse_json_template(ticket, kwargs.get('step_name', None), template)
-                endpoint = kwargs['endpoint']
+                endpoint_template = CompiledTemplate(kwargs['endpoint'], self._replacement_regex, self._specifier)
+                json_data, endpoint = self._render_templates(ticket, kwargs.get('step_name', None), template,
+                                                             endpoint_template)
                 response_template = kwargs.get('response_template_name', None)
-                placeholders = self._replacement_regex.findall(endpoint)
-                for placeholder in placeholders:
-                    endpoint = self._find_replacement(ticket, kwargs.get('step_name', None), placeholder, endpoint)
                 endpoints = endpoint.replace(' ', '').split(',')
                 if len(endpoints) > 1:
-                    response = self.send(kwargs['http_method'], endpoints[0], json_data, expected_status_codes)
                     url = kwargs['endpoint'].split(self._specifier)[0]
-                    for id in endpoints[1:]:
-                        new_endpoint = "{}{}".format(url, id)
-                        response = self.send(kwargs['http_method'], new_endpoint, json_data, expected_status_codes)
+                    endpoints = endpoints[:1] + ["{}{}".format(url, id) for id in endpoints[1:]]
+                    response = self.fan_out(
+                        kwargs['http_method'], endpoints, json_data, expected_status_codes,
+                        workers=kwargs.get('fanout_workers', DEFAULT_FANOUT_WORKERS),
+                        timeout=kwargs.get('fanout_timeout', DEFAULT_TIMEOUT),
+                        success_threshold=kwargs.get('fanout_success_threshold', DEFAULT_FANOUT_SUCCESS_THRESHOLD))
                 else:
                     response = self.send(kwargs['http_method'], endpoint, json_data, expected_status_codes)
                 if response_template:
-                    reassigned_status, ticket = self.reassign_task(ticket)
                     try:
                         response_json_template = self.get_template(response_template)
                     except IOError as e:
                         logger.error(e)
                     else:
-                        self._update_response(response, response_json_template)
-                    self.reverse_reassigned_ticket(ticket, reassigned_status)
-            self.pre_post_operations(ticket, kwargs.get('post', ''), **kwargs)
+                        with phase('response_write'):
+                            self._assign_for_run(ticket)
+                            self._update_response(response, response_json_template)
+            with phase('post_functions'):
+                self.pre_post_operations(ticket, kwargs.get('post', ''), **kwargs)
 
     def handle_action(self, ticket, action):
         logger.info("In handle_action for ticket id '{}' and action '{}'".format(ticket.id, str(action)))
@@ -399,7 +564,8 @@ class JsonTemplateClient:
             return None
 
         previous_ticket_last_step_name = ticket.get_last_step().name
-        ticket = self.sc_helper.get_ticket_by_id(ticket.id, predicate=Ticket.has_no_pending_tasks)
+        ticket = wait_for_no_pending_tasks(self.sc_helper, ticket.id, self.wait_strategy,
+                                           workflow=ticket.workflow.name, step=previous_ticket_last_step_name)
         section_name_template = 'integration {}-{}'
         try:
             current_step_name = ticket.get_current_step().name
@@ -441,6 +607,7 @@ class JsonTemplateClient:
     @staticmethod
     def _load_plugins():
         plugins = {}
+        plugins_root_dir = conf.get(SECURE_STORE_KEY, 'plugins_root_dir', default_value=DEFAULT_PLUGINS_ROOT_DIR)
         py_search = re.compile('custom_functions.py$', re.IGNORECASE)
         try:
             plugin_files = filter(py_search.search, os.listdir(plugins_root_dir))
@@ -0,0 +1,113 @@
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+from pytos.common.logging.definitions import THIRD_PARTY_LOGGER_NAME
+
+logger = logging.getLogger(THIRD_PARTY_LOGGER_NAME)
+
+# text: the placeholder as written in the template, e.g. '#Field Name|func#'
+# name: the field or placeholder function name, e.g. 'Field Name'
+# funcs: the functions the value is piped to, e.g. ['func']
+Placeholder = namedtuple('Placeholder', ['text', 'name', 'funcs'])
+
+_VALUE, _DICT, _LIST, _SLOT = range(4)
+
+
+class CompiledTemplate:
+    """
+    A JSON template compiled into a rendering plan.
+    Strings that contain placeholders are split once into literal parts and placeholders, so rendering resolves every
+    distinct placeholder once and builds the output in a single walk, however many times a placeholder is used.
+    """
+
+    def __init__(self, data, replacement_regex, specifier='#'):
+        """
+        :param data: The loaded JSON template, or a plain string
+        :param replacement_regex: Compiled regex with one group that matches a placeholder including the specifiers
+        :param specifier: The sign that wraps the placeholders
+        """
+        self.data = data
+        self._regex = replacement_regex
+        self._specifier = specifier
+        self.placeholders = OrderedDict()
+        self.slot_paths = []
+        self._plan = self._compile(data, ())
+
+    def _compile(self, node, path):
+        if isinstance(node, dict):
+            return _DICT, [(key, self._compile(value, path + (key,))) for key, value in node.items()]
+        elif isinstance(node, list):
+            return _LIST, [self._compile(item, path + (index,)) for index, item in enumerate(node)]
+        elif isinstance(node, str):
+            parts = self._regex.split(node)
+            if len(parts) == 1:
+                return _VALUE, node
+            # re.split with a capturing group puts the placeholders at the odd indexes
+            for text in parts[1::2]:
+                if text not in self.placeholders:
+                    name, *funcs = text.strip(self._specifier).split('|')
+                    self.placeholders[text] = Placeholder(text, name, funcs)
+            self.slot_paths.append(path)
+            return _SLOT, parts
+        return _VALUE, node
+
+    def render(self, values):
+        """
+        Build the output of the template.
+        :param values: A dict of placeholder text to its replacement, missing placeholders are left as is
+        :return: A new JSON structure, or a string if the template is a string
+        """
+        return self._render(self._plan, values)
+
+    def _render(self, plan, values):
+        kind, content = plan
+        if kind == _DICT:
+            return {key: self._render(child, values) for key, child in content}
+        elif kind == _LIST:
+            return [self._render(child, values) for child in content]
+        elif kind == _SLOT:
+            return ''.join(part if index % 2 == 0 else values.get(part, part) for index, part in enumerate(content))
+        return content
+
+
+_templates_cache = {}
+_templates_cache_lock = threading.Lock()
+
+
+def load_compiled_template(template_path, replacement_regex, specifier='#', encoding='utf-8'):
+    """
+    Load and compile a JSON template, compiled templates are cached by path and kept until the file changes.
+    :raise IOError: If the file cannot be read or is not valid JSON
+    """
+    try:
+        stat = os.stat(template_path)
+    except OSError as error:
+        raise IOError("Failed to read JSON template '{}'. Error: '{}'".format(template_path, error))
+    cache_key = (template_path, replacement_regex.pattern, specifier)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    with _templates_cache_lock:
+        try:
+            cached_signature, compiled = _templates_cache[cache_key]
+        except KeyError:
+            pass
+        else:
+            if cached_signature == signature:
+                return compiled
+
+    logger.debug("Compiling template '{}'".format(template_path))
+    try:
+        with open(template_path, encoding=encoding) as f:
+            content = f.read()
+    except OSError as error:
+        raise IOError("Failed to read JSON template '{}'. Error: '{}'".format(template_path, error))
+    try:
+        data = json.loads(content)
+    except ValueError as e:
+        raise IOError("Failed to load file as JSON. Error: '{}'".format(e))
+    compiled = CompiledTemplate(data, replacement_regex, specifier)
+    with _templates_cache_lock:
+        _templates_cache[cache_key] = signature, compiled
+    return compiled
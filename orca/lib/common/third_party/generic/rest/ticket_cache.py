@@ -0,0 +1,49 @@
+import logging
+
+from pytos.common.logging.definitions import THIRD_PARTY_LOGGER_NAME
+
+logger = logging.getLogger(THIRD_PARTY_LOGGER_NAME)
+
+
+class TicketSnapshotCache:
+    """
+    Tickets fetched from SecureChange during a single run of the integration.
+    A ticket is downloaded once and served from the cache until it is invalidated, which must be done after every
+    write the integration makes to the ticket (put_field, put_task, reassign_task_by_username).
+    """
+
+    def __init__(self, sc_helper):
+        self._sc_helper = sc_helper
+        self._tickets = {}
+        self._invalidated = set()
+        self.hits = 0
+        self.fetches = 0
+        self.refetches = 0
+
+    def seed(self, ticket):
+        """ Add a ticket that was just fetched by the caller."""
+        self._tickets[ticket.id] = ticket
+
+    def get(self, ticket_id):
+        try:
+            ticket = self._tickets[ticket_id]
+        except KeyError:
+            pass
+        else:
+            self.hits += 1
+            return ticket
+
+        self.fetches += 1
+        if ticket_id in self._invalidated:
+            self.refetches += 1
+            self._invalidated.discard(ticket_id)
+        logger.debug("Fetching ticket id '{}'".format(ticket_id))
+        ticket = self._tickets[ticket_id] = self._sc_helper.get_ticket_by_id(ticket_id)
+        return ticket
+
+    def invalidate(self, ticket_id):
+        if self._tickets.pop(ticket_id, None) is not None:
+            self._invalidated.add(ticket_id)
+
+    def __str__(self):
+        return "{} hits, {} fetches, {} refetches after writes".format(self.hits, self.fetches, self.refetches)
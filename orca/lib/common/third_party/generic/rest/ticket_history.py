@@ -0,0 +1,53 @@
+import logging
+import threading
+
+from pytos.common.logging.definitions import THIRD_PARTY_LOGGER_NAME
+
+logger = logging.getLogger(THIRD_PARTY_LOGGER_NAME)
+
+AUTOMATIC_STEP_FAILED = 'Automatic step failed'
+
+
+class TicketHistory:
+    """
+    The history of a ticket with the values used by the placeholders computed once.
+    """
+
+    def __init__(self, ticket_id, histories):
+        self.ticket_id = ticket_id
+        self.entries = list(histories)
+        self.start_time = self.entries[0].as_time_obj() if self.entries else None
+        self.end_time = self.entries[-1].as_time_obj() if self.entries else None
+        self.automatic_step_failures = [history for history in self.entries
+                                        if AUTOMATIC_STEP_FAILED in history.description]
+
+    @property
+    def last_automatic_step_failure(self):
+        return self.automatic_step_failures[-1] if self.automatic_step_failures else None
+
+
+_histories = {}
+_histories_lock = threading.Lock()
+
+
+def get_ticket_history(sc_helper, ticket_id):
+    """
+    Get the history of a ticket, it is fetched from SecureChange once until clear_cache is called.
+    """
+    with _histories_lock:
+        try:
+            return _histories[ticket_id]
+        except KeyError:
+            pass
+    logger.debug("Fetching history of ticket id '{}'".format(ticket_id))
+    history = TicketHistory(ticket_id, sc_helper.get_ticket_history_by_id(ticket_id))
+    with _histories_lock:
+        return _histories.setdefault(ticket_id, history)
+
+
+def clear_cache(ticket_id=None):
+    with _histories_lock:
+        if ticket_id is None:
+            _histories.clear()
+        else:
+            _histories.pop(ticket_id, None)
@@ -0,0 +1,80 @@
+import logging
+
+from pytos.common.logging.definitions import THIRD_PARTY_LOGGER_NAME
+
+logger = logging.getLogger(THIRD_PARTY_LOGGER_NAME)
+
+
+class TicketFieldIndex:
+    """
+    Index of the fields of a ticket, shared by the placeholders and functions that run on the same ticket object.
+    Field names are indexed in one pass over all the tasks of all the steps. Field types are indexed on the first
+    lookup of each type over the last task of every step, the same tasks the placeholders always looked at.
+    """
+    ATTRIBUTE_NAME = '_field_index'
+
+    def __init__(self, ticket):
+        self._ticket = ticket
+        self._steps = list(ticket.steps)
+        self._step_by_name = {}
+        self._latest_fields_by_name = {}
+        self._fields_by_step_and_name = {}
+        self._fields_by_type = {}
+        for step in self._steps:
+            step_fields = {}
+            for task in step.tasks:
+                for field in task.fields:
+                    step_fields.setdefault(field.name.lower(), []).append(field)
+            self._latest_fields_by_name.update(step_fields)
+            # Like Ticket.get_step_by_name, the first step with a name is the one used
+            if step.name not in self._step_by_name:
+                self._step_by_name[step.name] = step
+                for name, fields in step_fields.items():
+                    self._fields_by_step_and_name[(step.name, name)] = fields
+
+    @classmethod
+    def for_ticket(cls, ticket):
+        """ Get the index of a ticket object, the index is built on the first call and kept on the ticket."""
+        index = getattr(ticket, cls.ATTRIBUTE_NAME, None)
+        if index is None or index._ticket is not ticket:
+            index = cls(ticket)
+            setattr(ticket, cls.ATTRIBUTE_NAME, index)
+        return index
+
+    def fields_of_type(self, field_type):
+        """
+        :return: The first field of the type in the last task of each step, from the latest step to the first one
+        """
+        try:
+            return self._fields_by_type[field_type]
+        except KeyError:
+            pass
+        fields = []
+        for step in self._steps[::-1]:
+            task = step.get_last_task()
+            try:
+                fields.append(task.get_field_list_by_type(field_type)[0])
+            except IndexError:
+                continue
+        self._fields_by_type[field_type] = fields
+        return fields
+
+    def latest_field_of_type(self, field_type):
+        """
+        :return: The field of the type from the latest step that has one, or None
+        """
+        fields = self.fields_of_type(field_type)
+        return fields[0] if fields else None
+
+    def fields_named(self, name, step_name=None):
+        """
+        Get fields by name, case insensitive.
+        :param step_name: The step to look in, if not set the latest step that has fields with that name is used
+        :return: The fields with that name in all of the tasks of the step
+        """
+        if step_name is None:
+            return self._latest_fields_by_name.get(name.lower(), [])
+        return self._fields_by_step_and_name.get((step_name, name.lower()), [])
+
+    def step_by_name(self, step_name):
+        return self._step_by_name.get(step_name)
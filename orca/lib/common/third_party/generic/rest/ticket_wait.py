@@ -0,0 +1,98 @@
+import logging
+import time
+import xml.etree.ElementTree as ET
+
+from pytos.common.exceptions import REST_HTTP_Exception
+from pytos.common.logging.definitions import THIRD_PARTY_LOGGER_NAME
+from pytos.securechange.xml_objects.rest import Ticket
+
+from common import metrics
+
+logger = logging.getLogger(THIRD_PARTY_LOGGER_NAME)
+
+CURRENT_STEP_URI = "/securechangeworkflow/api/securechange/tickets/{}/steps/current"
+PENDING_STATUS = 'PENDING'
+WAIT_HISTOGRAM_NAME = 'ticket_wait_seconds'
+
+
+class TicketNotReadyError(ValueError):
+    pass
+
+
+class WaitStrategy:
+    """
+    Delays between checks of a ticket: an initial delay multiplied by backoff after every check, up to max_interval
+    between checks and max_time in total.
+    """
+
+    def __init__(self, initial_delay=1.0, backoff=2.0, max_interval=30.0, max_time=250.0):
+        self.initial_delay = float(initial_delay)
+        self.backoff = max(float(backoff), 1.0)
+        self.max_interval = float(max_interval)
+        self.max_time = float(max_time)
+
+    @classmethod
+    def from_conf(cls, conf_data):
+        """
+        :param conf_data: dict of the integration setup section
+        """
+        return cls(
+            initial_delay=conf_data.get('wait_initial_delay', 1),
+            backoff=conf_data.get('wait_backoff', 2),
+            max_interval=conf_data.get('wait_max_interval', 30),
+            max_time=conf_data.get('wait_max_time', 250),
+        )
+
+    def delays(self):
+        total, delay = 0.0, self.initial_delay
+        while total + delay <= self.max_time:
+            yield delay
+            total += delay
+            delay = min(delay * self.backoff, self.max_interval)
+
+
+def probe_pending_tasks(sc_helper, ticket_id):
+    """
+    Check the tasks of the current step without downloading the whole ticket.
+    :return: True or False, or None if the current step could not be checked
+    """
+    try:
+        response = sc_helper.get_uri(CURRENT_STEP_URI.format(ticket_id), expected_status_codes=200).response.content
+        statuses = [task.findtext('status') for task in ET.fromstring(response).iter('task')]
+    except (REST_HTTP_Exception, ValueError, IOError, ET.ParseError) as error:
+        logger.debug("Failed to get the current step of ticket id '{}'. Error: '{}'".format(ticket_id, error))
+        return None
+    if not statuses:
+        return None
+    return PENDING_STATUS in statuses
+
+
+def wait_for_no_pending_tasks(sc_helper, ticket_id, strategy, workflow='', step=''):
+    """
+    Wait until no task of the current step of a ticket is pending.
+    The wait time of every call is recorded in the ticket_wait_seconds histogram of the workflow and step.
+    :return: The ticket
+    :raise TicketNotReadyError: If there are still pending tasks after strategy.max_time seconds
+    """
+    start_time = time.monotonic()
+    checks = 0
+    for delay in [0] + list(strategy.delays()):
+        time.sleep(delay)
+        checks += 1
+        pending = probe_pending_tasks(sc_helper, ticket_id)
+        if pending:
+            continue
+        ticket = sc_helper.get_ticket_by_id(ticket_id)
+        if pending is None and not Ticket.has_no_pending_tasks(ticket):
+            continue
+        waited = time.monotonic() - start_time
+        metrics.histogram(WAIT_HISTOGRAM_NAME, workflow=workflow, step=step).observe(waited)
+        logger.info("Ticket id '{}' has no pending tasks after {:.1f} seconds and {} checks".format(
+            ticket_id, waited, checks))
+        return ticket
+
+    waited = time.monotonic() - start_time
+    metrics.histogram(WAIT_HISTOGRAM_NAME, workflow=workflow, step=step).observe(waited)
+    msg = "Ticket id '{}' still has pending tasks after {:.1f} seconds and {} checks".format(ticket_id, waited, checks)
+    logger.warning(msg)
+    raise TicketNotReadyError(msg)
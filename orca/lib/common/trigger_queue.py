@@ -0,0 +1,193 @@
+import fcntl
+import logging
+import os
+import sqlite3
+import time
+from collections import namedtuple
+from contextlib import closing
+
+from pytos.common.logging.definitions import COMMON_LOGGER_NAME
+
+logger = logging.getLogger(COMMON_LOGGER_NAME)
+
+DEFAULT_QUEUE_PATH = '/usr/local/orca/var/trigger_queue.db'
+PENDING = 'pending'
+RUNNING = 'running'
+
+QueuedTrigger = namedtuple('QueuedTrigger', ['id', 'ticket_id', 'trigger', 'prev_step_name', 'enqueued_at', 'attempts'])
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS triggers (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ticket_id INTEGER NOT NULL,
+    trigger_action TEXT NOT NULL,
+    prev_step_name TEXT NOT NULL DEFAULT '',
+    state TEXT NOT NULL,
+    enqueued_at REAL NOT NULL,
+    available_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (ticket_id, trigger_action, prev_step_name, state)
+);
+CREATE INDEX IF NOT EXISTS triggers_available ON triggers (state, available_at);
+"""
+
+
+class TriggerQueue:
+    """
+    Durable queue of SecureChange triggers, stored in SQLite so it can be shared by the script invocations of
+    SecureChange and a long-lived worker.
+    A trigger that is already pending for the same ticket, action and previous step is coalesced with the pending
+    one. Triggers of a ticket are handed out one at a time, in the order they were enqueued.
+    A single worker process handles a queue, it holds a lock file next to the queue database.
+    """
+
+    def __init__(self, path=DEFAULT_QUEUE_PATH, timeout=30):
+        self.path = path
+        self.timeout = timeout
+        self._worker_lock_file = None
+        queue_dir = os.path.dirname(path)
+        if queue_dir:
+            os.makedirs(queue_dir, exist_ok=True)
+        with closing(self._connect()) as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(_SCHEMA)
+
+    def _connect(self):
+        # Autocommit mode, transactions that need it are opened explicitly
+        return sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+
+    def lock_worker(self):
+        """
+        Take the worker lock of the queue, it is held until the process exits.
+        :raise IOError: If another worker process holds the lock
+        """
+        if self._worker_lock_file is not None:
+            return
+        lock_file = open(self.path + '.worker.lock', 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            raise IOError("Another worker is handling the triggers of the queue '{}'".format(self.path))
+        self._worker_lock_file = lock_file
+
+    @staticmethod
+    def _remove_pending_duplicates(connection, running_condition, params):
+        """
+        Remove the pending triggers that are identical to the running ones matching running_condition, so the running
+        ones can become pending again and keep their place in the queue.
+        :return: The smallest available_at of the removed triggers of each running one, by running trigger id
+        """
+        duplicates = connection.execute(
+            "SELECT running.id, pending.id, pending.available_at FROM triggers AS running "
+            "JOIN triggers AS pending ON pending.ticket_id = running.ticket_id "
+            "AND pending.trigger_action = running.trigger_action AND pending.prev_step_name = running.prev_step_name "
+            "WHERE pending.state = ? AND running.state = ? AND " + running_condition,
+            (PENDING, RUNNING) + tuple(params)).fetchall()
+        available_at = {}
+        for running_id, pending_id, pending_available_at in duplicates:
+            connection.execute("DELETE FROM triggers WHERE id = ?", (pending_id,))
+            available_at[running_id] = min(pending_available_at, available_at.get(running_id, pending_available_at))
+        return available_at
+
+    def enqueue(self, ticket_id, trigger, prev_step_name=None, delay=0):
+        """
+        :return: True if the trigger was added, False if it was coalesced with a pending one
+        """
+        now = time.time()
+        with closing(self._connect()) as connection:
+            cursor = connection.execute(
+                "INSERT OR IGNORE INTO triggers "
+                "(ticket_id, trigger_action, prev_step_name, state, enqueued_at, available_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (ticket_id, trigger, prev_step_name or '', PENDING, now, now + delay))
+            added = cursor.rowcount == 1
+        if not added:
+            logger.info("Trigger '{}' of ticket id '{}' is already queued".format(trigger, ticket_id))
+        return added
+
+    def claim(self):
+        """
+        Take the oldest available trigger of a ticket that has no running trigger.
+        :return: QueuedTrigger or None if there is nothing to do
+        """
+        now = time.time()
+        with closing(self._connect()) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = connection.execute(
+                    "SELECT id, ticket_id, trigger_action, prev_step_name, enqueued_at, attempts FROM triggers "
+                    "WHERE state = ? AND available_at <= ? AND ticket_id NOT IN "
+                    "(SELECT ticket_id FROM triggers WHERE state = ?) ORDER BY id LIMIT 1",
+                    (PENDING, now, RUNNING)).fetchone()
+                if row is not None:
+                    connection.execute("UPDATE triggers SET state = ?, attempts = attempts + 1 WHERE id = ?",
+                                       (RUNNING, row[0]))
+                connection.execute("COMMIT")
+            except sqlite3.Error:
+                connection.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        item_id, ticket_id, trigger, prev_step_name, enqueued_at, attempts = row
+        return QueuedTrigger(item_id, ticket_id, trigger, prev_step_name or None, enqueued_at, attempts + 1)
+
+    def complete(self, item):
+        with closing(self._connect()) as connection:
+            connection.execute("DELETE FROM triggers WHERE id = ?", (item.id,))
+
+    def retry(self, item, delay, count_attempt=True):
+        """
+        Make a claimed trigger available again after delay seconds. If the same trigger was enqueued again meanwhile
+        it is coalesced into the claimed one, which keeps its place before the triggers of the ticket enqueued later.
+        :param count_attempt: If False the claim is not counted as an attempt, for triggers that were not ready
+        """
+        with closing(self._connect()) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                available_at = time.time() + delay
+                duplicate_available_at = self._remove_pending_duplicates(connection, "running.id = ?", (item.id,))
+                available_at = min(available_at, duplicate_available_at.get(item.id, available_at))
+                connection.execute(
+                    "UPDATE triggers SET state = ?, available_at = ?, attempts = attempts - ? WHERE id = ?",
+                    (PENDING, available_at, 0 if count_attempt else 1, item.id))
+                connection.execute("COMMIT")
+            except sqlite3.Error:
+                connection.execute("ROLLBACK")
+                raise
+
+    def recover(self):
+        """
+        Make the triggers that were running when a previous worker stopped available again. Only the worker that
+        holds the worker lock recovers them, a running trigger is never recovered while its worker is alive.
+        :return: The number of recovered triggers
+        :raise IOError: If another worker process holds the lock
+        """
+        self.lock_worker()
+        with closing(self._connect()) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                # Triggers enqueued again while running are coalesced into the running ones, which keep their place
+                self._remove_pending_duplicates(connection, "1 = 1", ())
+                cursor = connection.execute("UPDATE triggers SET state = ? WHERE state = ?", (PENDING, RUNNING))
+                recovered = cursor.rowcount
+                connection.execute("COMMIT")
+            except sqlite3.Error:
+                connection.execute("ROLLBACK")
+                raise
+        if recovered:
+            logger.info("Recovered {} triggers that were interrupted".format(recovered))
+        return recovered
+
+    def metrics(self):
+        """
+        :return: dict with the number of pending and running triggers and the age in seconds of the oldest pending one
+        """
+        with closing(self._connect()) as connection:
+            counts = dict(connection.execute("SELECT state, COUNT(*) FROM triggers GROUP BY state").fetchall())
+            oldest = connection.execute("SELECT MIN(enqueued_at) FROM triggers WHERE state = ?",
+                                        (PENDING,)).fetchone()[0]
+        return {
+            'depth': counts.get(PENDING, 0),
+            'running': counts.get(RUNNING, 0),
+            'oldest_age': round(time.time() - oldest, 3) if oldest is not None else 0,
+        }